@@ -1,42 +1,176 @@
-from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context, send_from_directory
-from email_workflow import generate_email_content, modify_email_content, send_email
+import time
+# Measured from here, so /api/health can report the import time and time-to-ready
+_import_started = time.perf_counter()
+
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context, send_from_directory, g
+from email_workflow import (generate_email_content, modify_email_content, send_email,
+                            stream_email_content, stream_modified_email_content, parse_email_content)
 from intent_detection import detect_user_intent
-from chat_processing import process_general_chat
+from chat_processing import process_general_chat, stream_general_chat, SpeculativeChat
+from conversation_memory import new_conversation
 from data_analysis import read_data_file, generate_data_insights, format_analysis_output
-from vlm_agent import BreastMRIAnalyzer
 import os
+import sys
 from werkzeug.utils import secure_filename
-import time
 import json
+import logging
+import importlib
+import multiprocessing
+from functools import partial
+import uuid
+import threading
+from job_queue import JobQueue, QueueFullError
+from session_store import create_session_store
+from upload_store import UploadStore, UploadTooLarge, MAX_UPLOAD_BYTES, measure_peak_memory
+import tracemalloc
+import llm_client
+import metrics
+from warmup import Warmup, WARMUP_ON_START
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# The chart and workbook pools spawn worker processes, which re-import this module as
+# __mp_main__ when the app runs as a script; only the serving process has startup side effects
+IN_WORKER_PROCESS = multiprocessing.parent_process() is not None
+
 # Configure upload folder
 UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Requests with a larger Content-Length are refused with 413 before the body is read
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+upload_store = UploadStore(UPLOAD_FOLDER, max_bytes=MAX_UPLOAD_BYTES)
+
+# Opt-in: log the peak heap allocation of each upload request
+if os.environ.get('UPLOAD_MEMORY_PROFILE', '0') == '1' and not IN_WORKER_PROCESS and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+# The VLM agent (PIL, numpy, pydicom) is created on first use or by the startup warm-up
+_mri_analyzer = None
+_mri_analyzer_lock = threading.Lock()
+
+def get_mri_analyzer():
+    """Return the shared BreastMRIAnalyzer, creating it on first use."""
+    global _mri_analyzer
+    if _mri_analyzer is None:
+        with _mri_analyzer_lock:
+            if _mri_analyzer is None:
+                from vlm_agent import BreastMRIAnalyzer
+                _mri_analyzer = BreastMRIAnalyzer()
+    return _mri_analyzer
+
+# Background pool for image analysis so slow VLM calls do not block request workers
+app.config['ANALYSIS_WORKERS'] = int(os.environ.get('ANALYSIS_WORKERS', 2))
+app.config['ANALYSIS_MAX_PENDING'] = int(os.environ.get('ANALYSIS_MAX_PENDING', 16))
+analysis_jobs = JobQueue(max_workers=app.config['ANALYSIS_WORKERS'],
+                         max_pending=app.config['ANALYSIS_MAX_PENDING'])
 
+# Per-session state, keyed by a cookie. SESSION_BACKEND=sqlite shares state between
+# worker processes; the default in-memory store is per process.
+SESSION_COOKIE = 'frobe_session'
+session_store = create_session_store(os.environ.get('SESSION_BACKEND', 'memory'),
+                                     os.environ.get('SESSION_DIR', 'sessions'))
 
-# Initialize the VLM agent
-mri_analyzer = BreastMRIAnalyzer()
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.start_trace()
 
-# Global state (in a real app, use a proper database)
-app_state = {
-    'mode': 'chat',
-    'email_stage': None,
-    'generated_email': None,
-    'last_response': '',
-    'current_data': None,  # Store current data for analysis
-    'current_image': None  # Store current image for analysis
+@app.after_request
+def record_request_metrics(response):
+    # Registered before save_session, so it runs after it and the session save is included
+    elapsed = time.perf_counter() - g.request_started
+    metrics.HTTP_SECONDS.observe(elapsed, endpoint=request.endpoint or 'unmatched', method=request.method,
+                                 status=response.status_code)
+    entries = metrics.end_trace()
+    if metrics.SERVER_TIMING:
+        response.headers['Server-Timing'] = metrics.server_timing(entries, elapsed)
+    return response
+
+@app.before_request
+def load_session():
+    if request.endpoint == 'static':
+        return
+    session_id = request.cookies.get(SESSION_COOKIE)
+    g.new_session = not session_id
+    g.session_id = session_id or uuid.uuid4().hex
+    with metrics.timed('session_load'):
+        g.state = session_store.load(g.session_id)
+
+@app.after_request
+def save_session(response):
+    if 'state' not in g:
+        return response
+    # Streaming views save their state when the stream finishes
+    if not response.is_streamed:
+        with metrics.timed('session_save'):
+            session_store.save(g.session_id, g.state)
+    if g.new_session:
+        response.set_cookie(SESSION_COOKIE, g.session_id, httponly=True, samesite='Lax')
+    return response
+
+# Opt-in: start general chat generation alongside intent detection and cancel it
+# if the message turns out to need another workflow
+app.config['SPECULATIVE_CHAT'] = os.environ.get('SPECULATIVE_CHAT', '0') == '1'
+
+def save_stream_state(session_id, state, before, owned=()):
+    """
+    Merge the keys a streaming view changed since `before` (a dict.copy of `state` taken when
+    the request started), plus the `owned` keys it mutated in place, into the stored session.
+    Other requests may have saved the session while the stream was open, so the stream's
+    stale copy of the remaining keys must not overwrite theirs.
+    """
+    changed = {key: dict.__getitem__(state, key) for key in state
+               if key in owned or key not in before or dict.__getitem__(state, key) is not before[key]}
+    if changed:
+        session_store.update(session_id, lambda stored: stored.update(changed))
+
+def get_conversation(state):
+    """The session's general chat history, created on first use."""
+    if state.get('conversation') is None:
+        state['conversation'] = new_conversation()
+    return state['conversation']
+
+def resolve_intent(user_input, conversation=None):
+    """
+    Detect the intent, speculatively generating the chat reply in parallel when enabled.
+    Returns (intent, speculation); speculation is a running SpeculativeChat for 'normal'
+    messages in speculative mode and None otherwise.
+    """
+    if not app.config['SPECULATIVE_CHAT']:
+        return detect_user_intent(user_input), None
+    # Rules, cache and k-NN answer in microseconds; only speculate when the LLM is needed
+    intent = detect_user_intent(user_input, allow_llm=False)
+    if intent is not None:
+        return intent, None
+    speculation = SpeculativeChat(user_input, conversation)
+    intent = detect_user_intent(user_input)
+    if intent != 'normal':
+        speculation.cancel()
+        return intent, None
+    return intent, speculation
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'  # Stop reverse proxies from buffering the stream
 }
 
+def sse_event(payload):
+    """Encode a payload as one server-sent event."""
+    return 'data: ' + json.dumps(payload) + '\n\n'
+
 @app.route('/')
 def home():
     return render_template('index.html')
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
+    state = g.state
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
     
@@ -44,61 +178,132 @@ def upload_file():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
 
-    if file:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+    with measure_peak_memory(f"Upload {file.filename}"):
+        return handle_upload(state, file)
 
-        # Check file type and process accordingly
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.dicom')):
-            # Handle image file
-            try:
-                with open(filepath, 'rb') as img_file:
-                    image_data = img_file.read()
-                analysis = mri_analyzer.analyze_mri_scan(image_data)
-                app_state['current_image'] = image_data
-                app_state['last_response'] = format_image_analysis(analysis)
-                return jsonify({
-                    'response': app_state['last_response'],
-                    'mode': 'analyze_image'
-                })
-            except Exception as e:
-                return jsonify({
-                    'error': f'Error processing image: {str(e)}'
-                }), 400
-        elif filename.endswith(('.csv', '.xlsx', '.xls')):
-            # Handle data file
-            success, result = read_data_file(filepath)
-            if success:
-                app_state['current_data'] = result
-                insights = generate_data_insights(result)
-                formatted_output = format_analysis_output(insights)
-                app_state['last_response'] = formatted_output
-                return jsonify({
-                    'response': formatted_output,
-                    'mode': 'data_analysis'
-                })
-            else:
-                return jsonify({
-                    'error': f'Error processing file: {result}'
-                }), 400
+def handle_upload(state, file):
+    """Store an upload and start its image analysis or data analysis."""
+    filename = secure_filename(file.filename)
+    # Copied in chunks, hashed while written and stored under its content hash
+    try:
+        upload = upload_store.save(file.stream, filename)
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    filepath = upload.path
 
-        return jsonify({
-            'response': f'File uploaded successfully: {filename}',
-            'mode': 'chat'
-        })
+    # Check file type and process accordingly
+    if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.dicom', '.dcm', '.zip')):
+        # Handle image file
+        try:
+            # Identical images already being analyzed share the running job
+            job, _ = analysis_jobs.submit(upload.sha256, lambda job: run_image_analysis(job, upload))
+            # Keep a reference to the stored file, not its bytes
+            state['current_image'] = upload
+            return jsonify({
+                'job_id': job.id,
+                'status': job.status,
+                'mode': 'analyze_image'
+            }), 202
+        except QueueFullError as e:
+            return jsonify({
+                'error': f'Server is busy, please retry shortly. ({str(e)})'
+            }), 503, {'Retry-After': '10'}
+        except Exception as e:
+            return jsonify({
+                'error': f'Error processing image: {str(e)}'
+            }), 400
+    elif filename.endswith(('.csv', '.xlsx', '.xls')):
+        # Handle data file
+        success, result = read_data_file(filepath)
+        if success:
+            state['current_data'] = result
+            insights = generate_data_insights(result)
+            formatted_output = format_analysis_output(insights)
+            state['last_response'] = formatted_output
+            return jsonify({
+                'response': formatted_output,
+                'mode': 'data_analysis',
+                'charts': insights.get('charts', [])
+            })
+        else:
+            return jsonify({
+                'error': f'Error processing file: {result}'
+            }), 400
+
+    return jsonify({
+        'response': f'File uploaded successfully: {filename}',
+        'mode': 'chat'
+    })
+
+def run_image_analysis(job, upload):
+    """Job body: analyze the stored image, reporting model output as progress."""
+    with metrics.timed('mri_analysis'):
+        analysis = get_mri_analyzer().analyze_mri_scan(upload.path, on_token=job.report)
+    return {'response': format_image_analysis(analysis), 'mode': 'analyze_image'}
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'error': f'File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit'}), 413
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    job = analysis_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job.status == 'done':
+        g.state['last_response'] = job.result['response']
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    job = analysis_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    session_id = g.session_id
+
+    def generate_job_events():
+        seen = 0
+        while True:
+            events = job.wait_for_events(seen, timeout=15)
+            seen += len(events)
+            for event in events:
+                if event['type'] == 'progress':
+                    yield sse_event({'progress': event['data'], 'mode': 'analyze_image'})
+                else:
+                    yield sse_event({'status': event['data']})
+            if job.done:
+                if job.status == 'done':
+                    response = job.result['response']
+                    session_store.update(session_id, lambda stored: stored.update(last_response=response))
+                    yield sse_event(dict(job.result, final=True))
+                else:
+                    yield sse_event({'error': f'Error processing image: {job.error}'})
+                return
+            if not events:
+                # Comment line keeps idle connections open through proxies
+                yield ': keepalive\n\n'
+
+    return Response(stream_with_context(metrics.timed_stream('job_events', generate_job_events())), mimetype='text/event-stream',
+                    headers=SSE_HEADERS)
 
 def format_image_analysis(analysis):
     """Format the image analysis results into a readable string."""
     if 'error' in analysis:
         return f"❌ Error: {analysis['error']}"
     
+    note = ''
+    if analysis.get('near_duplicate'):
+        note = (f"ℹ️ This scan closely matches a previously analyzed image "
+                f"(hash distance {analysis['near_duplicate']['distance']}).\n\n")
+
     # Use the markdown format if available, otherwise fall back to the old format
     if 'markdown' in analysis and analysis['markdown']:
-        return analysis['markdown']
+        return note + analysis['markdown']
     
     # Fallback to the old format
-    output = "📊 Breast MRI Scan Analysis\n"
+    output = note + "📊 Breast MRI Scan Analysis\n"
     output += "=" * 30 + "\n\n"
     
     output += f"Stage: {analysis['stage'].upper()}\n"
@@ -115,10 +320,69 @@ def format_image_analysis(analysis):
 
 @app.route('/charts/<path:filename>')
 def serve_chart(filename):
-    return send_from_directory('exports/charts', filename)
+    from chart_renderer import wait_for_chart
+    # Charts are rendered in the background; hold the request until this one is written
+    wait_for_chart(filename)
+    # Chart names are content hashes, so a name always refers to the same image
+    response = send_from_directory('exports/charts', filename, etag=os.path.splitext(os.path.basename(filename))[0],
+                                   max_age=365 * 24 * 3600)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/api/health')
+def health():
+    """Readiness: 200 once the deferred modules and the models are loaded, 503 until then."""
+    status = warmup.status()
+    status['import_seconds'] = IMPORT_SECONDS
+    return jsonify(status), 200 if warmup.ready else 503
+
+def collect_metrics():
+    """Cache hit counters, intent tiers and job counts the modules already keep, read at scrape time."""
+    from data_analysis import insight_cache
+    from intent_detection import intent_stats
+    hits = []
+    misses = []
+
+    def add_cache(name, stats):
+        for tier in ('memory', 'disk'):
+            if f"{tier}_hits" in stats:
+                hits.append(({'cache': name, 'tier': tier}, stats[f"{tier}_hits"]))
+        if 'hits' in stats:
+            hits.append(({'cache': name, 'tier': 'all'}, stats['hits']))
+        misses.append(({'cache': name}, stats['misses']))
+
+    add_cache('insights', insight_cache.stats())
+    if _mri_analyzer is not None:
+        add_cache('mri_analysis', _mri_analyzer.cache_stats())
+        add_cache('image_payload', _mri_analyzer.preprocessor.stats())
+    # Only once a data file has been read; creating the cache would import pandas
+    if 'dataset_cache' in sys.modules:
+        cache = sys.modules['dataset_cache'].get_dataset_cache()
+        add_cache('dataset_profile', {'hits': cache.hits, 'misses': cache.misses})
+
+    jobs = analysis_jobs.stats()
+    return [
+        ('cache_hits_total', 'counter', 'Cache lookups answered from the cache.', hits),
+        ('cache_misses_total', 'counter', 'Cache lookups that had to compute the result.', misses),
+        ('intent_decisions_total', 'counter', 'Intent decisions per tier (rule, cache, knn, llm, error).',
+         [({'tier': tier}, count) for tier, count in intent_stats()['counts'].items()]),
+        ('analysis_jobs', 'gauge', 'Image analysis jobs in flight and retained.',
+         [({'state': state}, count) for state, count in jobs.items()]),
+        ('ready', 'gauge', '1 once the startup warm-up has finished.', [({}, 1 if warmup.ready else 0)]),
+    ]
+
+metrics.register_collector(collect_metrics)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if not metrics.METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
+    state = g.state
     data = request.json
     user_input = data.get('message', '').strip()
     
@@ -126,25 +390,25 @@ def chat():
         return jsonify({'error': 'No message provided'}), 400
 
     # Handle email workflow
-    if app_state['mode'] == 'email':
-        if app_state['email_stage'] == 'review':
+    if state['mode'] == 'email':
+        if state['email_stage'] == 'review':
             if user_input.lower() == 'yes':
-                app_state['email_stage'] = 'confirm'
+                state['email_stage'] = 'confirm'
                 return jsonify({
                     'response': 'Please provide the recipient\'s email address:',
                     'mode': 'email',
                     'stage': 'confirm'
                 })
             elif user_input.lower() == 'change':
-                app_state['email_stage'] = 'modify'
+                state['email_stage'] = 'modify'
                 return jsonify({
                     'response': 'Please provide your suggestions for modifications:',
                     'mode': 'email',
                     'stage': 'modify'
                 })
             elif user_input.lower() == 'cancel':
-                app_state['mode'] = 'chat'
-                app_state['email_stage'] = None
+                state['mode'] = 'chat'
+                state['email_stage'] = None
                 return jsonify({
                     'response': 'Email workflow cancelled. Returning to general chat.',
                     'mode': 'chat'
@@ -156,13 +420,13 @@ def chat():
                     'stage': 'review'
                 })
 
-        elif app_state['email_stage'] == 'confirm':
+        elif state['email_stage'] == 'confirm':
             try:
                 recipient = user_input
-                subject, body, _ = app_state['generated_email']
+                subject, body, _ = state['generated_email']
                 send_email(recipient, subject, body)
-                app_state['mode'] = 'chat'
-                app_state['email_stage'] = None
+                state['mode'] = 'chat'
+                state['email_stage'] = None
                 return jsonify({
                     'response': '✅ Email sent successfully!',
                     'mode': 'chat'
@@ -174,21 +438,21 @@ def chat():
                     'stage': 'confirm'
                 })
 
-        elif app_state['email_stage'] == 'modify':
+        elif state['email_stage'] == 'modify':
             suggestions = user_input
-            app_state['generated_email'] = modify_email_content(app_state['generated_email'][2], suggestions)
-            subject, body, _ = app_state['generated_email']
-            app_state['email_stage'] = 'review'
+            state['generated_email'] = modify_email_content(state['generated_email'][2], suggestions)
+            subject, body, _ = state['generated_email']
+            state['email_stage'] = 'review'
             return jsonify({
                 'response': f'Modified Email:\nSubject: {subject}\nBody: {body}\n\nReply with \'yes\' to send, \'change\' to modify further, or \'cancel\' to abort the email workflow.',
                 'mode': 'email',
                 'stage': 'review'
             })
 
-        elif app_state['email_stage'] == 'init':
-            app_state['generated_email'] = generate_email_content(user_input)
-            subject, body, _ = app_state['generated_email']
-            app_state['email_stage'] = 'review'
+        elif state['email_stage'] == 'init':
+            state['generated_email'] = generate_email_content(user_input)
+            subject, body, _ = state['generated_email']
+            state['email_stage'] = 'review'
             return jsonify({
                 'response': f'Generated Email:\nSubject: {subject}\nBody: {body}\n\nReply with \'yes\' to send, \'change\' to modify, or \'cancel\' to abort the email workflow.',
                 'mode': 'email',
@@ -196,12 +460,12 @@ def chat():
             })
 
     # If not in email workflow, detect intent
-    intent = detect_user_intent(user_input)
+    intent, speculation = resolve_intent(user_input, get_conversation(state))
 
     if intent == 'email':
-        if app_state['mode'] != 'email':
-            app_state['mode'] = 'email'
-            app_state['email_stage'] = 'init'
+        if state['mode'] != 'email':
+            state['mode'] = 'email'
+            state['email_stage'] = 'init'
             return jsonify({
                 'response': 'I\'ll help you with sending an email. Please provide a description for the email you want to send:',
                 'mode': 'email',
@@ -209,8 +473,8 @@ def chat():
             })
 
     elif intent == 'analyze':
-        if app_state['mode'] != 'data_analysis':
-            app_state['mode'] = 'data_analysis'
+        if state['mode'] != 'data_analysis':
+            state['mode'] = 'data_analysis'
             return jsonify({
                 'response': 'I\'ll help you analyze your data. Please provide the path to your CSV or Excel file:',
                 'mode': 'data_analysis'
@@ -218,13 +482,14 @@ def chat():
         else:
             success, result = read_data_file(user_input)
             if success:
-                app_state['current_data'] = result  # Store the data
+                state['current_data'] = result  # Store the data
                 insights = generate_data_insights(result)
                 formatted_output = format_analysis_output(insights)
-                app_state['last_response'] = formatted_output
+                state['last_response'] = formatted_output
                 return jsonify({
                     'response': formatted_output,
-                    'mode': 'data_analysis'
+                    'mode': 'data_analysis',
+                    'charts': insights.get('charts', [])
                 })
             else:
                 return jsonify({
@@ -232,8 +497,8 @@ def chat():
                     'mode': 'data_analysis'
                 })
     elif intent == 'analyze_image':
-        if app_state['mode'] != 'analyze_image':
-            app_state['mode'] = 'analyze_image'
+        if state['mode'] != 'analyze_image':
+            state['mode'] = 'analyze_image'
             return jsonify({
                 'response': 'I\'ll help you analyze a breast MRI scan. Please upload an image file (PNG, JPG, JPEG, or DICOM format):',
                 'mode': 'analyze_image'
@@ -244,38 +509,38 @@ def chat():
                 'mode': 'analyze_image'
             })
     elif intent == 'save':
-        if app_state['last_response']:
+        if state['last_response']:
             # Generate a filename with timestamp
             filename = f'analysis_report_{int(time.time())}.txt'
             
             # Create the document content
             document_content = f"Analysis Report\n{'='*50}\n\n"
-            document_content += app_state['last_response']
+            document_content += state['last_response']
             
-            if app_state['current_data'] is not None:
+            if state['current_data'] is not None:
                 document_content += "\n\nData Summary:\n"
-                document_content += f"Total Records: {len(app_state['current_data'])}\n"
-                document_content += f"Columns: {', '.join(app_state['current_data'].columns)}\n"
+                document_content += f"Total Records: {state['current_data']['row_count']}\n"
+                document_content += f"Columns: {', '.join(state['current_data']['columns'])}\n"
 
-            # Send the document immediately in the stream
-            yield f'data: ' + json.dumps({
+            return jsonify({
                 'response': '✅ Document generated successfully!',
-                'mode': app_state['mode'],
+                'mode': state['mode'],
                 'document': {
                     'content': document_content,
                     'filename': filename
                 }
-            }) + '\n\n'
-            return
+            })
         else:
-            response_text = '⚠️ No recent response available to save.'
-            mode = app_state['mode']
+            return jsonify({
+                'response': '⚠️ No recent response available to save.',
+                'mode': state['mode']
+            })
 
     else:  # normal chat
-        if app_state['mode'] != 'chat':
-            app_state['mode'] = 'chat'
-        response = process_general_chat(user_input)
-        app_state['last_response'] = response
+        if state['mode'] != 'chat':
+            state['mode'] = 'chat'
+        response = speculation.result() if speculation else process_general_chat(user_input, get_conversation(state))
+        state['last_response'] = response
         return jsonify({
             'response': response,
             'mode': 'chat'
@@ -286,8 +551,18 @@ def chat_stream():
     # Access request data before entering the generator
     data = request.json
     user_input = data.get('message', '').strip() if data else ''
+    session_id, state = g.session_id, g.state
+    before = dict.copy(state)
+    # Keys the stream mutates in place, so they keep their identity
+    owned = set()
 
     def generate_streamed_response(user_input):
+        try:
+            yield from respond(user_input)
+        finally:
+            save_stream_state(session_id, state, before, owned)
+
+    def respond(user_input):
         if not user_input:
             yield 'data: {"error": "No message provided"}\n\n'
             return
@@ -296,83 +571,104 @@ def chat_stream():
         mode = 'chat'
         chart_data = None
 
-        if app_state['mode'] == 'email':
-            if app_state['email_stage'] == 'review':
+        if state['mode'] == 'email':
+            if state['email_stage'] == 'review':
                 if user_input.lower() == 'yes':
+                    state['email_stage'] = 'confirm'
                     response_text = 'Please provide the recipient\'s email address:'
                     mode = 'email'
                 elif user_input.lower() == 'change':
+                    state['email_stage'] = 'modify'
                     response_text = 'Please provide your suggestions for modifications:'
                     mode = 'email'
                 elif user_input.lower() == 'cancel':
+                    state['mode'] = 'chat'
+                    state['email_stage'] = None
                     response_text = 'Email workflow cancelled. Returning to general chat.'
                     mode = 'chat'
                 else:
                     response_text = 'Invalid response. Reply with \'yes\', \'change\', or \'cancel\'.'
                     mode = 'email'
-            elif app_state['email_stage'] == 'confirm':
+            elif state['email_stage'] == 'confirm':
                 try:
                     recipient = user_input
-                    subject, body, _ = app_state['generated_email']
+                    subject, body, _ = state['generated_email']
                     send_email(recipient, subject, body)
+                    state['mode'] = 'chat'
+                    state['email_stage'] = None
                     response_text = '✅ Email sent successfully!'
                     mode = 'chat'
                 except Exception as e:
                     response_text = f'❌ Failed to send email. Error: {str(e)}\nPlease try again with a valid email address:'
                     mode = 'email'
-            elif app_state['email_stage'] == 'modify':
+            elif state['email_stage'] == 'modify':
                 suggestions = user_input
-                app_state['generated_email'] = modify_email_content(app_state['generated_email'][2], suggestions)
-                subject, body, _ = app_state['generated_email']
-                response_text = f'Modified Email:\nSubject: {subject}\nBody: {body}\n\nReply with \'yes\' to send, \'change\' to modify further, or \'cancel\' to abort the email workflow.'
+                yield sse_event({'response': 'Modified Email:\n', 'mode': 'email'})
+                parts = []
+                for chunk in stream_modified_email_content(state['generated_email'][2], suggestions):
+                    parts.append(chunk)
+                    yield sse_event({'response': chunk, 'mode': 'email'})
+                state['generated_email'] = parse_email_content(''.join(parts))
+                state['email_stage'] = 'review'
+                response_text = '\n\nReply with \'yes\' to send, \'change\' to modify further, or \'cancel\' to abort the email workflow.'
                 mode = 'email'
-            elif app_state['email_stage'] == 'init':
-                app_state['generated_email'] = generate_email_content(user_input)
-                subject, body, _ = app_state['generated_email']
-                response_text = f'Generated Email:\nSubject: {subject}\nBody: {body}\n\nReply with \'yes\' to send, \'change\' to modify, or \'cancel\' to abort the email workflow.'
+            elif state['email_stage'] == 'init':
+                yield sse_event({'response': 'Generated Email:\n', 'mode': 'email'})
+                parts = []
+                for chunk in stream_email_content(user_input):
+                    parts.append(chunk)
+                    yield sse_event({'response': chunk, 'mode': 'email'})
+                state['generated_email'] = parse_email_content(''.join(parts))
+                state['email_stage'] = 'review'
+                response_text = '\n\nReply with \'yes\' to send, \'change\' to modify, or \'cancel\' to abort the email workflow.'
                 mode = 'email'
         else:
-            intent = detect_user_intent(user_input)
+            intent, speculation = resolve_intent(user_input, get_conversation(state))
             if intent == 'email':
-                if app_state['mode'] != 'email':
+                if state['mode'] != 'email':
+                    state['mode'] = 'email'
+                    state['email_stage'] = 'init'
                     response_text = 'I\'ll help you with sending an email. Please provide a description for the email you want to send:'
                     mode = 'email'
             elif intent == 'analyze':
-                if app_state['mode'] != 'data_analysis':
+                if state['mode'] != 'data_analysis':
+                    state['mode'] = 'data_analysis'
                     response_text = 'I\'ll help you analyze your data. Please provide the path to your CSV or Excel file:'
                     mode = 'data_analysis'
                 else:
                     success, result = read_data_file(user_input)
                     if success:
-                        app_state['current_data'] = result
+                        state['current_data'] = result
                         insights = generate_data_insights(result)
                         formatted_output = format_analysis_output(insights)
-                        app_state['last_response'] = formatted_output
-                        response_text = formatted_output
+                        state['last_response'] = formatted_output
+                        yield sse_event({'response': formatted_output, 'mode': 'data_analysis',
+                                         'charts': insights.get('charts', [])})
                         mode = 'data_analysis'
                     else:
                         response_text = f'❌ Error reading file: {result}\nPlease provide a valid path to a CSV or Excel file:'
                         mode = 'data_analysis'
             elif intent == 'analyze_image':
-                if app_state['mode'] != 'analyze_image':
+                if state['mode'] != 'analyze_image':
+                    state['mode'] = 'analyze_image'
                     response_text = 'I\'ll help you analyze a breast MRI scan. Please upload an image file (PNG, JPG, JPEG, or DICOM format):'
                     mode = 'analyze_image'
                 else:
                     response_text = 'Please upload an image file for analysis.'
                     mode = 'analyze_image'
             elif intent == 'save':
-                if app_state['last_response']:
+                if state['last_response']:
                     filename = f'analysis_report_{int(time.time())}.txt'
                     document_content = f"Analysis Report\n{'='*50}\n\n"
-                    document_content += app_state['last_response']
-                    if app_state['current_data'] is not None:
+                    document_content += state['last_response']
+                    if state['current_data'] is not None:
                         document_content += "\n\nData Summary:\n"
-                        document_content += f"Total Records: {len(app_state['current_data'])}\n"
-                        document_content += f"Columns: {', '.join(app_state['current_data'].columns)}\n"
+                        document_content += f"Total Records: {state['current_data']['row_count']}\n"
+                        document_content += f"Columns: {', '.join(state['current_data']['columns'])}\n"
                     # Stream the document as a whole at the end
                     yield f'data: ' + json.dumps({
                         'response': '✅ Document generated successfully!',
-                        'mode': app_state['mode'],
+                        'mode': state['mode'],
                         'document': {
                             'content': document_content,
                             'filename': filename
@@ -381,25 +677,50 @@ def chat_stream():
                     return
                 else:
                     response_text = '⚠️ No recent response available to save.'
-                    mode = app_state['mode']
+                    mode = state['mode']
             else:
-                if app_state['mode'] != 'chat':
-                    app_state['mode'] = 'chat'
-                response_text = process_general_chat(user_input)
-                app_state['last_response'] = response_text
+                if state['mode'] != 'chat':
+                    state['mode'] = 'chat'
+                # Relay tokens to the browser as the model produces them
+                owned.add('conversation')
+                parts = []
+                chunks = speculation.chunks() if speculation else stream_general_chat(user_input, conversation=get_conversation(state))
+                for chunk in chunks:
+                    parts.append(chunk)
+                    yield sse_event({'response': chunk, 'mode': 'chat'})
+                state['last_response'] = ''.join(parts)
                 mode = 'chat'
 
-        # Then stream the response text
+        # Send any remaining fixed response text in one event
         if response_text:
-            for i in range(0, len(response_text), 20):
-                chunk = response_text[i:i+20]
-                yield f'data: ' + json.dumps({
-                    'response': chunk,
-                    'mode': mode
-                }) + '\n\n'
-                time.sleep(0.04)
-
-    return Response(stream_with_context(generate_streamed_response(user_input)), mimetype='text/event-stream')
+            yield sse_event({'response': response_text, 'mode': mode})
+
+    return Response(stream_with_context(metrics.timed_stream('chat_stream', generate_streamed_response(user_input))),
+                    mimetype='text/event-stream',
+                    headers=SSE_HEADERS)
+
+# Modules imported lazily by the workflows, loaded here ahead of the first upload
+WARMUP_MODULES = ('data_profiler', 'data_sampling', 'dataset_cache', 'excel_reader', 'query_engine', 'chart_renderer')
+# Load the chat and vision models into Ollama at startup so the first request does not wait for them
+PRELOAD_MODELS = os.environ.get('PRELOAD_MODELS', '1') == '1'
+
+def startup_steps():
+    from intent_detection import get_intent_classifier
+    steps = [
+        ('imports', lambda: [importlib.import_module(module) for module in WARMUP_MODULES]),
+        ('intent_classifier', get_intent_classifier),
+        ('mri_analyzer', get_mri_analyzer),
+    ]
+    if PRELOAD_MODELS:
+        for model in dict.fromkeys(llm_client.MODELS.values()):
+            steps.append((f"model:{model}", partial(llm_client.preload, model)))
+    return steps
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+logger.info(f"App imported in {IMPORT_SECONDS * 1000:.0f} ms")
+warmup = Warmup([] if IN_WORKER_PROCESS else startup_steps(), started=_import_started)
+if WARMUP_ON_START and not IN_WORKER_PROCESS:
+    warmup.start()
 
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+Micro-benchmark of the VLM image preprocessing over the sample images in uploads/.
+
+Compares the previous pipeline (full decode, LANCZOS resize to 800x800, RGB
+conversion, JPEG re-encode, base64) with ImagePreprocessor on a cold and on a warm
+payload cache. `--scale` also benchmarks upscaled copies of the samples, to show the
+effect of reduced JPEG decoding on large scans.
+
+    python benchmarks/bench_image_preprocess.py --scale 4 --repeat 20
+"""
+import argparse
+import base64
+import glob
+import os
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_preprocess import ImagePreprocessor  # noqa: E402
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def legacy_payload(data, max_size=(800, 800)):
+    image = Image.open(BytesIO(data))
+    ratio = min(max_size[0] / image.size[0], max_size[1] / image.size[1])
+    image = image.resize(tuple(int(dim * ratio) for dim in image.size), Image.Resampling.LANCZOS)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffered = BytesIO()
+    image.save(buffered, format='JPEG', quality=85)
+    return base64.b64encode(buffered.getvalue()).decode()
+
+
+def load_samples(upload_dir, scale):
+    samples = []
+    for path in sorted(glob.glob(os.path.join(upload_dir, '*'))):
+        if not path.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        samples.append((os.path.basename(path), data))
+        if scale > 1:
+            image = Image.open(BytesIO(data))
+            large = image.resize((image.size[0] * scale, image.size[1] * scale), Image.Resampling.BICUBIC)
+            buffered = BytesIO()
+            large.save(buffered, format=image.format, quality=95)
+            samples.append((f"{os.path.basename(path)} x{scale}", buffered.getvalue()))
+    return samples
+
+
+def timed(function, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--uploads', default='uploads', help='directory with sample images')
+    parser.add_argument('--scale', type=int, default=4, help='also benchmark copies upscaled by this factor (1 disables)')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    samples = load_samples(args.uploads, args.scale)
+    if not samples:
+        sys.exit(f"No images found in {args.uploads}")
+
+    print(f"{'image':<32} {'bytes':>9} {'legacy ms':>10} {'cold ms':>9} {'warm ms':>9} {'payload':>10}")
+    for name, data in samples:
+        legacy_ms, legacy = timed(lambda: legacy_payload(data), args.repeat)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # A fresh cache directory per run, so every cold run encodes
+            def cold():
+                with tempfile.TemporaryDirectory(dir=cache_dir) as run_dir:
+                    return ImagePreprocessor(cache_dir=run_dir).payload(data)
+            cold_ms, payload = timed(cold, args.repeat)
+            warm_preprocessor = ImagePreprocessor(cache_dir=cache_dir, memory_entries=0)
+            warm_preprocessor.payload(data)
+            warm_ms, _ = timed(lambda: warm_preprocessor.payload(data), args.repeat)
+        print(f"{name:<32} {len(data):>9} {legacy_ms:>10.2f} {cold_ms:>9.2f} {warm_ms:>9.2f} "
+              f"{len(payload):>10} (legacy {len(legacy)})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Measure how long `import app` takes in a fresh interpreter and how long the background
+warm-up (deferred imports and model preloading) takes until /api/health reports ready.
+
+    python benchmarks/bench_startup.py --repeat 5
+    OLLAMA_HOST=http://localhost:11500 python benchmarks/bench_startup.py   # e.g. against the stub server
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = """
+import time
+started = time.perf_counter()
+import app
+print(time.perf_counter() - started)
+"""
+
+READY_SNIPPET = """
+import json, sys, time
+import app
+deadline = time.perf_counter() + float(sys.argv[1])
+while not app.warmup.ready and time.perf_counter() < deadline:
+    time.sleep(0.05)
+status = app.warmup.status()
+status['import_seconds'] = app.IMPORT_SECONDS
+print(json.dumps(status))
+"""
+
+
+def run(snippet, *args, env=None):
+    result = subprocess.run([sys.executable, '-c', snippet, *args], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for readiness')
+    args = parser.parse_args()
+
+    env = dict(os.environ, WARMUP_ON_START='0')
+    started = time.perf_counter()
+    times = [float(run(IMPORT_SNIPPET, env=env)) for _ in range(args.repeat)]
+    print(f"import app: median {statistics.median(times) * 1000:.0f} ms, "
+          f"min {min(times) * 1000:.0f} ms over {args.repeat} runs "
+          f"({(time.perf_counter() - started) / args.repeat * 1000:.0f} ms per process incl. interpreter)")
+
+    status = json.loads(run(READY_SNIPPET, str(args.timeout), env=dict(os.environ, WARMUP_ON_START='1')))
+    print(f"status: {status['status']}, import {status['import_seconds'] * 1000:.0f} ms, "
+          f"time to ready: {status['time_to_ready'] if status['time_to_ready'] is None else round(status['time_to_ready'], 2)} s")
+    for name, step in status['steps'].items():
+        seconds = '-' if step['seconds'] is None else f"{step['seconds']:.2f}s"
+        print(f"  {name:<28} {step['state']:<8} {seconds:>8}  {step['error'] or ''}")
+
+
+if __name__ == '__main__':
+    main()
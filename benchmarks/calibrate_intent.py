@@ -0,0 +1,53 @@
+"""
+Choose the k-NN intent thresholds from held-out messages: for each (score, margin)
+pair, how many held-out messages the classifier would decide without the LLM and how
+many of those decisions are wrong. Messages the fast-path rules catch are skipped.
+
+    python benchmarks/calibrate_intent.py
+    python benchmarks/calibrate_intent.py --holdout my_messages.json --max-errors 0
+"""
+import argparse
+import json
+import os
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from intent_classifier import IntentClassifier  # noqa: E402
+from intent_detection import _fast_path, _normalize  # noqa: E402
+
+SCORES = [0.3, 0.35, 0.4, 0.45, 0.5, 0.6]
+MARGINS = [0.0, 0.05, 0.1, 0.15, 0.2, 0.25]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--holdout', default=os.path.join(BENCHMARK_DIR, 'intent_holdout.json'))
+    parser.add_argument('--max-errors', type=int, default=0, help='wrong k-NN decisions tolerated')
+    args = parser.parse_args()
+
+    with open(args.holdout, 'r', encoding='utf-8') as f:
+        holdout = [(_normalize(example['text']), example['intent']) for example in json.load(f)]
+    holdout = [(text, intent) for text, intent in holdout if _fast_path(text) is None]
+    classifier = IntentClassifier()
+    results = [(classifier.classify(text), intent) for text, intent in holdout]
+
+    print(f"{len(results)} held-out messages not caught by the rules")
+    print(f"{'score':>6} {'margin':>7} {'decided':>8} {'wrong':>6}")
+    best = None
+    for score in SCORES:
+        for margin in MARGINS:
+            decided = [(predicted, expected) for (predicted, similarity, gap), expected in results
+                       if similarity >= score and gap >= margin]
+            wrong = sum(predicted != expected for predicted, expected in decided)
+            print(f"{score:>6.2f} {margin:>7.2f} {len(decided):>8} {wrong:>6}")
+            if wrong <= args.max_errors and (best is None or len(decided) > best[2]):
+                best = (score, margin, len(decided))
+    if best:
+        print(f"Most decisions with at most {args.max_errors} errors: INTENT_KNN_THRESHOLD={best[0]} "
+              f"INTENT_KNN_MARGIN={best[1]} ({best[2]} of {len(results)} skip the LLM)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""
+Benchmark the chat, data and imaging workflows end to end against the local Ollama stub.
+
+Each stage runs `--iterations` times (on `--concurrency` threads) and reports latency
+percentiles, throughput and the peak Python heap of one extra traced run; streaming
+stages also report time to the first event. Every iteration uses fresh inputs or
+caches so the numbers reflect uncached work unless the stage name says otherwise.
+Runs happen in a temporary working directory, so the repository's caches and uploads
+are left untouched.
+
+    python benchmarks/run_benchmarks.py --iterations 10 --json results.json
+    python benchmarks/run_benchmarks.py --baseline results.json   # exit 1 on a p50 regression
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from stub_ollama import StubOllama  # noqa: E402
+
+CHAT_MESSAGES = [
+    "What are the early signs of breast cancer?",
+    "How often should a woman over forty get screened?",
+    "Can you explain what a BI-RADS score means?",
+    "What lifestyle changes lower cancer risk?",
+]
+# Phrases the rule tier does not match, so they reach the classifier or the LLM
+INTENT_MESSAGES = [
+    "could you put together a note for my manager about the results",
+    "I'd like to keep a copy of what you just said",
+    "what trends are hidden in last quarter's numbers",
+    "tell me something interesting about radiology",
+    "please look at the scan I am about to share",
+]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def noise_image(seed, size=(512, 512)):
+    """JPEG of random noise: every seed gives a perceptually different image, so no cache tier reuses it."""
+    import numpy as np
+    from PIL import Image
+    pixels = np.random.default_rng(seed).integers(0, 256, size=size, dtype=np.uint8)
+    buffered = io.BytesIO()
+    Image.fromarray(pixels, 'L').save(buffered, format='JPEG', quality=90)
+    return buffered.getvalue()
+
+
+def csv_variant(source, seed, directory):
+    """
+    Copy of `source` with one extra row whose first field is unique, so the dataset,
+    profile, insight and query caches all miss (same-schema structure reuse still applies).
+    """
+    unique = random.getrandbits(31)
+    path = os.path.join(directory, f"data-{seed}-{unique:08x}.csv")
+    with open(source, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    lines.append(f"{unique},{lines[-1].split(',', 1)[-1]}")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+class Stages:
+    """The benchmarked operations; each takes an iteration number and may return a time-to-first-event."""
+
+    def __init__(self, workdir, sample_csv):
+        import app
+        self.app = app
+        self.workdir = workdir
+        self.sample_csv = sample_csv
+
+    def client(self):
+        # One client per call: no shared cookie jar, so every request starts a new session
+        return self.app.app.test_client(use_cookies=False)
+
+    def intent(self, i):
+        import intent_detection
+        with intent_detection._lock:
+            intent_detection._intent_cache.clear()
+        intent_detection.detect_user_intent(INTENT_MESSAGES[i % len(INTENT_MESSAGES)])
+
+    def intent_llm(self, i):
+        import intent_detection
+        intent_detection._llm_intent(INTENT_MESSAGES[i % len(INTENT_MESSAGES)])
+
+    def chat(self, i):
+        from chat_processing import process_general_chat
+        process_general_chat(CHAT_MESSAGES[i % len(CHAT_MESSAGES)])
+
+    def insights(self, i):
+        from data_analysis import read_data_file, generate_data_insights
+        success, profile = read_data_file(csv_variant(self.sample_csv, i, self.workdir))
+        if not success:
+            raise RuntimeError(profile)
+        generate_data_insights(profile)
+
+    def insights_cached(self, i):
+        from data_analysis import read_data_file, generate_data_insights
+        success, profile = read_data_file(self.sample_csv)
+        generate_data_insights(profile)
+
+    def mri(self, i):
+        from image_preprocess import ImagePreprocessor
+        from vlm_agent import BreastMRIAnalyzer
+        cache_dir = tempfile.mkdtemp(dir=self.workdir)
+        analyzer = BreastMRIAnalyzer(cache_dir=cache_dir, preprocessor=ImagePreprocessor(cache_dir=os.path.join(cache_dir, 'payloads')))
+        result = analyzer.analyze_mri_scan(noise_image(i))
+        if result.get('error'):
+            raise RuntimeError(result['error'])
+
+    def api_chat(self, i):
+        response = self.client().post('/api/chat', json={'message': CHAT_MESSAGES[i % len(CHAT_MESSAGES)]})
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/chat returned {response.status_code}")
+
+    def api_chat_stream(self, i):
+        started = time.perf_counter()
+        response = self.client().post('/api/chat_stream', json={'message': CHAT_MESSAGES[i % len(CHAT_MESSAGES)]},
+                                      buffered=False)
+        first = None
+        for _ in response.response:
+            if first is None:
+                first = time.perf_counter() - started
+        response.close()
+        return first
+
+    def api_upload_image(self, i):
+        client = self.client()
+        response = client.post('/api/upload', data={'file': (io.BytesIO(noise_image(10_000 + i)), f"scan-{i}.jpg")},
+                               content_type='multipart/form-data')
+        if response.status_code != 202:
+            raise RuntimeError(f"/api/upload returned {response.status_code}: {response.get_json()}")
+        job_id = response.get_json()['job_id']
+        while True:
+            job = client.get(f"/api/jobs/{job_id}").get_json()
+            if job['status'] not in ('queued', 'running'):
+                break
+            time.sleep(0.01)
+        if job['status'] != 'done':
+            raise RuntimeError(f"analysis job {job['status']}: {job.get('error')}")
+
+    def api_upload_data(self, i):
+        path = csv_variant(self.sample_csv, 20_000 + i, self.workdir)
+        with open(path, 'rb') as f:
+            response = self.client().post('/api/upload', data={'file': (f, os.path.basename(path))},
+                                          content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/upload returned {response.status_code}: {response.get_json()}")
+
+
+STAGES = ('intent', 'intent_llm', 'chat', 'insights', 'insights_cached', 'mri',
+          'api_chat', 'api_chat_stream', 'api_upload_image', 'api_upload_data')
+
+
+def measure(name, operation, iterations, concurrency):
+    operation(iterations)  # first call pays for imports and connection setup; not counted
+
+    def timed(i):
+        started = time.perf_counter()
+        first = operation(i)
+        return time.perf_counter() - started, first
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(iterations)))
+    wall = time.perf_counter() - started
+
+    # One more run with tracemalloc on; tracing slows Python code, so it is kept out of the timings
+    tracemalloc.start()
+    try:
+        operation(iterations + 1)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    latencies = [seconds for seconds, _ in results]
+    firsts = [first for _, first in results if first is not None]
+    return {
+        'stage': name,
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'max_ms': max(latencies) * 1000,
+        'throughput': iterations / wall,
+        'first_event_p50_ms': statistics.median(firsts) * 1000 if firsts else None,
+        'peak_kib': peak / 1024,
+    }
+
+
+def print_table(results, max_rss_kib):
+    print(f"{'stage':<18} {'n':>4} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'ops/s':>8} {'first ms':>9} {'peak KiB':>10}")
+    for result in results:
+        first = '-' if result['first_event_p50_ms'] is None else f"{result['first_event_p50_ms']:.1f}"
+        print(f"{result['stage']:<18} {result['iterations']:>4} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+              f"{result['max_ms']:>9.1f} {result['throughput']:>8.2f} {first:>9} {result['peak_kib']:>10.0f}")
+    print(f"max RSS: {max_rss_kib / 1024:.0f} MiB")
+
+
+def compare(results, baseline_path, tolerance):
+    """Return the stages whose p50 latency grew by more than `tolerance` over the baseline."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {result['stage']: result for result in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        before = baseline.get(result['stage'])
+        if before and result['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+            regressions.append(f"{result['stage']}: p50 {before['p50_ms']:.1f} -> {result['p50_ms']:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--stages', default=','.join(STAGES), help=f"comma-separated subset of: {', '.join(STAGES)}")
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.02, help='stub: fixed seconds per request')
+    parser.add_argument('--prompt-rate', type=float, default=4000.0, help='stub: prompt tokens per second')
+    parser.add_argument('--token-rate', type=float, default=0, help='stub: generated tokens per second (0: instant)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file to compare p50 latencies against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p50 growth over the baseline')
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        sys.exit(f"Unknown stages: {', '.join(unknown)}")
+
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    shutil.copytree(os.path.join(ROOT, 'uploads'), os.path.join(workdir, 'uploads'))
+    os.chdir(workdir)
+    # Models are served by the stub; nothing to preload
+    os.environ['WARMUP_ON_START'] = '0'
+
+    stub = StubOllama(latency=args.latency, prompt_rate=args.prompt_rate, token_rate=args.token_rate).start()
+    try:
+        import llm_client
+        llm_client.set_client(llm_client.LLMClient(host=stub.url))
+        runner = Stages(workdir, os.path.join(workdir, 'uploads', 'titanic.csv'))
+        results = []
+        for stage in stages:
+            results.append(measure(stage, getattr(runner, stage), args.iterations, args.concurrency))
+            print(f"{stage} done", file=sys.stderr)
+        max_rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print_table(results, max_rss_kib)
+        print(f"stub requests: {stub.requests}; model usage: {json.dumps(llm_client.usage())}")
+    finally:
+        if 'chart_renderer' in sys.modules:
+            # Charts render in the background; let them finish before the workdir goes away
+            sys.modules['chart_renderer'].get_chart_renderer().wait_all()
+        stub.stop()
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'results': results, 'max_rss_kib': max_rss_kib, 'args': vars(args)}, f, indent=2)
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+Local HTTP stub of the Ollama API for benchmarks: /api/chat and /api/generate (streamed
+or not), /api/embed, /api/tags and /api/version.
+
+Replies are canned per prompt type (intent, email, data insights, SQL translation,
+chart specs, MRI analysis, general chat) so every workflow parses them as it would a
+real model's output. Timing follows a simple model of a local LLM: a fixed per-request
+latency, prompt evaluation at `prompt_rate` tokens/s for the part of the prompt that is
+not a prefix of the model's previous prompt (mimicking KV-cache prefix reuse), and
+generation at `token_rate` tokens/s.
+
+    python benchmarks/stub_ollama.py --port 11500 --token-rate 40
+    OLLAMA_HOST=http://127.0.0.1:11500 python app.py
+"""
+import argparse
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+EMBEDDING_DIMENSIONS = 64
+
+INSIGHTS_REPLY = (
+    "ANALYSIS:\n"
+    "The dataset mixes numeric and categorical columns with a few missing values. "
+    "Numeric columns are moderately skewed and one categorical column dominates the row count.\n\n"
+    "SUGGESTED QUERIES:\n"
+    "- How many rows are there?\n"
+    "- What is the average of each numeric column?\n"
+    "- Which category has the most rows?\n"
+    "- How many values are missing per column?\n"
+    "- What are the five largest values?\n\n"
+    "VISUALIZATION SUGGESTIONS:\n"
+    "- Histogram of the main numeric column\n"
+    "- Bar chart of row counts per category\n"
+)
+
+EMAIL_REPLY = (
+    "Subject: Follow-up on our discussion\n"
+    "Body:\n"
+    "Hello,\n\nThank you for your time today. As discussed, I am sharing the summary of the results "
+    "and the next steps we agreed on. Please let me know if anything needs to change.\n\nBest regards"
+)
+
+MRI_ANALYSIS = {
+    'stage': 'middle',
+    'confidence': 0.72,
+    'observations': ['An irregular mass is visible in the upper outer quadrant.',
+                     'Surrounding tissue shows moderate enhancement.'],
+    'explanation': 'The size and margins of the mass are consistent with a locally advanced lesion.',
+    'recommendations': ['Refer to an oncologist for staging workup.', 'Discuss neoadjuvant therapy options.'],
+}
+
+CHAT_REPLY = (
+    "Breast cancer screening usually combines clinical examination with imaging such as mammography, "
+    "ultrasound or MRI, depending on age and risk factors. Your doctor can recommend the schedule that "
+    "fits your situation, and any new symptom should be checked promptly."
+)
+
+
+def _tokens(text):
+    return re.findall(r'\S+\s*|\s+', text)
+
+
+def _prompt_text(messages):
+    return "\n".join(f"{message.get('role', '')}: {message.get('content', '')}" for message in messages)
+
+
+def canned_reply(prompt, response_format=None):
+    """Choose a reply the calling workflow can parse, based on the prompt and format."""
+    lowered = prompt.lower()
+    if isinstance(response_format, dict):
+        return json.dumps(MRI_ANALYSIS)
+    if response_format == 'json':
+        # Chart specs: a histogram of the first numeric column, a bar chart of the first other column
+        columns = re.findall(r'^- (.+) \((\w+)\)$', prompt, re.MULTILINE)
+        numeric = [name for name, dtype in columns if dtype.startswith(('int', 'float'))]
+        other = [name for name, dtype in columns if not dtype.startswith(('int', 'float'))]
+        charts = []
+        if numeric:
+            charts.append({'title': f"Distribution of {numeric[0]}", 'type': 'histogram', 'x': numeric[0], 'y': None, 'agg': 'count'})
+        if other:
+            charts.append({'title': f"Rows per {other[0]}", 'type': 'bar', 'x': other[0], 'y': None, 'agg': 'count'})
+        return json.dumps({'charts': charts})
+    if 'intent detection assistant' in lowered:
+        return 'normal'
+    if 'translate each question' in lowered:
+        questions = re.findall(r'^(\d+)\. ', prompt.split('Questions:', 1)[-1], re.MULTILINE)
+        return "\n".join(f"{number}. SELECT COUNT(*) AS n FROM data" for number in questions)
+    if 'data analysis expert' in lowered:
+        return INSIGHTS_REPLY
+    if 'email assistant' in lowered:
+        return EMAIL_REPLY
+    if 'markdown format' in lowered:
+        return "```markdown\n# Breast MRI Scan Analysis\n\n" + MRI_ANALYSIS['explanation'] + "\n```"
+    if 'breast scan image' in lowered:
+        return "Stage: Middle Stage. Confidence: 72%. " + MRI_ANALYSIS['explanation']
+    return CHAT_REPLY
+
+
+class StubOllama:
+    """Threaded stub server; use as a context manager or call start()/stop()."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.05, prompt_rate=2000.0, token_rate=50.0,
+                 max_tokens=None, responses=None):
+        self.latency = latency
+        self.prompt_rate = prompt_rate
+        self.token_rate = token_rate
+        self.max_tokens = max_tokens
+        # Optional {substring: reply} overrides checked before the canned replies
+        self.responses = responses or {}
+        self.requests = 0
+        self._last_prompt = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='stub-ollama', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reply(self, prompt, response_format=None):
+        for key, value in self.responses.items():
+            if key in prompt:
+                return value
+        return canned_reply(prompt, response_format)
+
+    def prompt_tokens(self, model, prompt):
+        """Tokens to evaluate: the part of the prompt not shared with this model's previous prompt."""
+        with self._lock:
+            self.requests += 1
+            previous = self._last_prompt.get(model, '')
+            self._last_prompt[model] = prompt
+        shared = 0
+        for a, b in zip(previous, prompt):
+            if a != b:
+                break
+            shared += 1
+        return max(1, (len(prompt) - shared) // CHARS_PER_TOKEN)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _json(self, payload, status=200):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/api/version':
+                    self._json({'version': '0.0.0-stub'})
+                elif self.path == '/api/tags':
+                    self._json({'models': []})
+                else:
+                    self._json({'error': 'not found'}, 404)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    request = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    self._json({'error': 'invalid JSON'}, 400)
+                    return
+                if self.path == '/api/chat':
+                    prompt = _prompt_text(request.get('messages') or [])
+                    self._generate(request, prompt, lambda text: {'message': {'role': 'assistant', 'content': text}})
+                elif self.path == '/api/generate':
+                    if not request.get('prompt'):
+                        # Empty prompt: Ollama only loads the model
+                        self._json(self._base(request) | {'response': '', 'done': True, 'done_reason': 'load'})
+                        return
+                    self._generate(request, request['prompt'], lambda text: {'response': text})
+                elif self.path == '/api/embed':
+                    inputs = request.get('input') or []
+                    inputs = [inputs] if isinstance(inputs, str) else inputs
+                    self._json(self._base(request) | {'embeddings': [self._embedding(text) for text in inputs]})
+                else:
+                    self._json({'error': 'not found'}, 404)
+
+            def _base(self, request):
+                return {'model': request.get('model', ''), 'created_at': datetime.now(timezone.utc).isoformat()}
+
+            def _embedding(self, text):
+                digest = hashlib.sha256(text.encode()).digest() * (EMBEDDING_DIMENSIONS // 32)
+                return [(byte - 128) / 128 for byte in digest[:EMBEDDING_DIMENSIONS]]
+
+            def _generate(self, request, prompt, wrap):
+                model = request.get('model', '')
+                started = time.perf_counter()
+                prompt_tokens = stub.prompt_tokens(model, prompt)
+                prompt_seconds = prompt_tokens / stub.prompt_rate
+                time.sleep(stub.latency + prompt_seconds)
+
+                tokens = _tokens(stub.reply(prompt, request.get('format')))
+                limit = (request.get('options') or {}).get('num_predict') or stub.max_tokens
+                if limit and limit > 0:
+                    tokens = tokens[:limit]
+                delay = 1 / stub.token_rate if stub.token_rate else 0
+                final = {
+                    'done': True,
+                    'done_reason': 'stop',
+                    'prompt_eval_count': prompt_tokens,
+                    'prompt_eval_duration': int(prompt_seconds * 1e9),
+                    'eval_count': len(tokens),
+                    'eval_duration': int(len(tokens) * delay * 1e9),
+                }
+
+                if request.get('stream', True) is False:
+                    time.sleep(len(tokens) * delay)
+                    final['total_duration'] = int((time.perf_counter() - started) * 1e9)
+                    self._json(self._base(request) | wrap(''.join(tokens)) | final)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                try:
+                    for token in tokens:
+                        time.sleep(delay)
+                        self._chunk(self._base(request) | wrap(token) | {'done': False})
+                    final['total_duration'] = int((time.perf_counter() - started) * 1e9)
+                    self._chunk(self._base(request) | wrap('') | final)
+                    self.wfile.write(b'0\r\n\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading, e.g. a cancelled generation
+                    pass
+
+            def _chunk(self, payload):
+                line = json.dumps(payload).encode() + b'\n'
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b'\r\n')
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11500)
+    parser.add_argument('--latency', type=float, default=0.05, help='fixed seconds per request')
+    parser.add_argument('--prompt-rate', type=float, default=2000.0, help='prompt tokens evaluated per second')
+    parser.add_argument('--token-rate', type=float, default=50.0, help='generated tokens per second (0: no delay)')
+    parser.add_argument('--max-tokens', type=int, default=None, help='truncate replies to this many tokens')
+    parser.add_argument('--responses', help='JSON file of {"prompt substring": "reply"} overrides')
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses, 'r', encoding='utf-8') as f:
+            responses = json.load(f)
+    logging.basicConfig(level=logging.INFO)
+    stub = StubOllama(args.host, args.port, args.latency, args.prompt_rate, args.token_rate, args.max_tokens, responses)
+    logger.info(f"Stub Ollama listening on {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
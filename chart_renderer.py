@@ -0,0 +1,415 @@
+import hashlib
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+import llm_client
+from dataset_cache import get_dataset_cache
+from result_cache import TieredCache
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+CHARTS_DIR = os.path.join('exports', 'charts')
+CHART_WORKERS = int(os.environ.get('CHART_WORKERS', 2))
+CHART_TIMEOUT = float(os.environ.get('CHART_TIMEOUT', 30))
+MAX_CHARTS = 4
+# Bump when rendering or the spec prompt changes so stale charts are not reused
+CHART_VERSION = 'v1'
+CHART_TYPES = ('histogram', 'bar', 'line', 'scatter')
+HISTOGRAM_BINS = 50
+LINE_BINS = 200
+MAX_BARS = 20
+# Above this many rows scatter plots are rasterized into a density grid
+SCATTER_POINTS = 5000
+DENSITY_GRID = 200
+
+_render_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_render_pool():
+    global _render_pool
+    if _render_pool is None:
+        with _pool_lock:
+            if _render_pool is None:
+                # Spawned workers do not inherit the server's threads and locks
+                _render_pool = ProcessPoolExecutor(max_workers=CHART_WORKERS,
+                                                   mp_context=multiprocessing.get_context('spawn'))
+    return _render_pool
+
+
+def _reset_render_pool():
+    # A crashed worker leaves the pool unusable; the next render starts a fresh one
+    global _render_pool
+    with _pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=False)
+        _render_pool = None
+
+
+def chart_specs(profile: Dict, suggestions: List[str]) -> List[Dict]:
+    """
+    Ask the chat model to turn visualization suggestions into chart specs
+    ({title, type, x, y, agg}) over the profiled columns; invalid specs are dropped.
+    """
+    columns = profile['columns']
+    listing = "\n".join(f"- {name} ({column['dtype']})" for name, column in columns.items())
+    numbered = "\n".join(f"{index}. {suggestion}" for index, suggestion in enumerate(suggestions, 1))
+    prompt = (
+        f"Dataset columns:\n{listing}\n\n"
+        f"Visualization suggestions:\n{numbered}\n\n"
+        f"Turn up to {MAX_CHARTS} of the suggestions into chart specifications. Respond with JSON of the form "
+        '{"charts": [{"title": "...", "type": "histogram|bar|line|scatter", "x": "<column>", '
+        '"y": "<column or null>", "agg": "count|mean|sum"}]}. '
+        "histogram uses one numeric x; bar groups by a categorical x and aggregates y (or counts rows); "
+        "line and scatter need numeric x and y. Use only the column names listed above."
+    )
+    response = llm_client.chat(model=llm_client.MODELS['chat'], messages=[{"role": "user", "content": prompt}],
+                               format='json', options={'temperature': 0})
+    try:
+        charts = json.loads(response['message']['content']).get('charts', [])
+    except (ValueError, AttributeError):
+        return []
+
+    specs = []
+    for chart in charts if isinstance(charts, list) else []:
+        if not isinstance(chart, dict):
+            continue
+        spec = {
+            'title': str(chart.get('title') or ''),
+            'type': chart.get('type'),
+            'x': chart.get('x'),
+            'y': chart.get('y') or None,
+            'agg': chart.get('agg') if chart.get('agg') in ('count', 'mean', 'sum') else 'count',
+        }
+        if spec['type'] not in CHART_TYPES or spec['x'] not in columns:
+            continue
+        if spec['y'] is not None and spec['y'] not in columns:
+            continue
+        numeric_x = 'mean' in columns[spec['x']]
+        numeric_y = spec['y'] is not None and 'mean' in columns[spec['y']]
+        if spec['type'] == 'histogram' and not numeric_x:
+            continue
+        if spec['type'] in ('line', 'scatter') and not (numeric_x and numeric_y):
+            continue
+        if spec['type'] == 'bar' and spec['agg'] != 'count' and not numeric_y:
+            spec['agg'] = 'count'
+        specs.append(spec)
+    return specs[:MAX_CHARTS]
+
+
+class _Aggregator:
+    """
+    Reduces the table to the few hundred values one chart needs as chunks stream past:
+    histogram bins, per-category aggregates, binned line means or a density grid.
+    """
+
+    def __init__(self, spec: Dict, profile: Dict):
+        columns = profile['columns']
+        self.spec = spec
+        self.kind = spec['type']
+        self.x, self.y = spec['x'], spec['y']
+        if self.kind == 'histogram':
+            self.edges = np.linspace(columns[self.x]['min'], columns[self.x]['max'], HISTOGRAM_BINS + 1)
+            self.counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+        elif self.kind == 'bar':
+            self.totals = None
+        elif self.kind == 'line':
+            self.edges = np.linspace(columns[self.x]['min'], columns[self.x]['max'], LINE_BINS + 1)
+            self.sums = np.zeros(LINE_BINS)
+            self.counts = np.zeros(LINE_BINS)
+        elif profile['row_count'] <= SCATTER_POINTS:
+            # Scatter: raw points for small tables, a rasterized density grid otherwise
+            self.bounds = None
+            self.xs, self.ys = [], []
+        else:
+            self.bounds = [[columns[self.x]['min'], columns[self.x]['max']], [columns[self.y]['min'], columns[self.y]['max']]]
+            self.grid = np.zeros((DENSITY_GRID, DENSITY_GRID), dtype=np.int64)
+
+    def _pairs(self, chunk):
+        return pd.DataFrame({'x': pd.to_numeric(chunk[self.x], errors='coerce'),
+                             'y': pd.to_numeric(chunk[self.y], errors='coerce')}).dropna()
+
+    def add(self, chunk: pd.DataFrame):
+        x, y = self.x, self.y
+        if self.kind == 'histogram':
+            values = pd.to_numeric(chunk[x], errors='coerce').dropna().to_numpy(dtype=np.float64)
+            self.counts += np.histogram(values, bins=self.edges)[0]
+        elif self.kind == 'bar':
+            if self.spec['agg'] == 'count' or y is None:
+                part = chunk[x].astype(str).value_counts().to_frame('count')
+                part['sum'] = part['count']
+            else:
+                numbers = pd.to_numeric(chunk[y], errors='coerce')
+                part = numbers.groupby(chunk[x].astype(str)).agg(['sum', 'count'])
+            self.totals = part if self.totals is None else self.totals.add(part, fill_value=0)
+        elif self.kind == 'line':
+            frame = self._pairs(chunk)
+            index = np.clip(np.searchsorted(self.edges, frame['x'].to_numpy(), side='right') - 1, 0, LINE_BINS - 1)
+            self.sums += np.bincount(index, weights=frame['y'].to_numpy(), minlength=LINE_BINS)
+            self.counts += np.bincount(index, minlength=LINE_BINS)
+        elif self.bounds is None:
+            frame = self._pairs(chunk)
+            self.xs.extend(frame['x'].tolist())
+            self.ys.extend(frame['y'].tolist())
+        else:
+            frame = self._pairs(chunk)
+            self.grid += np.histogram2d(frame['x'].to_numpy(), frame['y'].to_numpy(), bins=DENSITY_GRID,
+                                        range=self.bounds)[0].astype(np.int64)
+
+    def result(self) -> Dict:
+        if self.kind == 'histogram':
+            return {'edges': self.edges.tolist(), 'counts': self.counts.tolist()}
+        if self.kind == 'bar':
+            totals = self.totals
+            if totals is None:
+                return {'labels': [], 'values': []}
+            if self.spec['agg'] == 'mean':
+                values = totals['sum'] / totals['count'].replace(0, np.nan)
+            elif self.spec['agg'] == 'sum':
+                values = totals['sum']
+            else:
+                values = totals['count']
+            values = values.dropna().sort_values(ascending=False).head(MAX_BARS)
+            return {'labels': [str(label) for label in values.index], 'values': values.tolist()}
+        if self.kind == 'line':
+            filled = self.counts > 0
+            centers = (self.edges[:-1] + self.edges[1:]) / 2
+            return {'x': centers[filled].tolist(), 'y': (self.sums[filled] / self.counts[filled]).tolist()}
+        if self.bounds is None:
+            return {'x': self.xs, 'y': self.ys}
+        bounds = self.bounds
+        return {'grid': self.grid.tolist(), 'extent': [bounds[0][0], bounds[0][1], bounds[1][0], bounds[1][1]]}
+
+
+def aggregate_all(chunks, specs: List[Dict], profile: Dict) -> List[Optional[Dict]]:
+    """
+    Aggregate the data of every chart in `specs` in a single pass over `chunks`.
+    A chart whose aggregation fails gets None instead of stopping the others.
+    """
+    aggregators = []
+    for spec in specs:
+        try:
+            aggregators.append(_Aggregator(spec, profile))
+        except Exception as e:
+            logger.error(f"Error preparing chart {spec}: {e}")
+            aggregators.append(None)
+    for chunk in chunks:
+        for index, aggregator in enumerate(aggregators):
+            if aggregator is None:
+                continue
+            try:
+                aggregator.add(chunk)
+            except Exception as e:
+                logger.error(f"Error aggregating chart {aggregator.spec}: {e}")
+                aggregators[index] = None
+    return [aggregator.result() if aggregator is not None else None for aggregator in aggregators]
+
+
+def aggregate(chunks, spec: Dict, profile: Dict) -> Dict:
+    """Aggregate the data of a single chart in one streaming pass."""
+    return aggregate_all(chunks, [spec], profile)[0]
+
+
+def _render_charts(cache_dir: str, file_path: str, sheets, specs: List[Dict], paths: List[str], profile: Dict) -> List[str]:
+    """
+    Aggregate the charts in one scan of the cached table and render each to its path.
+    Runs in a worker process, so neither the scan nor plotting holds up a request.
+    """
+    from dataset_cache import DatasetCache
+    chunks = DatasetCache(cache_dir=cache_dir).iter_chunks(file_path, sheets)
+    rendered = []
+    for spec, path, data in zip(specs, paths, aggregate_all(chunks, specs, profile)):
+        if data is None:
+            continue
+        try:
+            rendered.append(_render_chart(spec, data, path))
+        except Exception as e:
+            logger.error(f"Error rendering chart {spec}: {e}")
+    return rendered
+
+
+def _render_chart(spec: Dict, data: Dict, path: str) -> str:
+    """Render aggregated chart data to a PNG at `path`. Runs in a worker process."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(7, 4), dpi=100)
+    try:
+        kind = spec['type']
+        if kind == 'histogram':
+            edges = np.asarray(data['edges'])
+            ax.bar(edges[:-1], data['counts'], width=np.diff(edges), align='edge')
+            ax.set_xlabel(spec['x'])
+            ax.set_ylabel('count')
+        elif kind == 'bar':
+            ax.bar(range(len(data['labels'])), data['values'])
+            ax.set_xticks(range(len(data['labels'])))
+            ax.set_xticklabels(data['labels'], rotation=45, ha='right')
+            ax.set_xlabel(spec['x'])
+            ax.set_ylabel(spec['agg'] if spec['agg'] == 'count' else f"{spec['agg']} of {spec['y']}")
+        elif kind == 'line':
+            ax.plot(data['x'], data['y'])
+            ax.set_xlabel(spec['x'])
+            ax.set_ylabel(f"mean {spec['y']}")
+        elif 'grid' in data:
+            grid = np.asarray(data['grid'], dtype=np.float64).T
+            ax.imshow(np.log1p(grid), origin='lower', extent=data['extent'], aspect='auto', cmap='viridis')
+            ax.set_xlabel(spec['x'])
+            ax.set_ylabel(spec['y'])
+        else:
+            ax.scatter(data['x'], data['y'], s=6, alpha=0.5)
+            ax.set_xlabel(spec['x'])
+            ax.set_ylabel(spec['y'])
+        ax.set_title(spec['title'])
+        fig.tight_layout()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            fig.savefig(f, format='png')
+        os.replace(tmp_path, path)
+    finally:
+        plt.close(fig)
+    return path
+
+
+class ChartRenderer:
+    """
+    Renders the insights' visualization suggestions as PNGs under `charts_dir`.
+
+    The charts of a dataset are aggregated in one pass over the cached table and drawn
+    with Matplotlib in a process pool; render_suggested returns their names without
+    waiting, and wait() lets the chart route hold a request until its file is written.
+    File names are hashes of the dataset content and chart spec, so a chart is rendered
+    once and can be served with long-lived cache headers.
+    """
+
+    def __init__(self, charts_dir=CHARTS_DIR, dataset_cache=None, cache=None, timeout=CHART_TIMEOUT):
+        self.charts_dir = charts_dir
+        self.dataset_cache = dataset_cache or get_dataset_cache()
+        self.cache = cache or TieredCache(os.path.join('cache', 'charts'), max_entries=256, max_disk_entries=2000)
+        self.timeout = timeout
+        # filename -> future of the render that will write it
+        self._pending = {}
+        self._lock = threading.Lock()
+        if not os.path.exists(self.charts_dir):
+            os.makedirs(self.charts_dir)
+
+    def render_suggested(self, profile: Dict, suggestions: List[str]) -> List[Dict]:
+        """
+        Return [{'title', 'filename'}] for the charts of `suggestions`. Charts not on disk yet
+        are rendered in the background; their files appear once the worker writes them.
+        """
+        file_path = profile.get('source')
+        if not suggestions or not file_path or not os.path.exists(file_path):
+            return []
+        if importlib.util.find_spec('matplotlib') is None:
+            logger.info("matplotlib is not installed; skipping chart rendering")
+            return []
+
+        sheets = profile.get('sheets')
+        dataset = self.dataset_cache.dataset_key(file_path, sheets)
+        schema = [[name, column['dtype']] for name, column in profile['columns'].items()]
+        key = hashlib.sha256(json.dumps(['specs', CHART_VERSION, llm_client.MODELS['chat'], schema, suggestions])
+                             .encode('utf-8')).hexdigest()
+        specs = self.cache.get(key)
+        if specs is None:
+            try:
+                specs = chart_specs(profile, suggestions)
+            except Exception as e:
+                logger.error(f"Error generating chart specs: {e}")
+                return []
+            self.cache.set(key, specs)
+
+        charts = []
+        missing = []
+        for spec in specs:
+            name = hashlib.sha256(json.dumps([CHART_VERSION, dataset, spec], sort_keys=True).encode('utf-8')).hexdigest()[:32]
+            filename = f"{name}.png"
+            path = os.path.join(self.charts_dir, filename)
+            charts.append({'title': spec['title'], 'filename': filename})
+            if os.path.exists(path) or filename in self._pending:
+                continue
+            missing.append((spec, filename, path))
+        if not missing:
+            return charts
+
+        try:
+            # Absolute paths: the worker keeps the working directory it was spawned in
+            future = _get_render_pool().submit(_render_charts, os.path.abspath(self.dataset_cache.cache_dir),
+                                               os.path.abspath(file_path), sheets, [spec for spec, _, _ in missing],
+                                               [os.path.abspath(path) for _, _, path in missing], profile)
+        except Exception as e:
+            logger.error(f"Error scheduling charts: {e}")
+            _reset_render_pool()
+            return [chart for chart in charts if os.path.exists(os.path.join(self.charts_dir, chart['filename']))]
+        filenames = [filename for _, filename, _ in missing]
+        with self._lock:
+            for filename in filenames:
+                self._pending[filename] = future
+        future.add_done_callback(lambda done: self._finished(done, filenames))
+        return charts
+
+    def _finished(self, future, filenames):
+        with self._lock:
+            for filename in filenames:
+                self._pending.pop(filename, None)
+        try:
+            future.result()
+        except BrokenProcessPool as e:
+            logger.error(f"Chart worker crashed: {e}")
+            _reset_render_pool()
+        except Exception as e:
+            logger.error(f"Error rendering charts: {e}")
+
+    def wait(self, filename: str, timeout=None) -> bool:
+        """Wait up to `timeout` (default: the render timeout) for a pending chart; True once its file exists."""
+        with self._lock:
+            future = self._pending.get(filename)
+        if future is not None:
+            try:
+                future.result(timeout=self.timeout if timeout is None else timeout)
+            except Exception:
+                pass
+        return os.path.exists(os.path.join(self.charts_dir, filename))
+
+    def wait_all(self, timeout=None):
+        """Block until the charts queued so far are rendered, e.g. in tests and benchmarks."""
+        with self._lock:
+            futures = set(self._pending.values())
+        for future in futures:
+            try:
+                future.result(timeout)
+            except Exception:
+                pass
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_chart_renderer():
+    """Return the process-wide ChartRenderer, creating it on first use."""
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = ChartRenderer()
+    return _renderer
+
+
+def render_suggested_charts(profile: Dict, suggestions: List[str]) -> List[Dict]:
+    return get_chart_renderer().render_suggested(profile, suggestions)
+
+
+def wait_for_chart(filename: str) -> bool:
+    return get_chart_renderer().wait(filename)
@@ -1,15 +1,121 @@
 import logging
-import ollama 
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import llm_client
+from conversation_memory import get_conversation_memory
 
-def process_general_chat(user_input):
+# Threads that run chat generations speculatively, before the intent is known
+_speculation_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='speculative-chat')
+
+def process_general_chat(user_input, conversation=None):
     """
     Processes a general conversation input using an LLM.
+    With a `conversation` (the session's state from conversation_memory.new_conversation),
+    earlier turns are sent within the history token budget and the new turn is recorded.
     """
     try:
-        response = ollama.chat(model='qwen2.5:3B', messages=[{"role": "user", "content": user_input}])
+        memory = get_conversation_memory()
+        response = llm_client.chat(model=llm_client.MODELS['chat'], messages=memory.messages(conversation, user_input))
         chat_response = response['message']['content']
+        memory.record(conversation, user_input, chat_response)
         logging.info("General chat response generated by LLM.")
         return chat_response
     except Exception as e:
         logging.error(f"Error in general chat processing: {e}")
         return "Sorry, something went wrong processing your message."
+
+
+def stream_general_chat(user_input, cancel_event=None, conversation=None, on_complete=None):
+    """
+    Streams the LLM reply to a general conversation input, yielding text chunks as they are generated.
+    Stops early, closing the connection so the server aborts generation, once `cancel_event` is set.
+    A completed reply is recorded in `conversation`, or passed to `on_complete` instead when given;
+    a cancelled one is not.
+    """
+    stream = None
+    try:
+        memory = get_conversation_memory()
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        stream = iter(llm_client.chat(model=llm_client.MODELS['chat'], messages=memory.messages(conversation, user_input), stream=True))
+        parts = []
+        while True:
+            # Checked before waiting for the next chunk, so a cancelled generation stops promptly
+            if cancel_event is not None and cancel_event.is_set():
+                logging.info("General chat generation cancelled.")
+                return
+            chunk = next(stream, None)
+            if chunk is None:
+                break
+            content = chunk['message']['content']
+            if content:
+                parts.append(content)
+                yield content
+        if on_complete is not None:
+            on_complete(''.join(parts))
+        else:
+            memory.record(conversation, user_input, ''.join(parts))
+        logging.info("General chat response streamed by LLM.")
+    except Exception as e:
+        logging.error(f"Error in general chat streaming: {e}")
+        yield "Sorry, something went wrong processing your message."
+    finally:
+        if stream is not None and hasattr(stream, 'close'):
+            stream.close()
+
+
+class SpeculativeChat:
+    """
+    General chat generation started on a worker thread while intent detection is still running.
+    Call cancel() if the message turns out not to be general chat; otherwise consume chunks().
+    The turn is only recorded in `conversation` once chunks() has delivered the whole reply,
+    so a reply generated for a message that proves not to be general chat is never remembered.
+    """
+
+    def __init__(self, user_input, conversation=None):
+        self._user_input = user_input
+        self._conversation = conversation
+        self._reply = None
+        self._chunks = queue.Queue()
+        self._cancelled = threading.Event()
+        self._future = _speculation_pool.submit(self._produce)
+
+    def _produce(self):
+        try:
+            for chunk in stream_general_chat(self._user_input, cancel_event=self._cancelled,
+                                             conversation=self._conversation, on_complete=self._complete):
+                self._chunks.put(chunk)
+        finally:
+            self._chunks.put(None)
+
+    def _complete(self, reply):
+        self._reply = reply
+
+    def cancel(self):
+        self._cancelled.set()
+        self._future.cancel()
+
+    def chunks(self):
+        """
+        Yield generated text chunks, including those produced before this call. If the consumer
+        stops early (e.g. the client disconnected), generation is cancelled to free its model slot.
+        """
+        finished = False
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is None:
+                    break
+                yield chunk
+            finished = True
+        finally:
+            if not finished:
+                self.cancel()
+        if self._reply is not None:
+            get_conversation_memory().record(self._conversation, self._user_input, self._reply)
+            self._reply = None
+
+    def result(self):
+        """Block until generation finishes and return the full reply."""
+        return ''.join(self.chunks())
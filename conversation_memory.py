@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import llm_client
+import metrics
+from result_cache import TieredCache
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+# Prompt tokens the verbatim recent turns may use; older turns are folded into the summary
+CHAT_HISTORY_TOKENS = int(os.environ.get('CHAT_HISTORY_TOKENS', 1500))
+# Upper bound on the length of the rolling summary
+CHAT_SUMMARY_TOKENS = int(os.environ.get('CHAT_SUMMARY_TOKENS', 300))
+# Hard cap on the turns kept verbatim or awaiting summary; if summaries lag or fail
+# (e.g. Ollama is down) the oldest unsummarized turns are dropped instead of piling up
+CHAT_MAX_TURNS = int(os.environ.get('CHAT_MAX_TURNS', 100))
+CHARS_PER_TOKEN = 4
+# Role and formatting tokens added by the chat template per message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Bump when the summary prompt changes so stale cached summaries are not reused
+SUMMARY_PROMPT_VERSION = 'v1'
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant about breast health, "
+    "data analysis and related topics. The user's message contains the current summary, which may be empty, "
+    "followed by the turns that happened after it.\n\n"
+    "Write an updated summary that keeps the facts, names, numbers, questions and decisions later turns may "
+    "refer back to, and drops greetings and repetition. Write plain prose in the third person, at most a few "
+    "short paragraphs. Reply with the summary only."
+)
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def new_conversation():
+    """
+    Empty per-session conversation state: the rolling summary, and the turns not yet
+    folded into it. turns[window:] are sent verbatim; turns[:window] are waiting to be
+    summarized.
+    """
+    return {'summary': '', 'turns': [], 'window': 0}
+
+
+def _turn_tokens(turn):
+    return estimate_tokens(turn['user']) + estimate_tokens(turn['assistant'])
+
+
+class ConversationMemory:
+    """
+    Token-budgeted chat history. Each turn sends the summary of older turns followed by the
+    recent turns verbatim, so the prompt stays within roughly `history_tokens` plus
+    `summary_tokens` however long the conversation runs.
+
+    When the verbatim turns outgrow the budget, the oldest are moved out of the window in
+    one step, leaving it half full; the message prefix then stays unchanged for several
+    turns, so Ollama can serve it from the KV cache instead of re-evaluating earlier turns.
+    The turns moved out are summarized on a background thread; the summary is applied on
+    a later turn and cached by content, so any worker process can pick it up.
+    """
+
+    def __init__(self, history_tokens=CHAT_HISTORY_TOKENS, summary_tokens=CHAT_SUMMARY_TOKENS, cache=None,
+                 max_turns=CHAT_MAX_TURNS):
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.max_turns = max_turns
+        self.cache = cache or TieredCache(os.path.join('cache', 'summaries'), max_entries=256, max_disk_entries=5000)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='summarize')
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def messages(self, conversation, user_input):
+        """Chat messages for `user_input`: the summary, the recent turns and the new message."""
+        if conversation is None:
+            return [{"role": "user", "content": user_input}]
+        self._apply_summary(conversation)
+        messages = []
+        if conversation['summary']:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{conversation['summary']}"})
+        for turn in conversation['turns'][conversation['window']:]:
+            messages.append({"role": "user", "content": turn['user']})
+            messages.append({"role": "assistant", "content": turn['assistant']})
+        messages.append({"role": "user", "content": user_input})
+        return messages
+
+    def record(self, conversation, user_input, reply):
+        """Append a completed turn and, once the window is over budget, schedule a summary."""
+        if conversation is None:
+            return
+        conversation['turns'].append({'user': user_input, 'assistant': reply})
+        self._truncate(conversation)
+        turns = conversation['turns']
+        window = conversation['window']
+        tokens = sum(_turn_tokens(turn) for turn in turns[window:])
+        if tokens <= self.history_tokens:
+            return
+        while window < len(turns) and tokens > self.history_tokens // 2:
+            tokens -= _turn_tokens(turns[window])
+            window += 1
+        conversation['window'] = window
+        logger.info(f"Moved {window} turns out of the chat window for summarization")
+        self._schedule(conversation['summary'], turns[:window])
+
+    def _truncate(self, conversation):
+        # Summaries are behind: drop the oldest turns, which are the ones awaiting summary
+        excess = len(conversation['turns']) - self.max_turns
+        if excess <= 0:
+            return
+        del conversation['turns'][:excess]
+        conversation['window'] = max(conversation['window'] - excess, 0)
+        logger.warning(f"Dropped {excess} unsummarized chat turns; the conversation summary is behind")
+
+    def _key(self, summary, turns):
+        payload = [llm_client.MODELS['chat'], SUMMARY_PROMPT_VERSION, summary, turns]
+        return hashlib.sha256(json.dumps(payload).encode('utf-8')).hexdigest()
+
+    def _apply_summary(self, conversation):
+        window = conversation['window']
+        if not window:
+            return
+        folded = conversation['turns'][:window]
+        summary = self.cache.get(self._key(conversation['summary'], folded))
+        if summary is None:
+            # Still running, or computed for a shorter span; make sure this span is queued
+            self._schedule(conversation['summary'], folded)
+            return
+        conversation['summary'] = summary
+        del conversation['turns'][:window]
+        conversation['window'] = 0
+
+    def _schedule(self, summary, turns):
+        key = self._key(summary, turns)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending[key] = self._executor.submit(self._summarize, key, summary, list(turns))
+
+    def _summarize(self, key, summary, turns):
+        try:
+            if self.cache.get(key) is not None:
+                return
+            transcript = "\n\n".join(f"User: {turn['user']}\nAssistant: {turn['assistant']}" for turn in turns)
+            with metrics.timed('summarize'):
+                response = llm_client.chat(model=llm_client.MODELS['chat'], messages=[
+                    {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"},
+                ], options={'num_predict': self.summary_tokens})
+            self.cache.set(key, response['message']['content'].strip())
+            logger.info(f"Summarized {len(turns)} chat turns")
+        except Exception as e:
+            logger.error(f"Error summarizing the conversation: {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def wait(self, timeout=None):
+        """Block until the summaries queued so far are done, e.g. in tests and benchmarks."""
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.result(timeout)
+
+
+_memory = None
+_memory_lock = threading.Lock()
+
+
+def get_conversation_memory():
+    """Return the process-wide ConversationMemory, creating it on first use."""
+    global _memory
+    if _memory is None:
+        with _memory_lock:
+            if _memory is None:
+                _memory = ConversationMemory()
+    return _memory
@@ -1,90 +1,200 @@
-import pandas as pd
-from typing import Tuple, List, Dict
-import ollama
+from typing import Tuple, List, Dict, Optional
+import llm_client
+import metrics
+import hashlib
+import json
 import logging
+import os
+from result_cache import TieredCache
+# The profiling, query and chart modules pull in pandas, pyarrow, duckdb and matplotlib;
+# they are imported inside the functions that use them to keep application startup fast
 
 # Get the logger for this module
 logger = logging.getLogger(__name__)
 
-def read_data_file(file_path: str) -> Tuple[bool, pd.DataFrame]:
+# Example rows sent with the profile: 'reservoir', 'stratified', 'outlier' or 'head'
+SAMPLING_MODE = os.environ.get('DATA_SAMPLING_MODE', 'reservoir')
+STRATIFY_COLUMN = os.environ.get('DATA_STRATIFY_COLUMN')
+# Prompt tokens the example rows may use
+SAMPLE_TOKEN_BUDGET = int(os.environ.get('DATA_SAMPLE_TOKENS', 800))
+
+# Bump when the insights prompt changes so stale cached insights are not served
+INSIGHTS_PROMPT_VERSION = 'v2'
+INSIGHT_CACHE_TTL = float(os.environ.get('INSIGHT_CACHE_TTL', 7 * 24 * 3600))
+# Execute the suggested queries against the uploaded file and show their results
+RUN_SUGGESTED_QUERIES = os.environ.get('RUN_SUGGESTED_QUERIES', '1') == '1'
+# Render the visualization suggestions as PNG charts served from /charts
+RENDER_CHARTS = os.environ.get('RENDER_CHARTS', '1') == '1'
+insight_cache = TieredCache(os.path.join('cache', 'insights'), max_entries=256, max_disk_entries=2000, ttl=INSIGHT_CACHE_TTL)
+
+@metrics.timed('parse_data')
+def read_data_file(file_path: str, sampling: str = SAMPLING_MODE, token_budget: int = SAMPLE_TOKEN_BUDGET,
+                   stratify_by: Optional[str] = STRATIFY_COLUMN, sheets=None) -> Tuple[bool, Dict]:
     """
-    Read CSV or Excel file and return the first 4 rows as a sample.
+    Stream a CSV or Excel file once and return a compact profile of every column,
+    with example rows drawn by the chosen sampling mode within `token_budget` tokens.
+    Profiles are cached per file content, so re-entering the same file does not re-parse it.
+    `sheets` selects workbook sheets: 'all' or a list of names; None uses EXCEL_SHEETS,
+    or the first sheet when that is not set.
     """
+    from data_sampling import budget_sampler
+    from dataset_cache import get_dataset_cache
+    from excel_reader import DEFAULT_SHEETS
     try:
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        elif file_path.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(file_path)
-        else:
+        if not file_path.endswith(('.csv', '.xlsx', '.xls')):
             return False, "Unsupported file format. Please upload a CSV or Excel file."
         
-        return True, df.head(4)
+        if file_path.endswith('.csv'):
+            sheets = None
+        elif sheets is None:
+            sheets = DEFAULT_SHEETS
+        profile_key = f"{sampling}:{token_budget}:{stratify_by}"
+        return True, get_dataset_cache().profile(file_path, profile_key, budget_sampler(sampling, token_budget, stratify_by),
+                                                 sheets=sheets)
     except Exception as e:
         logger.error(f"Error reading file: {e}")
         return False, str(e)
 
-def generate_data_insights(df: pd.DataFrame) -> Dict:
-    """
-    Generate insights and suggested queries using Ollama model.
-    """
-    # Convert DataFrame to a readable string format
-    data_str = df.to_string()
-    columns_info = "\n".join([f"- {col}: {dtype}" for col, dtype in df.dtypes.items()])
-    
-    structured_prompt = (
-        "You are a data analysis expert. Analyze the following data sample and provide insights and suggested queries.\n\n"
-        "Data Sample:\n"
-        f"{data_str}\n\n"
-        "Column Information:\n"
-        f"{columns_info}\n\n"
-        "Please provide:\n"
-        "1. A brief analysis of the data structure and potential insights\n"
-        "2. A list of 5-7 specific, actionable queries that would help understand the data better\n"
-        "3. Suggestions for what kind of visualizations might be useful\n\n"
-        "Format your response as follows:\n"
-        "ANALYSIS:\n"
-        "<your analysis>\n\n"
-        "SUGGESTED QUERIES:\n"
-        "- <query 1>\n"
-        "- <query 2>\n"
-        "...\n\n"
-        "VISUALIZATION SUGGESTIONS:\n"
-        "- <suggestion 1>\n"
-        "- <suggestion 2>\n"
-        "..."
+def _schema_signature(profile: Dict) -> List:
+    return [[name, column['dtype']] for name, column in profile['columns'].items()]
+
+def _cache_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+# Static instructions sent as the system message; the dataset profile follows as the
+# user message, so the instructions stay a reusable prefix in the model's KV cache
+INSIGHTS_SYSTEM_PROMPT = (
+    "You are a data analysis expert. Analyze the dataset profile in the user's message and provide insights and suggested queries.\n\n"
+    "Please provide:\n"
+    "1. A brief analysis of the data structure and potential insights\n"
+    "2. A list of 5-7 specific, actionable queries that would help understand the data better\n"
+    "3. Suggestions for what kind of visualizations might be useful\n\n"
+    "Format your response as follows:\n"
+    "ANALYSIS:\n"
+    "<your analysis>\n\n"
+    "SUGGESTED QUERIES:\n"
+    "- <query 1>\n"
+    "- <query 2>\n"
+    "...\n\n"
+    "VISUALIZATION SUGGESTIONS:\n"
+    "- <suggestion 1>\n"
+    "- <suggestion 2>\n"
+    "..."
+)
+
+ANALYSIS_SYSTEM_PROMPT = (
+    "You are a data analysis expert. Analyze the dataset profile in the user's message.\n\n"
+    "Please provide a brief analysis of the data structure and potential insights.\n\n"
+    "Format your response as follows:\n"
+    "ANALYSIS:\n"
+    "<your analysis>"
+)
+
+def _profile_message(profile: Dict) -> str:
+    from data_profiler import format_profile
+    # Full-dataset column statistics plus a few example rows
+    profile_str = format_profile(profile)
+    sample_str = "\n".join(str(record) for record in profile['sample'])
+    return (
+        "Dataset Profile (computed over all rows):\n"
+        f"{profile_str}\n\n"
+        f"Example Rows ({profile.get('sampling', 'head')} sample of {len(profile['sample'])}):\n"
+        f"{sample_str}"
     )
+
+def _insights_messages(profile: Dict, analysis_only: bool = False) -> List[Dict]:
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT if analysis_only else INSIGHTS_SYSTEM_PROMPT},
+        {"role": "user", "content": _profile_message(profile)},
+    ]
+
+def _parse_insights(insights: str) -> Dict:
+    # Parse the response into sections
+    sections = {
+        "analysis": "",
+        "queries": [],
+        "visualizations": []
+    }
     
-    try:
-        response = ollama.chat(model='qwen2.5:3B', messages=[{"role": "user", "content": structured_prompt}])
-        insights = response['message']['content']
-        logger.info("Data insights generated successfully")
-        
-        # Parse the response into sections
-        sections = {
-            "analysis": "",
-            "queries": [],
-            "visualizations": []
-        }
+    current_section = None
+    for line in insights.split('\n'):
+        if line.startswith('ANALYSIS:'):
+            current_section = 'analysis'
+            continue
+        elif line.startswith('SUGGESTED QUERIES:'):
+            current_section = 'queries'
+            continue
+        elif line.startswith('VISUALIZATION SUGGESTIONS:'):
+            current_section = 'visualizations'
+            continue
         
-        current_section = None
-        for line in insights.split('\n'):
-            if line.startswith('ANALYSIS:'):
-                current_section = 'analysis'
-                continue
-            elif line.startswith('SUGGESTED QUERIES:'):
-                current_section = 'queries'
-                continue
-            elif line.startswith('VISUALIZATION SUGGESTIONS:'):
-                current_section = 'visualizations'
-                continue
-            
-            if current_section == 'analysis':
-                sections['analysis'] += line + '\n'
-            elif current_section == 'queries' and line.strip().startswith('-'):
-                sections['queries'].append(line.strip()[2:])
-            elif current_section == 'visualizations' and line.strip().startswith('-'):
-                sections['visualizations'].append(line.strip()[2:])
+        if current_section == 'analysis':
+            sections['analysis'] += line + '\n'
+        elif current_section == 'queries' and line.strip().startswith('-'):
+            sections['queries'].append(line.strip()[2:])
+        elif current_section == 'visualizations' and line.strip().startswith('-'):
+            sections['visualizations'].append(line.strip()[2:])
+    
+    return sections
+
+def generate_data_insights(profile: Dict, run_queries: bool = RUN_SUGGESTED_QUERIES,
+                           render_charts: bool = RENDER_CHARTS) -> Dict:
+    """
+    Generate insights and suggested queries using Ollama model. With `run_queries`, the
+    suggested queries are also executed against the file and their results attached
+    under 'query_results'; with `render_charts`, the visualization suggestions are
+    rendered and listed under 'charts'.
+    """
+    insights = dict(_generate_insights(profile))
+    if insights.get('error'):
+        return insights
+    if run_queries:
+        from query_engine import run_suggested_queries
+        with metrics.timed('queries'):
+            insights['query_results'] = run_suggested_queries(profile, insights['queries'])
+    if render_charts:
+        from chart_renderer import render_suggested_charts
+        with metrics.timed('charts'):
+            insights['charts'] = render_suggested_charts(profile, insights['visualizations'])
+    return insights
+
+@metrics.timed('insights_llm')
+def _generate_insights(profile: Dict) -> Dict:
+    """
+    Results are cached on the model, prompt version and full messages. Files with the same
+    schema (column names and types) reuse the cached queries and visualization
+    suggestions, and only the data-dependent analysis is regenerated.
+    """
+    model = llm_client.MODELS['chat']
+    messages = _insights_messages(profile)
+    key = _cache_key('insights', model, INSIGHTS_PROMPT_VERSION, messages)
+    schema_key = _cache_key('schema', model, INSIGHTS_PROMPT_VERSION, _schema_signature(profile))
+
+    cached = insight_cache.get(key)
+    if cached is not None:
+        logger.info("Data insights served from cache")
+        return dict(cached)
+
+    try:
+        structure = insight_cache.get(schema_key)
+        if structure is not None:
+            # Same columns as a previous file: only the analysis depends on the data
+            response = llm_client.chat(model=model, messages=_insights_messages(profile, analysis_only=True))
+            sections = _parse_insights(response['message']['content'])
+            sections['queries'] = list(structure['queries'])
+            sections['visualizations'] = list(structure['visualizations'])
+            logger.info("Data insights generated reusing cached structure for this schema")
+        else:
+            response = llm_client.chat(model=model, messages=messages)
+            sections = _parse_insights(response['message']['content'])
+            logger.info("Data insights generated successfully")
+            if sections['queries'] or sections['visualizations']:
+                insight_cache.set(schema_key, {
+                    'queries': sections['queries'],
+                    'visualizations': sections['visualizations'],
+                })
         
+        insight_cache.set(key, sections)
         return sections
         
     except Exception as e:
@@ -92,7 +202,8 @@ def generate_data_insights(df: pd.DataFrame) -> Dict:
         return {
             "analysis": "Error generating insights.",
             "queries": ["Error generating queries."],
-            "visualizations": ["Error generating visualization suggestions."]
+            "visualizations": ["Error generating visualization suggestions."],
+            "error": True
         }
 
 def format_analysis_output(insights: Dict) -> str:
@@ -108,8 +219,33 @@ def format_analysis_output(insights: Dict) -> str:
     for query in insights['queries']:
         output += f"- {query}\n"
     
+    for result in insights.get('query_results', []):
+        if result.get('error'):
+            continue
+        output += f"\n🧮 {result['question']}\n"
+        output += f"SQL: {result['sql']}\n"
+        output += _format_rows(result['columns'], result['rows'])
+        if result['truncated']:
+            output += f"(first {len(result['rows'])} rows shown)\n"
+    
     output += "\n📈 Visualization Suggestions:\n"
     for viz in insights['visualizations']:
         output += f"- {viz}\n"
     
-    return output 
\ No newline at end of file
+    if insights.get('charts'):
+        output += "\n🖼️ Charts:\n"
+        for chart in insights['charts']:
+            output += f"- {chart['title']}: /charts/{chart['filename']}\n"
+    
+    return output
+
+def _format_rows(columns: List[str], rows: List[List], max_rows: int = 10) -> str:
+    """
+    Render query results as a small pipe-separated table.
+    """
+    lines = [" | ".join(str(column) for column in columns)]
+    for row in rows[:max_rows]:
+        lines.append(" | ".join("" if value is None else str(value) for value in row))
+    if len(rows) > max_rows:
+        lines.append(f"... {len(rows) - max_rows} more rows")
+    return "\n".join(lines) + "\n"
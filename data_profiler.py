@@ -0,0 +1,347 @@
+import logging
+import math
+from typing import Dict, Iterator, List
+import numpy as np
+import pandas as pd
+from excel_reader import iter_workbook_chunks
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNKSIZE = 50_000
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def iter_chunks(file_path: str, chunksize: int = DEFAULT_CHUNKSIZE, sheets=None) -> Iterator[pd.DataFrame]:
+    """
+    Yield the file as DataFrames of at most `chunksize` rows. For workbooks, `sheets`
+    selects the sheets to stack (see excel_reader.resolve_sheets).
+    """
+    if file_path.endswith('.csv'):
+        yield from pd.read_csv(file_path, chunksize=chunksize)
+    elif file_path.endswith(('.xlsx', '.xls')):
+        yield from iter_workbook_chunks(file_path, sheets, chunksize)
+    else:
+        raise ValueError("Unsupported file format. Please upload a CSV or Excel file.")
+
+
+class Reservoir:
+    """Fixed-size uniform random sample of a stream of numbers (Algorithm R, vectorized)."""
+
+    def __init__(self, size=2048, seed=0):
+        self.size = size
+        self.seen = 0
+        self.values = np.empty(0, dtype=np.float64)
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values: np.ndarray):
+        if len(values) == 0:
+            return
+        free = self.size - len(self.values)
+        if free > 0:
+            self.values = np.concatenate([self.values, values[:free]])
+            self.seen += min(free, len(values))
+            values = values[free:]
+            if len(values) == 0:
+                return
+        # Item i of the stream (0-based) replaces a random slot with probability size / (i + 1)
+        positions = self.seen + np.arange(1, len(values) + 1)
+        accepted = self._rng.random(len(values)) < self.size / positions
+        slots = self._rng.integers(0, self.size, size=int(accepted.sum()))
+        # Later assignments win on duplicate slots, matching sequential replacement
+        self.values[slots] = values[accepted]
+        self.seen += len(values)
+
+    def merge(self, other: 'Reservoir'):
+        total = self.seen + other.seen
+        if total == 0:
+            return
+        pool = np.concatenate([self.values, other.values])
+        # Weight each retained item by how many stream items it stands for
+        weights = np.concatenate([
+            np.full(len(self.values), self.seen / max(len(self.values), 1)),
+            np.full(len(other.values), other.seen / max(len(other.values), 1)),
+        ])
+        keep = min(self.size, len(pool))
+        chosen = self._rng.choice(len(pool), size=keep, replace=False, p=weights / weights.sum())
+        self.values = pool[chosen]
+        self.seen = total
+
+    def quantiles(self, qs=QUANTILES) -> Dict[str, float]:
+        if len(self.values) == 0:
+            return {}
+        return {f"p{int(q * 100):02d}": float(v) for q, v in zip(qs, np.quantile(self.values, qs))}
+
+
+class HyperLogLog:
+    """HyperLogLog distinct-count sketch over 64-bit hashes (about 1.6% error at p=12)."""
+
+    def __init__(self, p=12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def update(self, hashes: np.ndarray):
+        if len(hashes) == 0:
+            return
+        hashes = hashes.astype(np.uint64, copy=False)
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << (64 - self.p)) - 1)
+        # Rank = position of the leftmost 1-bit in the remaining 64 - p bits
+        width = 64 - self.p
+        bit_length = np.zeros(len(remainder), dtype=np.int64)
+        nonzero = remainder > 0
+        bit_length[nonzero] = np.frexp(remainder[nonzero].astype(np.float64))[1]
+        rank = (width - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: 'HyperLogLog'):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m ** 2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.m and zeros:
+            # Small-range correction: linear counting
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+
+class FrequentItems:
+    """Misra-Gries heavy-hitter summary; counts are lower bounds within n / capacity."""
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.counts = {}
+
+    def update(self, value_counts: pd.Series):
+        if len(value_counts) > self.capacity:
+            # Summarize the chunk first (vectorized) so only `capacity` items are merged
+            cutoff = value_counts.nlargest(self.capacity + 1).iloc[-1]
+            value_counts = value_counts[value_counts > cutoff] - cutoff
+        for value, count in value_counts.items():
+            self.counts[value] = self.counts.get(value, 0) + int(count)
+        self._shrink()
+
+    def merge(self, other: 'FrequentItems'):
+        for value, count in other.counts.items():
+            self.counts[value] = self.counts.get(value, 0) + count
+        self._shrink()
+
+    def _shrink(self):
+        if len(self.counts) <= self.capacity:
+            return
+        ordered = sorted(self.counts.values(), reverse=True)
+        cutoff = ordered[self.capacity]
+        self.counts = {value: count - cutoff for value, count in self.counts.items() if count > cutoff}
+
+    def top(self, k=5) -> List:
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class ColumnProfile:
+    """Single-pass, mergeable statistics for one column."""
+
+    def __init__(self, name):
+        self.name = name
+        self.dtype = None
+        self.count = 0
+        self.nulls = 0
+        # Welford / Chan running moments for numeric values
+        self.numeric_count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.reservoir = Reservoir()
+        self.distinct = HyperLogLog()
+        self.frequent = FrequentItems()
+
+    def update(self, series: pd.Series):
+        self._merge_dtype(str(series.dtype))
+        values = series.dropna()
+        self.count += len(values)
+        self.nulls += len(series) - len(values)
+        if len(values) == 0:
+            return
+
+        self.distinct.update(pd.util.hash_pandas_object(values, index=False).to_numpy())
+        self.frequent.update(values.value_counts(sort=False))
+
+        if pd.api.types.is_numeric_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype):
+            numbers = values.to_numpy(dtype=np.float64)
+            self._merge_moments(len(numbers), float(numbers.mean()), float(((numbers - numbers.mean()) ** 2).sum()))
+            self._merge_range(float(numbers.min()), float(numbers.max()))
+            self.reservoir.update(numbers)
+        else:
+            try:
+                self._merge_range(values.min(), values.max())
+            except TypeError:
+                # Mixed, unorderable values
+                pass
+
+    def merge(self, other: 'ColumnProfile'):
+        if other.dtype is not None:
+            self._merge_dtype(other.dtype)
+        self.count += other.count
+        self.nulls += other.nulls
+        if other.numeric_count:
+            self._merge_moments(other.numeric_count, other.mean, other.m2)
+            self.reservoir.merge(other.reservoir)
+        if other.min is not None:
+            self._merge_range(other.min, other.max)
+        self.distinct.merge(other.distinct)
+        self.frequent.merge(other.frequent)
+
+    def _merge_dtype(self, dtype):
+        if self.dtype is None or self.dtype == dtype:
+            self.dtype = dtype
+        elif {self.dtype, dtype} <= {'int64', 'float64'}:
+            self.dtype = 'float64'
+        else:
+            self.dtype = 'object'
+
+    def _merge_moments(self, n, mean, m2):
+        total = self.numeric_count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.numeric_count * n / total
+        self.numeric_count = total
+
+    def _merge_range(self, low, high):
+        try:
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+        except TypeError:
+            pass
+
+    def to_dict(self) -> Dict:
+        result = {
+            'dtype': self.dtype,
+            'count': self.count,
+            'nulls': self.nulls,
+            'distinct_approx': self.distinct.count() if self.count else 0,
+            'top_values': [[jsonable(value), count] for value, count in self.frequent.top()],
+        }
+        if self.min is not None:
+            result['min'] = jsonable(self.min)
+            result['max'] = jsonable(self.max)
+        if self.numeric_count:
+            result['mean'] = self.mean
+            result['std'] = math.sqrt(self.m2 / (self.numeric_count - 1)) if self.numeric_count > 1 else 0.0
+            result['quantiles'] = self.reservoir.quantiles()
+        return result
+
+
+def jsonable(value):
+    """Convert a numpy or pandas value to a JSON-serializable one; NaN and infinities become None."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+class DataProfiler:
+    """
+    Accumulates a bounded-memory profile of a table streamed in chunks.
+
+    `sampler` is an optional factory called with the first chunk that returns an object
+    with `update(chunk)` and `rows()` (see data_sampling); without one the first
+    `sample_rows` rows are kept.
+    """
+
+    def __init__(self, sample_rows=5, sampler=None):
+        self.sample_rows = sample_rows
+        self.row_count = 0
+        self.columns = {}
+        self.sample = []
+        self._sampler_factory = sampler
+        self.sampler = None
+
+    def update(self, chunk: pd.DataFrame):
+        if self._sampler_factory is not None:
+            if self.sampler is None:
+                self.sampler = self._sampler_factory(chunk)
+            self.sampler.update(chunk)
+        self.row_count += len(chunk)
+        for name in chunk.columns:
+            column = self.columns.get(str(name))
+            if column is None:
+                column = self.columns[str(name)] = ColumnProfile(str(name))
+            column.update(chunk[name])
+        if self.sampler is None and len(self.sample) < self.sample_rows:
+            head = chunk.head(self.sample_rows - len(self.sample))
+            self.sample.extend(
+                {str(key): jsonable(value) for key, value in record.items()}
+                for record in head.to_dict(orient='records')
+            )
+
+    def merge(self, other: 'DataProfiler'):
+        self.row_count += other.row_count
+        for name, column in other.columns.items():
+            if name in self.columns:
+                self.columns[name].merge(column)
+            else:
+                self.columns[name] = column
+        if other.sampler is not None:
+            if self.sampler is None:
+                self.sampler = other.sampler
+            else:
+                self.sampler.merge(other.sampler)
+        else:
+            self.sample.extend(other.sample[:max(self.sample_rows - len(self.sample), 0)])
+
+    def result(self, source=None) -> Dict:
+        sample = self.sampler.rows() if self.sampler is not None else self.sample
+        return {
+            'source': source,
+            'row_count': self.row_count,
+            'column_count': len(self.columns),
+            'columns': {name: column.to_dict() for name, column in self.columns.items()},
+            'sample': sample,
+            'sampling': getattr(self.sampler, 'mode', 'head'),
+        }
+
+
+def profile_file(file_path: str, chunksize: int = DEFAULT_CHUNKSIZE, sampler=None, sheets=None) -> Dict:
+    """
+    Profile a CSV or Excel file in a single streaming pass with bounded memory.
+    `sampler` is a sample factory as accepted by DataProfiler.
+    """
+    profiler = DataProfiler(sampler=sampler)
+    for chunk in iter_chunks(file_path, chunksize, sheets):
+        profiler.update(chunk)
+    logger.info(f"Profiled {profiler.row_count} rows of {file_path}")
+    return profiler.result(source=file_path)
+
+
+def format_profile(profile: Dict, max_top_values: int = 3) -> str:
+    """
+    Render a profile as compact text for an LLM prompt.
+    """
+    lines = [f"Rows: {profile['row_count']}, Columns: {profile['column_count']}", ""]
+    for name, column in profile['columns'].items():
+        parts = [f"{column['dtype']}", f"non-null {column['count']}", f"nulls {column['nulls']}",
+                 f"~{column['distinct_approx']} distinct"]
+        if 'mean' in column:
+            quantiles = column.get('quantiles', {})
+            parts.append(
+                f"min {_fmt(column['min'])}, p25 {_fmt(quantiles.get('p25'))}, median {_fmt(quantiles.get('p50'))}, "
+                f"p75 {_fmt(quantiles.get('p75'))}, max {_fmt(column['max'])}, mean {_fmt(column['mean'])}, "
+                f"std {_fmt(column['std'])}"
+            )
+        top = column['top_values'][:max_top_values]
+        if top and column['distinct_approx'] < 0.5 * max(column['count'], 1):
+            parts.append("top: " + ", ".join(f"{value!r} ({count})" for value, count in top))
+        lines.append(f"- {name}: " + "; ".join(parts))
+    return "\n".join(lines)
+
+
+def _fmt(value):
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return str(value)
@@ -0,0 +1,234 @@
+import logging
+import math
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from data_profiler import jsonable
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+SAMPLING_MODES = ('head', 'reservoir', 'stratified', 'outlier')
+# Rough characters-per-token ratio for sizing samples against a prompt budget
+CHARS_PER_TOKEN = 4
+
+
+def _records(df: pd.DataFrame) -> List[Dict]:
+    return [
+        {str(key): jsonable(value) for key, value in record.items()}
+        for record in df.to_dict(orient='records')
+    ]
+
+
+def rows_for_budget(chunk: pd.DataFrame, token_budget: int, min_rows: int = 3, max_rows: int = 200) -> int:
+    """
+    Number of rows that fit in `token_budget` prompt tokens, estimated from the rendered
+    size of the first rows of the file.
+    """
+    head = _records(chunk.head(20))
+    if not head:
+        return min_rows
+    tokens_per_row = max(sum(len(str(record)) for record in head) / len(head) / CHARS_PER_TOKEN, 1)
+    return int(min(max(token_budget // tokens_per_row, min_rows), max_rows))
+
+
+class HeadSampler:
+    """The first `size` rows, as before; cheap but biased for sorted files."""
+
+    def __init__(self, size):
+        self.size = size
+        self._rows = []
+
+    def update(self, chunk: pd.DataFrame):
+        if len(self._rows) < self.size:
+            self._rows.extend(_records(chunk.head(self.size - len(self._rows))))
+
+    def merge(self, other: 'HeadSampler'):
+        self._rows.extend(other._rows[:max(self.size - len(self._rows), 0)])
+
+    def rows(self) -> List[Dict]:
+        return self._rows
+
+
+class ReservoirSampler:
+    """Uniform sample of `size` rows from a stream of chunks (Algorithm R)."""
+
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.seen = 0
+        self._rows = []
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, chunk: pd.DataFrame):
+        if len(chunk) == 0:
+            return
+        free = self.size - len(self._rows)
+        if free > 0:
+            self._rows.extend(_records(chunk.iloc[:free]))
+            taken = min(free, len(chunk))
+            self.seen += taken
+            chunk = chunk.iloc[taken:]
+            if len(chunk) == 0:
+                return
+        # Vectorized acceptance test; only accepted rows are converted to records
+        positions = self.seen + np.arange(1, len(chunk) + 1)
+        accepted = np.flatnonzero(self._rng.random(len(chunk)) < self.size / positions)
+        slots = self._rng.integers(0, self.size, size=len(accepted))
+        for slot, record in zip(slots, _records(chunk.iloc[accepted])):
+            self._rows[slot] = record
+        self.seen += len(chunk)
+
+    def merge(self, other: 'ReservoirSampler'):
+        total = self.seen + other.seen
+        pool = self._rows + other._rows
+        if not pool:
+            return
+        # Weight each retained row by how many stream rows it stands for
+        weights = np.concatenate([
+            np.full(len(self._rows), self.seen / max(len(self._rows), 1)),
+            np.full(len(other._rows), other.seen / max(len(other._rows), 1)),
+        ])
+        keep = min(self.size, len(pool))
+        chosen = self._rng.choice(len(pool), size=keep, replace=False, p=weights / weights.sum())
+        self._rows = [pool[index] for index in chosen]
+        self.seen = total
+
+    def rows(self) -> List[Dict]:
+        return self._rows
+
+
+class StratifiedSampler:
+    """
+    Per-stratum reservoirs on `column`, allocated proportionally to stratum size with at
+    least one row per stratum. Strata beyond `max_strata` share one reservoir.
+    """
+
+    OTHER = '__other__'
+
+    def __init__(self, size, column, max_strata=50, seed=0):
+        self.size = size
+        self.column = column
+        self.max_strata = max_strata
+        self.seed = seed
+        self._strata = {}
+        self._counts = {}
+
+    def update(self, chunk: pd.DataFrame):
+        keys = chunk[self.column].astype(str)
+        # Map values to strata once per distinct value, not once per row
+        mapping = {value: self._stratum(value) for value in keys.unique()}
+        for key, group in chunk.groupby(keys.map(mapping), sort=False):
+            self._strata[key].update(group)
+            self._counts[key] = self._counts.get(key, 0) + len(group)
+
+    def merge(self, other: 'StratifiedSampler'):
+        for key, sampler in other._strata.items():
+            target = self._stratum(key)
+            self._strata[target].merge(sampler)
+            self._counts[target] = self._counts.get(target, 0) + other._counts.get(key, 0)
+
+    def _stratum(self, key):
+        if key not in self._strata:
+            if len(self._strata) >= self.max_strata:
+                key = self.OTHER
+            if key not in self._strata:
+                self._strata[key] = ReservoirSampler(self.size, seed=self.seed + len(self._strata))
+        return key
+
+    def rows(self) -> List[Dict]:
+        total = sum(self._counts.values())
+        if not total:
+            return []
+        ordered = sorted(self._counts, key=self._counts.get, reverse=True)[:self.size]
+        # One row per stratum first, the rest of the budget in proportion to stratum size
+        spare = self.size - len(ordered)
+        rows = []
+        for key in ordered:
+            share = 1 + math.floor(spare * self._counts[key] / total)
+            rows.extend(self._strata[key].rows()[:share])
+        return rows
+
+
+class OutlierSampler:
+    """
+    Uniform reservoir plus the rows holding the smallest and largest values of each
+    numeric column, so extremes are visible to the model.
+    """
+
+    def __init__(self, size, seed=0):
+        self.size = size
+        self._reservoir = ReservoirSampler(size, seed=seed)
+        self._extremes = {}
+
+    def update(self, chunk: pd.DataFrame):
+        self._reservoir.update(chunk)
+        for name in chunk.select_dtypes(include='number').columns:
+            column = chunk[name]
+            if column.notna().sum() == 0:
+                continue
+            for kind, index in (('min', column.idxmin()), ('max', column.idxmax())):
+                self._offer(name, kind, column.loc[index], lambda: _records(chunk.loc[[index]])[0])
+
+    def merge(self, other: 'OutlierSampler'):
+        self._reservoir.merge(other._reservoir)
+        for (name, kind), (value, record) in other._extremes.items():
+            self._offer(name, kind, value, lambda: record)
+
+    def _offer(self, name, kind, value, record):
+        current = self._extremes.get((name, kind))
+        if current is None or (value < current[0] if kind == 'min' else value > current[0]):
+            self._extremes[(name, kind)] = (value, record())
+
+    def rows(self) -> List[Dict]:
+        # Up to half the budget goes to extremes; the rest stays uniform
+        extremes = []
+        for _, record in self._extremes.values():
+            if record not in extremes:
+                extremes.append(record)
+        extremes = extremes[:self.size // 2]
+        uniform = [record for record in self._reservoir.rows() if record not in extremes]
+        return extremes + uniform[:self.size - len(extremes)]
+
+
+def create_sampler(mode: str, size: int, stratify_by: Optional[str] = None):
+    """Build the sampler for `mode` ('head', 'reservoir', 'stratified' or 'outlier')."""
+    if mode == 'head':
+        return HeadSampler(size)
+    if mode == 'reservoir':
+        return ReservoirSampler(size)
+    if mode == 'stratified':
+        if not stratify_by:
+            raise ValueError("Stratified sampling needs a column to stratify by")
+        return StratifiedSampler(size, stratify_by)
+    if mode == 'outlier':
+        return OutlierSampler(size)
+    raise ValueError(f"Unknown sampling mode: {mode}")
+
+
+class BudgetSampler:
+    """
+    Sample factory for DataProfiler: sizes a `mode` sampler from the first chunk so the
+    sample fits in `token_budget` prompt tokens. Picklable, so profiles can be built in
+    worker processes and merged.
+    """
+
+    def __init__(self, mode: str = 'reservoir', token_budget: int = 800, stratify_by: Optional[str] = None):
+        if mode not in SAMPLING_MODES:
+            raise ValueError(f"Unknown sampling mode: {mode}")
+        self.mode = mode
+        self.token_budget = token_budget
+        self.stratify_by = stratify_by
+
+    def __call__(self, first_chunk: pd.DataFrame):
+        mode = self.mode
+        if mode == 'stratified' and self.stratify_by not in first_chunk.columns:
+            logger.warning(f"Stratification column {self.stratify_by!r} not found, using reservoir sampling")
+            mode = 'reservoir'
+        sampler = create_sampler(mode, rows_for_budget(first_chunk, self.token_budget), self.stratify_by)
+        sampler.mode = mode
+        return sampler
+
+
+def budget_sampler(mode: str = 'reservoir', token_budget: int = 800, stratify_by: Optional[str] = None):
+    """Return the DataProfiler sample factory for `mode` within `token_budget` tokens."""
+    return BudgetSampler(mode, token_budget, stratify_by)
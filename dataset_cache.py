@@ -0,0 +1,424 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, Optional
+import pandas as pd
+from data_profiler import DEFAULT_CHUNKSIZE, DataProfiler, iter_chunks
+from excel_reader import iter_sheet_chunks, resolve_sheets
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+DATASET_CACHE_DIR = os.environ.get('DATASET_CACHE_DIR', os.path.join('cache', 'datasets'))
+# Disk quota for converted datasets and their profiles; least recently used go first
+DATASET_CACHE_QUOTA = int(os.environ.get('DATASET_CACHE_BYTES', 2 * 1024 ** 3))
+ARROW_FILE = 'data.arrow'
+# Processes used to parse the sheets of a multi-sheet workbook selection
+EXCEL_WORKERS = int(os.environ.get('EXCEL_WORKERS', min(4, os.cpu_count() or 1)))
+
+
+def file_digest(file_path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def promote_schemas(schemas):
+    """
+    Common schema for tables whose inferred column types differ, e.g. between CSV chunks
+    or workbook sheets: int64 widens to double, all-null columns take the other type, and
+    columns that hold numbers in one table and text in another become strings.
+    """
+    try:
+        return pa.unify_schemas(schemas, promote_options='permissive')
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    candidates = {}
+    for schema in schemas:
+        for field in schema:
+            candidates.setdefault(field.name, []).append(field)
+    fields = []
+    for name, column_fields in candidates.items():
+        try:
+            fields.append(pa.unify_schemas([pa.schema([field]) for field in column_fields],
+                                           promote_options='permissive').field(0))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+
+def conform(table, schema):
+    """Cast `table` to `schema`, adding all-null columns for fields it does not have."""
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            column = table.column(field.name)
+            if not column.type.equals(field.type):
+                column = column.cast(field.type)
+        else:
+            column = pa.nulls(table.num_rows, field.type)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+class ArrowSink:
+    """
+    Writes DataFrame chunks to an Arrow IPC file atomically. When a later chunk's inferred
+    types differ from those written so far, the schema is promoted (see promote_schemas)
+    and the batches already written are re-cast to it, and `promoted` becomes True. If a
+    chunk still cannot be converted the file is abandoned and `ok` becomes False.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ok = pa is not None
+        self.promoted = False
+        self._writer = None
+        self._schema = None
+        self._tmp_path = None
+
+    def write(self, chunk: pd.DataFrame):
+        if not self.ok:
+            return
+        try:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+        except (pa.ArrowException, ValueError, TypeError) as e:
+            self._give_up(e)
+            return
+        self.write_table(table)
+
+    def write_table(self, table):
+        if not self.ok:
+            return
+        try:
+            if self._writer is None:
+                fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+                os.close(fd)
+                self._schema = table.schema
+                self._writer = pa.ipc.new_file(self._tmp_path, self._schema)
+            elif not table.schema.equals(self._schema):
+                schema = promote_schemas([self._schema, table.schema])
+                if not schema.equals(self._schema):
+                    self._rewrite(schema)
+                table = conform(table, schema)
+                self.promoted = True
+            self._writer.write_table(table)
+        except (pa.ArrowException, ValueError, TypeError) as e:
+            self._give_up(e)
+
+    def _rewrite(self, schema):
+        # Copy the batches written so far into a new file under the promoted schema
+        self._writer.close()
+        self._writer = None
+        previous = self._tmp_path
+        fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+        os.close(fd)
+        try:
+            self._writer = pa.ipc.new_file(self._tmp_path, schema)
+            reader = pa.ipc.open_file(pa.memory_map(previous, 'r'))
+            for index in range(reader.num_record_batches):
+                self._writer.write_table(conform(pa.Table.from_batches([reader.get_batch(index)]), schema))
+            del reader
+        finally:
+            os.remove(previous)
+        logger.info(f"Promoted the Arrow schema of {self.path} to fit a later chunk")
+        self._schema = schema
+
+    def _give_up(self, error):
+        # A chunk Arrow cannot represent; keep the profile, skip the conversion
+        logger.warning(f"Not caching {self.path} as Arrow: {error}")
+        self.abort()
+
+    def commit(self) -> bool:
+        """Publish the file; returns whether anything was written."""
+        if not self.ok or self._writer is None:
+            return False
+        self._writer.close()
+        self._writer = None
+        os.replace(self._tmp_path, self.path)
+        self._tmp_path = None
+        return True
+
+    def abort(self):
+        """Discard an unfinished file; a no-op after commit."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._tmp_path is not None and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+        self._tmp_path = None
+        self.ok = False
+
+
+def _profile_sheet(file_path, sheet, chunksize, sampler, part_path):
+    """Worker: profile one workbook sheet and write it to `part_path` as Arrow."""
+    profiler = DataProfiler(sampler=sampler)
+    sink = ArrowSink(part_path)
+    try:
+        for chunk in iter_sheet_chunks(file_path, sheet, chunksize):
+            profiler.update(chunk)
+            sink.write(chunk)
+        return profiler, sink.commit()
+    finally:
+        sink.abort()
+
+
+class DatasetCache:
+    """
+    On-disk cache of ingested tables, keyed by content hash.
+
+    Each entry is a directory holding the table as an Arrow IPC file (when pyarrow is
+    installed) and one JSON profile per sampling configuration. Arrow files are
+    memory-mapped on reload, so re-reading a cached table neither parses the source
+    nor copies its column buffers. Entries are evicted least recently used first once
+    the directory exceeds `quota_bytes`.
+    """
+
+    def __init__(self, cache_dir=DATASET_CACHE_DIR, quota_bytes=DATASET_CACHE_QUOTA, chunksize=DEFAULT_CHUNKSIZE):
+        self.cache_dir = cache_dir
+        self.quota_bytes = quota_bytes
+        self.chunksize = chunksize
+        # (path, size, mtime) -> content hash, so unchanged files are hashed once per process
+        self._digests = {}
+        self._lock = threading.Lock()
+        # Profile lookups answered from the cache and those that parsed the source
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def fingerprint(self, file_path: str) -> Dict:
+        """Return the size, mtime and content hash of `file_path`."""
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(key)
+        if digest is None:
+            digest = file_digest(file_path)
+            with self._lock:
+                if len(self._digests) > 1024:
+                    self._digests.clear()
+                self._digests[key] = digest
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+
+    def dataset_key(self, file_path: str, sheets=None) -> str:
+        """
+        Cache key for a file's table: its content hash, combined with the sheet
+        selection for workbooks read with other than the default sheet.
+        """
+        digest = self.fingerprint(file_path)['sha256']
+        if sheets is None:
+            return digest
+        return hashlib.sha256(json.dumps([digest, sheets]).encode('utf-8')).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def entry_path(self, file_path: str, name: str, sheets=None) -> str:
+        """Path for a derived file `name` stored (and evicted) with the dataset's entry."""
+        entry_dir = self._entry_dir(self.dataset_key(file_path, sheets))
+        if not os.path.exists(entry_dir):
+            os.makedirs(entry_dir, exist_ok=True)
+        return os.path.join(entry_dir, name)
+
+    def arrow_path(self, file_path: str, sheets=None) -> Optional[str]:
+        """Path of the cached Arrow file for `file_path`, or None if not converted yet."""
+        path = os.path.join(self._entry_dir(self.dataset_key(file_path, sheets)), ARROW_FILE)
+        return path if os.path.exists(path) else None
+
+    def table(self, file_path: str, sheets=None):
+        """Return the cached table as a memory-mapped pyarrow.Table, or None."""
+        path = self.arrow_path(file_path, sheets) if pa is not None else None
+        if path is None:
+            return None
+        return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+    def iter_chunks(self, file_path: str, sheets=None) -> Iterator[pd.DataFrame]:
+        """Yield the table in chunks, from the Arrow cache when available."""
+        path = self.arrow_path(file_path, sheets) if pa is not None else None
+        if path is None:
+            yield from iter_chunks(file_path, self.chunksize, sheets)
+        else:
+            yield from self._read_arrow(path)
+
+    def profile(self, file_path: str, profile_key: str = 'default', sampler=None, sheets=None) -> Dict:
+        """
+        Return the profile of `file_path` for `profile_key`, computing it at most once per
+        file content. `sampler` is the DataProfiler sample factory that `profile_key`
+        identifies and `sheets` the workbook sheet selection. The first profiling pass
+        also converts the file to Arrow.
+        """
+        fingerprint = self.fingerprint(file_path)
+        key = self.dataset_key(file_path, sheets)
+        entry_dir = self._entry_dir(key)
+        profile_name = hashlib.sha256(profile_key.encode('utf-8')).hexdigest()[:16]
+        profile_path = os.path.join(entry_dir, f"profile-{profile_name}.json")
+
+        profile = self._read_json(profile_path)
+        if profile is not None:
+            os.utime(entry_dir)
+            with self._lock:
+                self.hits += 1
+            logger.info(f"Dataset cache hit for {file_path}")
+        else:
+            with self._lock:
+                self.misses += 1
+            if not os.path.exists(entry_dir):
+                os.makedirs(entry_dir, exist_ok=True)
+            arrow_path = os.path.join(entry_dir, ARROW_FILE)
+            profiler = DataProfiler(sampler=sampler)
+            if pa is not None and os.path.exists(arrow_path):
+                for chunk in self._read_arrow(arrow_path):
+                    profiler.update(chunk)
+            elif self._ingest(file_path, sheets, arrow_path, profiler, sampler):
+                # The profile saw the source's drifting types; describe the cached table instead
+                profiler = DataProfiler(sampler=sampler)
+                for chunk in self._read_arrow(arrow_path):
+                    profiler.update(chunk)
+            profile = profiler.result()
+            profile['fingerprint'] = fingerprint
+            profile['sheets'] = sheets
+            self._write_json(profile_path, profile)
+            self._evict(keep=key)
+
+        profile['source'] = file_path
+        return profile
+
+    def _ingest(self, file_path, sheets, arrow_path, profiler, sampler) -> bool:
+        """
+        Profile the source into `profiler` and convert it to Arrow. Returns True when the
+        Arrow file was written with promoted column types, so that `profiler` no longer
+        matches the cached table.
+        """
+        if file_path.endswith(('.xlsx', '.xls')):
+            selected = resolve_sheets(file_path, sheets)
+            if len(selected) > 1 and EXCEL_WORKERS > 1:
+                return self._ingest_sheets(file_path, selected, arrow_path, profiler, sampler)
+        # Profile and convert in the same pass over the source file
+        sink = ArrowSink(arrow_path)
+        try:
+            for chunk in iter_chunks(file_path, self.chunksize, sheets):
+                profiler.update(chunk)
+                sink.write(chunk)
+            return sink.commit() and sink.promoted
+        finally:
+            sink.abort()
+
+    def _ingest_sheets(self, file_path, selected, arrow_path, profiler, sampler):
+        # Parse sheets in parallel processes; each profiles its sheet and writes an Arrow part
+        entry_dir = os.path.dirname(arrow_path)
+        parts = [os.path.join(entry_dir, f"part-{index}.arrow") for index in range(len(selected))]
+        workers = min(len(selected), EXCEL_WORKERS)
+        promoted = False
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = [
+                    pool.submit(_profile_sheet, file_path, sheet, self.chunksize, sampler, part)
+                    for sheet, part in zip(selected, parts)
+                ]
+                results = [future.result() for future in futures]
+            for part_profiler, _ in results:
+                profiler.merge(part_profiler)
+
+            if pa is not None and all(converted for _, converted in results):
+                tables = [pa.ipc.open_file(pa.memory_map(part, 'r')).read_all() for part in parts]
+                sink = ArrowSink(arrow_path)
+                try:
+                    # Sheets may infer different types for a column, e.g. int64 in one and double in
+                    # another; promoting up front spares the sink from rewriting earlier sheets
+                    schema = promote_schemas([table.schema for table in tables])
+                    for table in tables:
+                        sink.write_table(conform(table, schema))
+                    promoted = sink.commit() and any(not table.schema.equals(schema) for table in tables)
+                except (pa.ArrowException, ValueError, TypeError) as e:
+                    logger.warning(f"Not caching {file_path} as Arrow: sheets do not share a schema ({e})")
+                finally:
+                    sink.abort()
+                    del tables
+        finally:
+            for part in parts:
+                if os.path.exists(part):
+                    os.remove(part)
+        return promoted
+
+    def _read_arrow(self, path):
+        reader = pa.ipc.open_file(pa.memory_map(path, 'r'))
+        for index in range(reader.num_record_batches):
+            yield reader.get_batch(index).to_pandas()
+
+    def _read_json(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable dataset cache entry {path}: {e}")
+            return None
+
+    def _write_json(self, path, value):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+    def _evict(self, keep=None):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir():
+                continue
+            try:
+                size = sum(item.stat().st_size for item in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.name, entry.path))
+            except OSError:
+                continue
+            total += size
+        for _, size, name, path in sorted(entries):
+            if total <= self.quota_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted cached dataset {name}")
+
+    def stats(self):
+        """Return the number of cached datasets, their total size in bytes and the hit/miss counters."""
+        count = 0
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_dir():
+                count += 1
+                total += sum(item.stat().st_size for item in os.scandir(entry.path))
+        return {'datasets': count, 'bytes': total, 'quota_bytes': self.quota_bytes, 'arrow': pa is not None,
+                'hits': self.hits, 'misses': self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_dataset_cache():
+    """Return the process-wide DatasetCache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DatasetCache()
+    return _cache
@@ -0,0 +1,257 @@
+import logging
+import math
+import os
+import zipfile
+import numpy as np
+from PIL import Image
+import metrics
+from image_preprocess import MAX_IMAGE_SIZE
+
+try:
+    import pydicom
+except ImportError:
+    pydicom = None
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+# Slices shown to the VLM for a multi-slice study, tiled into one montage image
+DICOM_SLICES = int(os.environ.get('DICOM_SLICES', 9))
+# Set to 0 to send only the single most representative slice
+DICOM_MONTAGE = os.environ.get('DICOM_MONTAGE', '1') == '1'
+# Upper bound on the files inspected in a series zip
+MAX_SERIES_FILES = int(os.environ.get('DICOM_MAX_SERIES_FILES', 2000))
+
+DICOM_EXTENSIONS = ('.dcm', '.dicom')
+SERIES_EXTENSIONS = ('.zip',)
+PIXEL_DATA = 0x7FE00010
+# Stride of the thumbnail used to score slices, so scoring touches a fraction of each frame
+SCORE_STRIDE = 8
+
+
+class DicomError(ValueError):
+    """Raised when a DICOM file or series cannot be turned into an image."""
+
+
+def is_dicom_upload(path) -> bool:
+    """True for single DICOM files and zipped series, judged by extension."""
+    return str(path).lower().endswith(DICOM_EXTENSIONS + SERIES_EXTENSIONS)
+
+
+def _require_pydicom():
+    if pydicom is None:
+        raise DicomError("DICOM support needs the pydicom package (pip install pydicom)")
+
+
+def _dtype(ds, little_endian=True):
+    bits = int(ds.BitsAllocated)
+    if bits not in (8, 16, 32):
+        return None
+    kind = 'i' if int(getattr(ds, 'PixelRepresentation', 0)) == 1 else 'u'
+    return np.dtype(f"{'<' if little_endian else '>'}{kind}{bits // 8}")
+
+
+def _as_frames(pixels, ds):
+    """Give pixel data a leading frame axis: (frames, rows, cols[, samples])."""
+    frames = int(getattr(ds, 'NumberOfFrames', 1) or 1)
+    samples = int(getattr(ds, 'SamplesPerPixel', 1) or 1)
+    if frames == 1:
+        pixels = pixels[np.newaxis]
+    if samples > 1 and pixels.shape[-1] != samples:
+        # Planar configuration 1 stores each colour plane separately
+        pixels = np.moveaxis(pixels, 1, -1)
+    return pixels
+
+
+def read_frames(path):
+    """
+    Return (frames, dataset) for a DICOM file. Headers are parsed with large values
+    deferred; uncompressed pixel data is memory-mapped in place rather than read, so
+    only the frames that are indexed are paged in. Compressed transfer syntaxes are
+    decoded by pydicom.
+    """
+    _require_pydicom()
+    try:
+        ds = pydicom.dcmread(path, defer_size=1024)
+        try:
+            elem = ds.get_item(PIXEL_DATA, keep_deferred=True)
+        except TypeError:
+            # pydicom 2 returns the raw, still deferred element by default
+            elem = ds.get_item(PIXEL_DATA)
+        if elem is None:
+            raise DicomError("The DICOM file contains no image data")
+        syntax = ds.file_meta.TransferSyntaxUID
+        dtype = _dtype(ds, getattr(elem, 'is_little_endian', syntax.is_little_endian))
+        value_tell = getattr(elem, 'value_tell', None)
+        if not syntax.is_compressed and dtype is not None and value_tell is not None:
+            frames = int(getattr(ds, 'NumberOfFrames', 1) or 1)
+            samples = int(getattr(ds, 'SamplesPerPixel', 1) or 1)
+            shape = (frames, int(ds.Rows), int(ds.Columns))
+            if samples > 1:
+                planar = int(getattr(ds, 'PlanarConfiguration', 0) or 0)
+                shape = (frames, samples) + shape[1:] if planar else shape + (samples,)
+            if getattr(elem, 'length', None) == math.prod(shape) * dtype.itemsize:
+                pixels = np.memmap(path, dtype=dtype, mode='r', offset=value_tell, shape=shape)
+                if samples > 1 and planar:
+                    pixels = np.moveaxis(pixels, 1, -1)
+                return pixels, ds
+        return _as_frames(ds.pixel_array, ds), ds
+    except DicomError:
+        raise
+    except Exception as e:
+        raise DicomError(f"Could not read DICOM file: {e}")
+
+
+def _first(value):
+    # Window values may be multi-valued; the first pair is the primary window
+    if isinstance(value, (list, tuple)) or type(value).__name__ == 'MultiValue':
+        value = value[0] if len(value) else None
+    return None if value is None or value == '' else float(value)
+
+
+def window_frames(frames, ds):
+    """
+    Apply the modality rescale and the stored window/level (or a 1st-99th percentile
+    window when the header has none) to a stack of frames, returning uint8 in one
+    vectorized pass.
+    """
+    values = np.asarray(frames, dtype=np.float32)
+    slope = float(getattr(ds, 'RescaleSlope', 1) or 1)
+    intercept = float(getattr(ds, 'RescaleIntercept', 0) or 0)
+    if slope != 1 or intercept != 0:
+        values = values * slope + intercept
+
+    if int(getattr(ds, 'SamplesPerPixel', 1) or 1) > 1:
+        low, high = float(values.min()), float(values.max())
+    else:
+        center = _first(getattr(ds, 'WindowCenter', None))
+        width = _first(getattr(ds, 'WindowWidth', None))
+        if center is not None and width is not None and width > 1:
+            low, high = center - width / 2, center + width / 2
+        else:
+            low, high = np.percentile(values[..., ::4, ::4], [1, 99])
+    scaled = np.clip((values - low) / max(high - low, 1e-6), 0, 1)
+    if getattr(ds, 'PhotometricInterpretation', '') == 'MONOCHROME1':
+        scaled = 1 - scaled
+    return (scaled * 255).astype(np.uint8)
+
+
+def slice_score(frame):
+    """Amount of structure in a frame: pixel spread over a strided thumbnail."""
+    thumb = np.asarray(frame[::SCORE_STRIDE, ::SCORE_STRIDE], dtype=np.float32)
+    return float(thumb.std())
+
+
+def select_slices(scores, count):
+    """
+    Pick up to `count` slice indices spread over the series: the series is split into
+    `count` consecutive ranges and the slice with the most structure in each is kept.
+    """
+    total = len(scores)
+    if total <= count:
+        return list(range(total))
+    scores = np.asarray(scores)
+    return [int(chunk[np.argmax(scores[chunk])]) for chunk in np.array_split(np.arange(total), count)]
+
+
+def montage(slices, size=MAX_IMAGE_SIZE):
+    """Tile uint8 slices into one grid image no larger than `size`."""
+    images = [Image.fromarray(np.ascontiguousarray(frame)) for frame in slices]
+    if len(images) == 1:
+        return images[0]
+    columns = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    # Slices are shrunk to fit their tile but never enlarged
+    tile = min(size[0] // columns, size[1] // rows, max(max(image.size) for image in images))
+    mode = 'RGB' if any(image.mode == 'RGB' for image in images) else 'L'
+    canvas = Image.new(mode, (tile * columns, tile * rows))
+    for index, image in enumerate(images):
+        image = image.convert(mode)
+        image.thumbnail((tile, tile), Image.Resampling.LANCZOS)
+        x = (index % columns) * tile + (tile - image.size[0]) // 2
+        y = (index // columns) * tile + (tile - image.size[1]) // 2
+        canvas.paste(image, (x, y))
+    return canvas
+
+
+def _series_info(ds, total, selected):
+    return {
+        'modality': str(getattr(ds, 'Modality', '')),
+        'series_description': str(getattr(ds, 'SeriesDescription', '')),
+        'slices': total,
+        'selected': selected,
+    }
+
+
+def load_dicom_file(path, count):
+    frames, ds = read_frames(path)
+    selected = select_slices([slice_score(frame) for frame in frames], count)
+    # Fancy indexing a memmap reads only the selected frames
+    return list(window_frames(frames[selected], ds)), _series_info(ds, len(frames), selected)
+
+
+def _sort_key(ds):
+    position = getattr(ds, 'ImagePositionPatient', None)
+    instance = getattr(ds, 'InstanceNumber', None)
+    return (
+        float(position[2]) if position is not None and len(position) == 3 else 0.0,
+        int(instance) if instance not in (None, '') else 0,
+    )
+
+
+def load_series_zip(path, count):
+    """
+    Read a zipped series in two streaming passes holding one file's pixels at a time:
+    the first scores every slice, the second decodes only the selected ones. The
+    largest series in the archive is used when it holds several.
+    """
+    _require_pydicom()
+    with zipfile.ZipFile(path) as archive:
+        members = [info for info in archive.infolist()
+                   if not info.is_dir() and not os.path.basename(info.filename).startswith('.')
+                   and not info.filename.startswith('__MACOSX/')][:MAX_SERIES_FILES]
+        slices = []
+        for info in members:
+            try:
+                with archive.open(info) as f:
+                    ds = pydicom.dcmread(f)
+                frames = _as_frames(ds.pixel_array, ds)
+            except Exception as e:
+                logger.debug(f"Skipping {info.filename} in {path}: {e}")
+                continue
+            slices.append((str(getattr(ds, 'SeriesInstanceUID', '')), _sort_key(ds), info, slice_score(frames[len(frames) // 2])))
+            del ds, frames
+        if not slices:
+            raise DicomError("The zip file contains no readable DICOM images")
+
+        series_counts = {}
+        for series, _, _, _ in slices:
+            series_counts[series] = series_counts.get(series, 0) + 1
+        series = max(series_counts, key=series_counts.get)
+        slices = sorted((item for item in slices if item[0] == series), key=lambda item: item[1])
+        selected = select_slices([score for _, _, _, score in slices], count)
+
+        images = []
+        for index in selected:
+            with archive.open(slices[index][2]) as f:
+                ds = pydicom.dcmread(f)
+            frames = _as_frames(ds.pixel_array, ds)
+            images.append(window_frames(frames[len(frames) // 2:len(frames) // 2 + 1], ds)[0])
+    return images, _series_info(ds, len(slices), selected)
+
+
+@metrics.timed('dicom_ingest')
+def load_study_image(path, slices=DICOM_SLICES, use_montage=DICOM_MONTAGE):
+    """
+    Turn a DICOM file or zipped series into the image sent to the VLM: a montage of
+    up to `slices` representative slices, or the single most representative one.
+    Returns (PIL image, series info).
+    """
+    count = max(1, slices) if use_montage else 1
+    if str(path).lower().endswith(SERIES_EXTENSIONS):
+        images, info = load_series_zip(path, count)
+    else:
+        images, info = load_dicom_file(path, count)
+    logger.info(f"DICOM {info['modality']} series '{info['series_description']}': "
+                f"{len(images)} of {info['slices']} slices selected")
+    return montage(images), info
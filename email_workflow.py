@@ -2,52 +2,105 @@ import smtplib
 import logging
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import ollama
+import llm_client
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Instructions are sent as an unchanging system message ahead of the user's text, so
+# the model can reuse the processed prefix from its KV cache across requests.
+EMAIL_SYSTEM_PROMPT = (
+    "You are an AI email assistant. Your task is to generate a well-structured and professional email based on the user's input.\n\n"
+    "Instructions:\n"
+    "1. Understand the context: Analyze the user's input to determine the purpose of the email. Identify the subject, tone, and key details.\n"
+    "2. Ensure proper formatting:\n"
+    "   - Format the email as follows:\n"
+    "     Subject: <email subject>\n"
+    "     Body:\n"
+    "     <email body>\n"
+    "   - The subject should be clear, concise, and relevant (under 10 words).\n"
+    "   - The body should be well-structured with logical flow.\n"
+    "3. Adjust tone based on intent: Use formal language for professional emails and a friendly tone for casual ones.\n"
+    "4. Avoid unnecessary filler: Keep the email concise and ensure the key message is clear.\n"
+    "5. Ensure grammar and clarity: The email must be grammatically correct and easy to read.\n"
+    "6. Personalize if possible: Use the user's provided name or any other details if mentioned.\n\n"
+    "The user's message describes the email to write.\n\n"
+    "Expected Output Format:\n"
+    "Subject: <email subject>\n"
+    "Body:\n"
+    "<email body>"
+)
+
+MODIFY_SYSTEM_PROMPT = (
+    "You are an AI email assistant. The user's message contains the current version of an email "
+    "and the changes they suggest.\n\n"
+    "Please modify the email accordingly. Maintain the same format:\n"
+    "Subject: <email subject>\n"
+    "Body:\n"
+    "<email body>"
+)
+
+
+def _email_messages(prompt):
+    return [
+        {"role": "system", "content": EMAIL_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _modify_messages(original_email, suggestions):
+    return [
+        {"role": "system", "content": MODIFY_SYSTEM_PROMPT},
+        {"role": "user", "content": (
+            "Current email:\n\n"
+            f"{original_email}\n\n"
+            "Suggested changes:\n"
+            f"{suggestions}"
+        )},
+    ]
+
+
+def parse_email_content(email_content):
+    """
+    Split LLM output into a tuple (subject, body, full_email_content).
+    """
+    if "Subject:" in email_content and "Body:" in email_content:
+        subject = email_content.split("Subject:", 1)[1].split("Body:", 1)[0].strip()
+        body = email_content.split("Body:", 1)[1].strip()
+        return subject, body, email_content
+    else:
+        return "No Subject", email_content, email_content
+
+
 def generate_email_content(prompt):
     """
     Generate a well-structured email content using a language model.
     Returns a tuple (subject, body, full_email_content).
     """
-    structured_prompt = (
-        "You are an AI email assistant. Your task is to generate a well-structured and professional email based on the user's input.\n\n"
-        "Instructions:\n"
-        "1. Understand the context: Analyze the user's input to determine the purpose of the email. Identify the subject, tone, and key details.\n"
-        "2. Ensure proper formatting:\n"
-        "   - Format the email as follows:\n"
-        "     Subject: <email subject>\n"
-        "     Body:\n"
-        "     <email body>\n"
-        "   - The subject should be clear, concise, and relevant (under 10 words).\n"
-        "   - The body should be well-structured with logical flow.\n"
-        "3. Adjust tone based on intent: Use formal language for professional emails and a friendly tone for casual ones.\n"
-        "4. Avoid unnecessary filler: Keep the email concise and ensure the key message is clear.\n"
-        "5. Ensure grammar and clarity: The email must be grammatically correct and easy to read.\n"
-        "6. Personalize if possible: Use the user's provided name or any other details if mentioned.\n\n"
-        "User Input:\n"
-        f"{prompt}\n\n"
-        "Expected Output Format:\n"
-        "Subject: <email subject>\n"
-        "Body:\n"
-        "<email body>"
-    )
-    
     try:
-        response = ollama.chat(model='qwen2.5:3B', messages=[{"role": "user", "content": structured_prompt}])
+        response = llm_client.chat(model=llm_client.MODELS['chat'], messages=_email_messages(prompt))
         email_content = response['message']['content']
         logging.info("Email content generated by LLM.")
     except Exception as e:
         logging.error(f"Error generating email content: {e}")
         return "No Subject", "Error generating email content.", ""
     
-    if "Subject:" in email_content and "Body:" in email_content:
-        subject = email_content.split("Subject:", 1)[1].split("Body:", 1)[0].strip()
-        body = email_content.split("Body:", 1)[1].strip()
-        return subject, body, email_content
-    else:
-        return "No Subject", email_content, email_content
+    return parse_email_content(email_content)
+
+
+def stream_email_content(prompt):
+    """
+    Stream the generated email text chunk by chunk as the language model produces it.
+    Pass the concatenated chunks to parse_email_content to get (subject, body, full_email_content).
+    """
+    try:
+        for chunk in llm_client.chat(model=llm_client.MODELS['chat'], messages=_email_messages(prompt), stream=True):
+            content = chunk['message']['content']
+            if content:
+                yield content
+        logging.info("Email content streamed by LLM.")
+    except Exception as e:
+        logging.error(f"Error generating email content: {e}")
+        yield "Error generating email content."
 
 
 def modify_email_content(original_email, suggestions):
@@ -55,30 +108,30 @@ def modify_email_content(original_email, suggestions):
     Modify the current email content based on the user's suggestions.
     Returns a tuple (subject, body, full_email_content) of the updated email.
     """
-    structured_prompt = (
-        "You are an AI email assistant. The following is the current version of an email:\n\n"
-        f"{original_email}\n\n"
-        "The user has suggested the following changes:\n"
-        f"{suggestions}\n\n"
-        "Please modify the email accordingly. Maintain the same format:\n"
-        "Subject: <email subject>\n"
-        "Body:\n"
-        "<email body>"
-    )
     try:
-        response = ollama.chat(model='qwen2.5:3B', messages=[{"role": "user", "content": structured_prompt}])
+        response = llm_client.chat(model=llm_client.MODELS['chat'], messages=_modify_messages(original_email, suggestions))
         new_email_content = response['message']['content']
         logging.info("Email content modified by LLM.")
     except Exception as e:
         logging.error(f"Error modifying email content: {e}")
         return "No Subject", "Error modifying email content.", original_email
 
-    if "Subject:" in new_email_content and "Body:" in new_email_content:
-        subject = new_email_content.split("Subject:", 1)[1].split("Body:", 1)[0].strip()
-        body = new_email_content.split("Body:", 1)[1].strip()
-        return subject, body, new_email_content
-    else:
-        return "No Subject", new_email_content, new_email_content
+    return parse_email_content(new_email_content)
+
+
+def stream_modified_email_content(original_email, suggestions):
+    """
+    Stream the modified email text chunk by chunk as the language model produces it.
+    """
+    try:
+        for chunk in llm_client.chat(model=llm_client.MODELS['chat'], messages=_modify_messages(original_email, suggestions), stream=True):
+            content = chunk['message']['content']
+            if content:
+                yield content
+        logging.info("Email content modified by LLM.")
+    except Exception as e:
+        logging.error(f"Error modifying email content: {e}")
+        yield "Error modifying email content."
 
 
 def send_email(to_email, subject, body):
@@ -0,0 +1,128 @@
+import logging
+import os
+import zipfile
+from typing import Iterator, List, Optional, Sequence, Union
+from xml.etree import ElementTree
+import pandas as pd
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+try:
+    import xlrd
+except ImportError:
+    xlrd = None
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+# Sheets read when none are selected: the first one, as pd.read_excel did
+DEFAULT_SHEETS = os.environ.get('EXCEL_SHEETS') or None
+
+
+def _is_xls(file_path: str) -> bool:
+    return file_path.lower().endswith('.xls')
+
+
+def sheet_names(file_path: str) -> List[str]:
+    """Names of the sheets in a workbook, in order, without loading their cells."""
+    if not _is_xls(file_path):
+        # Read the workbook part directly; openpyxl scans every sheet that lacks a dimension tag
+        with zipfile.ZipFile(file_path) as archive, archive.open('xl/workbook.xml') as f:
+            root = ElementTree.parse(f).getroot()
+        return [sheet.get('name') for sheet in root.iter() if sheet.tag.endswith('}sheet')]
+    if _is_xls(file_path) and xlrd is not None:
+        book = xlrd.open_workbook(file_path, on_demand=True)
+        try:
+            return book.sheet_names()
+        finally:
+            book.release_resources()
+    return list(pd.ExcelFile(file_path).sheet_names)
+
+
+def resolve_sheets(file_path: str, sheets: Optional[Union[str, Sequence[str]]] = None) -> List[str]:
+    """
+    Turn a sheet selection into sheet names: None for the first sheet, 'all' or '*' for
+    every sheet, or sheet names as a list or a comma-separated string.
+    """
+    names = sheet_names(file_path)
+    if not names:
+        raise ValueError("The workbook has no sheets")
+    if sheets is None:
+        return names[:1]
+    if isinstance(sheets, str):
+        if sheets.strip().lower() in ('all', '*'):
+            return names
+        sheets = [sheet.strip() for sheet in sheets.split(',') if sheet.strip()]
+    missing = [sheet for sheet in sheets if sheet not in names]
+    if missing:
+        raise ValueError(f"Sheet(s) not found: {', '.join(missing)}. Available: {', '.join(names)}")
+    return list(sheets)
+
+
+def _frame(rows, header):
+    return pd.DataFrame.from_records(rows, columns=header).infer_objects()
+
+
+def _header(values):
+    # Blank or repeated header cells get positional names, as pandas does
+    header = []
+    for index, value in enumerate(values):
+        name = str(value) if value is not None and str(value).strip() else f"Unnamed: {index}"
+        while name in header:
+            name = f"{name}.1"
+        header.append(name)
+    return header
+
+
+def _iter_rows_chunks(rows, chunksize):
+    header = None
+    batch = []
+    for values in rows:
+        if header is None:
+            header = _header(values)
+            continue
+        values = list(values[:len(header)]) + [None] * (len(header) - len(values))
+        if all(value is None or value == '' for value in values):
+            continue
+        batch.append(values)
+        if len(batch) >= chunksize:
+            yield _frame(batch, header)
+            batch = []
+    if batch or header is not None:
+        yield _frame(batch, header or [])
+
+
+def iter_sheet_chunks(file_path: str, sheet: str, chunksize: int) -> Iterator[pd.DataFrame]:
+    """
+    Yield one sheet as DataFrames of at most `chunksize` rows, with the first row as
+    header. .xlsx sheets are streamed row by row in openpyxl's read-only mode, so
+    memory stays bounded by the chunk size; .xls files are read with xlrd.
+    """
+    if not _is_xls(file_path) and openpyxl is not None:
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            yield from _iter_rows_chunks(workbook[sheet].iter_rows(values_only=True), chunksize)
+        finally:
+            workbook.close()
+    elif _is_xls(file_path) and xlrd is not None:
+        book = xlrd.open_workbook(file_path, on_demand=True)
+        try:
+            worksheet = book.sheet_by_name(sheet)
+            rows = (worksheet.row_values(index) for index in range(worksheet.nrows))
+            yield from _iter_rows_chunks(rows, chunksize)
+        finally:
+            book.release_resources()
+    else:
+        logger.warning(f"No streaming reader for {file_path}; loading sheet {sheet!r} with pandas")
+        df = pd.read_excel(file_path, sheet_name=sheet)
+        for start in range(0, max(len(df), 1), chunksize):
+            yield df.iloc[start:start + chunksize]
+
+
+def iter_workbook_chunks(file_path: str, sheets=None, chunksize: int = 50_000) -> Iterator[pd.DataFrame]:
+    """Yield the selected sheets one after another as a single stacked table."""
+    for sheet in resolve_sheets(file_path, sheets):
+        yield from iter_sheet_chunks(file_path, sheet, chunksize)
@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from io import BytesIO
+from PIL import Image
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+
+def dhash(image, hash_size=8):
+    """
+    Compute a difference hash of the image as a `hash_size * hash_size` bit integer.
+
+    The hash only depends on the brightness gradient of a tiny grayscale thumbnail,
+    so re-encoding, re-saving, rescaling or a slight crop leaves it (nearly) unchanged.
+    """
+    if not isinstance(image, Image.Image):
+        # Encoded bytes or a file-like object such as a memory-mapped file
+        image = Image.open(BytesIO(image) if isinstance(image, bytes) else image)
+        # Let the JPEG decoder downscale while decoding; no-op for other formats
+        image.draft('L', (hash_size * 4, hash_size * 4))
+    thumb = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = list(thumb.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes using Hamming distance."""
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, item_hash, value):
+        """Insert `value` under `item_hash`. An identical hash replaces the old value."""
+        if self._root is None:
+            self._root = [item_hash, value, {}]
+            self._size = 1
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(item_hash, node[0])
+            if distance == 0:
+                node[1] = value
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [item_hash, value, {}]
+                self._size += 1
+                return
+            node = child
+
+    def search(self, item_hash, max_distance):
+        """Return (distance, hash, value) tuples within `max_distance`, closest first."""
+        results = []
+        if self._root is None:
+            return results
+        stack = [self._root]
+        while stack:
+            node_hash, value, children = stack.pop()
+            distance = hamming_distance(item_hash, node_hash)
+            if distance <= max_distance:
+                results.append((distance, node_hash, value))
+            # Triangle inequality: only subtrees in this band can hold matches
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for d, child in children.items() if low <= d <= high)
+        results.sort(key=lambda result: result[0])
+        return results
+
+    def items(self):
+        """Iterate over all (hash, value) pairs."""
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_hash, value, children = stack.pop()
+            yield node_hash, value
+            stack.extend(children.values())
+
+
+class PerceptualIndex:
+    """Persistent BK-tree mapping perceptual hashes of analyzed images to cache keys."""
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+        index_dir = os.path.dirname(self.index_file)
+        if index_dir and not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        self._load()
+
+    def __len__(self):
+        return len(self._tree)
+
+    def nearest(self, item_hash, max_distance):
+        """Return (distance, cache_key) of the closest indexed image, or None."""
+        with self._lock:
+            matches = self._tree.search(item_hash, max_distance)
+        if not matches:
+            return None
+        distance, _, cache_key = matches[0]
+        return distance, cache_key
+
+    def add(self, item_hash, cache_key):
+        """Index `cache_key` under `item_hash` and persist the index."""
+        with self._lock:
+            self._tree.add(item_hash, cache_key)
+            entries = [[f"{h:x}", key] for h, key in self._tree.items()]
+            self._save(entries)
+
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, 'r') as f:
+                for hex_hash, cache_key in json.load(f):
+                    self._tree.add(int(hex_hash, 16), cache_key)
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable perceptual hash index {self.index_file}: {e}")
+
+    def _save(self, entries):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.index_file) or '.', suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.index_file)
+        except OSError as e:
+            logger.error(f"Error saving perceptual hash index: {e}")
@@ -0,0 +1,189 @@
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image
+import metrics
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+# Bump when the preprocessing changes so stale cached payloads are not reused
+PREPROCESS_VERSION = 'v1'
+MAX_IMAGE_SIZE = (800, 800)
+JPEG_QUALITY = 85
+PAYLOAD_CACHE_DIR = os.environ.get('IMAGE_PAYLOAD_CACHE_DIR', os.path.join('cache', 'payloads'))
+PAYLOAD_CACHE_ENTRIES = int(os.environ.get('IMAGE_PAYLOAD_CACHE_ENTRIES', 2000))
+# Modes a JPEG payload can hold as they are; anything else is converted to RGB
+JPEG_MODES = ('RGB', 'L')
+
+
+def _open(image):
+    if isinstance(image, Image.Image):
+        return image
+    # Encoded bytes or a file-like object such as a memory-mapped file; only the header is read here
+    return Image.open(BytesIO(image) if isinstance(image, bytes) else image)
+
+
+def fit_size(size, max_size=MAX_IMAGE_SIZE):
+    """Largest size within `max_size` with the aspect ratio of `size`; never larger than `size`."""
+    ratio = min(max_size[0] / size[0], max_size[1] / size[1], 1.0)
+    return tuple(max(1, int(dim * ratio)) for dim in size)
+
+
+def prepare_image(image, max_size=MAX_IMAGE_SIZE):
+    """
+    Decode an image at most `max_size` large, in a mode JPEG can store.
+
+    Large JPEGs are decoded at a reduced scale (1/2, 1/4 or 1/8) by the decoder itself
+    before the final resize; images that already fit are not resized, and the colour
+    mode is converted only when JPEG cannot hold it.
+    """
+    image = _open(image)
+    target = fit_size(image.size, max_size)
+    if target != image.size and image.format == 'JPEG':
+        image.draft(image.mode if image.mode in JPEG_MODES else 'RGB', target)
+    if image.size != target:
+        # reducing_gap shrinks by an integer factor first, which is much cheaper than LANCZOS over the full image
+        image = image.resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    if image.mode not in JPEG_MODES:
+        image = image.convert('RGB')
+    return image
+
+
+def encode_jpeg(image, max_size=MAX_IMAGE_SIZE, quality=JPEG_QUALITY):
+    """
+    JPEG bytes for the VLM. A JPEG that already fits and needs no mode conversion is
+    passed through without being decoded.
+    """
+    source = _open(image)
+    if (not isinstance(image, Image.Image) and source.format == 'JPEG' and source.mode in JPEG_MODES
+            and fit_size(source.size, max_size) == source.size):
+        if isinstance(image, bytes):
+            return image
+        image.seek(0)
+        return image.read()
+    buffered = BytesIO()
+    prepare_image(source, max_size).save(buffered, format='JPEG', quality=quality)
+    return buffered.getvalue()
+
+
+class ImagePreprocessor:
+    """
+    Turns uploaded images into the base64 JPEG payload sent to the VLM.
+
+    Payloads are stored content-addressed on disk under the digest of the source image
+    and the preprocessing settings, so analysing the same image again skips decoding
+    and encoding entirely. A small in-memory LRU keeps the most recent payloads.
+    """
+
+    def __init__(self, cache_dir=PAYLOAD_CACHE_DIR, max_size=MAX_IMAGE_SIZE, quality=JPEG_QUALITY,
+                 max_entries=PAYLOAD_CACHE_ENTRIES, memory_entries=16):
+        self.cache_dir = cache_dir
+        self.max_size = tuple(max_size)
+        self.quality = quality
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def payload_key(self, image):
+        """Content address of the payload for `image` under the current settings."""
+        digest = hashlib.sha256(f"{PREPROCESS_VERSION}:{self.max_size}:{self.quality}:".encode())
+        if isinstance(image, Image.Image):
+            digest.update(f"{image.mode}:{image.size}:".encode())
+            digest.update(image.tobytes())
+        else:
+            digest.update(image)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.jpg")
+
+    @metrics.timed('image_preprocess')
+    def payload(self, image, key=None):
+        """Base64 JPEG payload for bytes, a buffer such as an mmap, or a PIL image."""
+        key = key or self.payload_key(image)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            with self._lock:
+                self.hits += 1
+        except OSError:
+            data = encode_jpeg(image, self.max_size, self.quality)
+            self._write(key, data)
+            with self._lock:
+                self.misses += 1
+
+        encoded = base64.b64encode(data).decode()
+        with self._lock:
+            self._memory[key] = encoded
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+        return encoded
+
+    def stats(self):
+        """Return payload cache hit/miss counters."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'memory_entries': len(self._memory)}
+
+    def _write(self, key, data):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except OSError as e:
+            logger.error(f"Error writing image payload {key}: {e}")
+            return
+        self._evict()
+
+    def _evict(self):
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir)
+                       if entry.is_file() and entry.name.endswith('.jpg')]
+        except OSError:
+            return
+        overflow = len(entries) - self.max_entries
+        if overflow <= 0:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:overflow]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+_preprocessor = None
+_preprocessor_lock = threading.Lock()
+
+
+def get_image_preprocessor():
+    """Return the process-wide ImagePreprocessor, creating it on first use."""
+    global _preprocessor
+    if _preprocessor is None:
+        with _preprocessor_lock:
+            if _preprocessor is None:
+                _preprocessor = ImagePreprocessor()
+    return _preprocessor
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import re
+import zlib
+import numpy as np
+import llm_client
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+INTENT_EXAMPLES_FILE = os.environ.get(
+    'INTENT_EXAMPLES_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_examples.json')
+)
+
+
+def load_examples(path=INTENT_EXAMPLES_FILE):
+    """Load labelled (text, intent) pairs from a JSON list of {"text", "intent"} objects."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [(example['text'], example['intent']) for example in json.load(f)]
+
+
+class HashingVectorizer:
+    """
+    TF-IDF over hashed word unigrams, word bigrams and character trigrams.
+
+    Needs no vocabulary or model download; IDF weights are learned from the examples.
+    """
+
+    def __init__(self, n_features=4096):
+        self.n_features = n_features
+        self.idf = np.ones(n_features, dtype=np.float32)
+
+    def _features(self, text):
+        words = re.findall(r"[a-z0-9_]+", text.lower())
+        features = [f"w:{word}" for word in words]
+        features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f" {word} "
+            features += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+        return features
+
+    def _counts(self, texts):
+        matrix = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                matrix[row, zlib.crc32(feature.encode()) % self.n_features] += 1
+        # Sublinear term frequency
+        np.log1p(matrix, out=matrix)
+        return matrix
+
+    def fit(self, texts):
+        counts = self._counts(texts)
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self.idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+        return self
+
+    def transform(self, texts):
+        matrix = self._counts(texts) * self.idf
+        return _normalize_rows(matrix)
+
+
+class OllamaEmbedder:
+    """Sentence embeddings from a local Ollama embedding model such as nomic-embed-text."""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def fit(self, texts):
+        return self
+
+    def transform(self, texts):
+        response = llm_client.embed(model=self.model_name, input=list(texts))
+        return _normalize_rows(np.asarray(response['embeddings'], dtype=np.float32))
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class IntentClassifier:
+    """
+    Cosine k-nearest-neighbour intent classifier over embedded labelled examples.
+
+    The examples are embedded once into a row-normalized matrix; classifying a message
+    is one matrix-vector product plus a similarity-weighted vote among the `k` nearest.
+    """
+
+    def __init__(self, examples=None, k=5, embedding_model=None):
+        if examples is None:
+            examples = load_examples()
+        self.k = k
+        self.texts = [text for text, _ in examples]
+        self.labels = np.array([intent for _, intent in examples])
+
+        self.vectorizer = None
+        if embedding_model:
+            try:
+                self.vectorizer = OllamaEmbedder(embedding_model)
+                self.matrix = self.vectorizer.transform(self.texts)
+            except Exception as e:
+                logger.warning(f"Embedding model {embedding_model} unavailable, using hashing vectorizer: {e}")
+                self.vectorizer = None
+        if self.vectorizer is None:
+            self.vectorizer = HashingVectorizer().fit(self.texts)
+            self.matrix = self.vectorizer.transform(self.texts)
+
+    def classify(self, text):
+        """
+        Return (intent, score, margin), where score is the cosine similarity of the closest
+        example carrying the winning label and margin is how much closer that example is
+        than the closest example of any other label (negative when another label's
+        example is nearer but lost the vote).
+        """
+        query = self.vectorizer.transform([text])[0]
+        similarities = self.matrix @ query
+
+        k = min(self.k, len(similarities))
+        nearest = np.argpartition(-similarities, k - 1)[:k]
+        votes = {}
+        for index in nearest:
+            label = self.labels[index]
+            votes[label] = votes.get(label, 0.0) + max(float(similarities[index]), 0.0)
+
+        intent = max(votes, key=votes.get)
+        score = float(similarities[self.labels == intent].max())
+        others = similarities[self.labels != intent]
+        margin = score - float(others.max()) if len(others) else score
+        return str(intent), score, margin
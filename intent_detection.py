@@ -1,15 +1,118 @@
 import logging
-import ollama
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from functools import lru_cache
+import llm_client
+import metrics
 
 # Get the logger for this module
 logger = logging.getLogger(__name__)
 
-def detect_user_intent(user_input):
-    """
-    Detects whether the user intends to send an email, save a document, analyze data, analyze image, or just chat.
-    Returns one of: 'email', 'save', 'analyze', 'analyze_image', or 'normal'.
-    """
-    intent_prompt = (
+INTENTS = ('email', 'save', 'analyze', 'analyze_image', 'normal')
+
+# Optional polite or request framing before the verb of an instruction
+REQUEST_PREFIX = r"^(please |(can|could|would|will) you (please )?|i (want|need|would like|'d like) (you )?to |help me |let's )?"
+
+# High-precision patterns checked in order before any model call. They only match
+# requests to act ("send an email to ...", "save this report"), anchored at the start
+# of the message; questions about a topic ("what is an MRI?", "how do I write a good
+# email?") are left to the classifier and the LLM.
+FAST_PATH_RULES = [
+    ('normal', re.compile(
+        r"^(hi|hii+|hello|hey|yo|thanks|thank you|thx|ok|okay|cool|great|bye|goodbye|"
+        r"good (morning|afternoon|evening|night)|how are you)[\s!.?]*$")),
+    ('analyze', re.compile(r"^\S+\.(csv|xlsx|xls)$")),
+    ('analyze_image', re.compile(
+        REQUEST_PREFIX + r"(analy[sz]e|check|review|interpret|read) (my |this |the |a |an )?"
+        r"(breast )?(mri|mammogram|ultrasound) ?(scan|image|images|results?)?\b")),
+    ('email', re.compile(
+        REQUEST_PREFIX + r"(send|draft|write|compose|prepare|generate) (an? |the |this |that |my )?e-?mail\b"
+        r"|^e-?mail (him|her|them|my|the|this|it)\b")),
+    ('save', re.compile(
+        REQUEST_PREFIX + r"(save|download|export) (this|it|that|the|your|my)( last)? ?"
+        r"(response|answer|report|summary|conversation|chat|document|note|analysis)?[\s!.?]*$")),
+    ('analyze', re.compile(
+        REQUEST_PREFIX + r"(analy[sz]e|get insights from|give me insights (on|from)) (my |this |the |some |a )?"
+        r"(data|dataset|csv|excel|spreadsheet|sales)\b")),
+]
+
+INTENT_CACHE_SIZE = 1024
+
+# Nearest-neighbour decisions are deferred to the LLM below this cosine similarity, or
+# when the closest example of another intent is within this margin; a margin of 0 still
+# defers when another intent's example is nearer than the winner's. Chosen with
+# benchmarks/calibrate_intent.py: on benchmarks/intent_holdout.json, 0.3 / 0.0 decides
+# 12 of the 32 messages the rules miss with no errors, the most of any error-free setting
+KNN_CONFIDENCE_THRESHOLD = float(os.environ.get('INTENT_KNN_THRESHOLD', 0.3))
+KNN_MARGIN = float(os.environ.get('INTENT_KNN_MARGIN', 0.0))
+# Only nearest-neighbour decisions this clear are cached, so a borderline one is not
+# repeated for every later copy of the message
+KNN_CACHE_THRESHOLD = float(os.environ.get('INTENT_KNN_CACHE_THRESHOLD', 0.5))
+KNN_CACHE_MARGIN = float(os.environ.get('INTENT_KNN_CACHE_MARGIN', 0.2))
+# Optional Ollama embedding model for the k-NN tier; the hashing vectorizer is used otherwise
+INTENT_EMBEDDING_MODEL = os.environ.get('INTENT_EMBEDDING_MODEL')
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+_intent_cache = OrderedDict()
+_tier_counts = Counter()
+_lock = threading.Lock()
+
+
+def _normalize(user_input):
+    """Lower-case, collapse whitespace and trim surrounding punctuation."""
+    return re.sub(r'\s+', ' ', user_input.lower()).strip(' \t\n"\'`')
+
+
+def _fast_path(normalized):
+    for intent, pattern in FAST_PATH_RULES:
+        if pattern.search(normalized):
+            return intent
+    return None
+
+
+def _parse_intent(text):
+    """Map free-text model output onto one of INTENTS, defaulting to 'normal'."""
+    cleaned = text.strip().lower().strip(' .\'"`*-→')
+    if cleaned in INTENTS:
+        return cleaned
+    # Check the longer label first so 'analyze_image' is not read as 'analyze'
+    for intent in ('analyze_image', 'analyze', 'email', 'save', 'normal'):
+        if re.search(rf'\b{intent}\b', cleaned):
+            return intent
+    logger.warning(f"Unrecognized intent label from model: {text!r}")
+    return 'normal'
+
+
+def get_intent_classifier():
+    """Build the k-NN classifier from the example file on first use."""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                # Deferred: the classifier needs numpy, which is not needed for rule or cache hits
+                from intent_classifier import IntentClassifier
+                _classifier = IntentClassifier(embedding_model=INTENT_EMBEDDING_MODEL)
+    return _classifier
+
+
+@lru_cache(maxsize=1)
+def _examples_prompt():
+    from intent_classifier import load_examples
+    return "\n".join(
+        f"Example {number}: {text} → {intent}"
+        for number, (text, intent) in enumerate(load_examples(), start=1)
+    )
+
+
+@lru_cache(maxsize=1)
+def _system_prompt():
+    # Identical on every call, so the model can reuse its processed prefix from the KV
+    # cache; only the short user message that follows is evaluated per request.
+    return (
     "You are an intent detection assistant for a virtual AI agent. Your task is to understand the user's intent "
     "based on their input. The user may want to either send an email, save the assistant's response into a document, "
     "analyze data from a file, analyze a breast MRI scan image, or simply engage in a normal chat.\n\n"
@@ -22,36 +125,102 @@ def detect_user_intent(user_input):
     "- 'normal' → For all general queries or conversational input that do not involve the above intents.\n\n"
 
     "Here are examples to guide your judgment:\n"
-    "Example 1: I want to send an update to my boss about the project → email\n"
-    "Example 2: Can you create a summary report and save it for me? → save\n"
-    "Example 3: Tell me a joke → normal\n"
-    "Example 4: Generate an email to HR about my resignation → email\n"
-    "Example 5: Save this summary to a text file → save\n"
-    "Example 6: What's the capital of France? → normal\n"
-    "Example 7: Email a proposal to the client → email\n"
-    "Example 8: Store this conversation in a file → save\n"
-    "Example 9: Who won the cricket match yesterday? → normal\n"
-    "Example 10: I want to download this response → save\n"
-    "Example 11: Can you analyze this CSV file for me? → analyze\n"
-    "Example 12: I want to upload an Excel file for data insights → analyze\n"
-    "Example 13: Help me understand this dataset → analyze\n"
-    "Example 14: What insights can you get from this data? → analyze\n"
-    "Example 15: I need to analyze some sales data → analyze\n"
-    "Example 16: Can you analyze this breast MRI scan? → analyze_image\n"
-    "Example 17: I want to upload an MRI image for analysis → analyze_image\n"
-    "Example 18: What stage is this breast cancer scan showing? → analyze_image\n"
-    "Example 19: Please analyze this medical image → analyze_image\n"
-    "Example 20: Tell me about this breast MRI scan → analyze_image\n\n"
-    
-    f"Now analyze the following user input:\nUser Input: {user_input}\n\n"
+    f"{_examples_prompt()}\n\n"
+
+    "The next message is the user input to analyze. "
     "Your response (only one word - email, save, analyze, analyze_image, or normal):"
     )
 
+
+def _record(tier):
+    with _lock:
+        _tier_counts[tier] += 1
+
+
+def intent_stats():
+    """
+    Return how many messages each tier ('rule', 'cache', 'knn', 'llm', 'error') decided,
+    with the fraction of all decisions and the current cache size.
+    """
+    with _lock:
+        total = sum(_tier_counts.values())
+        return {
+            'counts': dict(_tier_counts),
+            'fractions': {tier: count / total for tier, count in _tier_counts.items()} if total else {},
+            'cache_entries': len(_intent_cache),
+        }
+
+
+@metrics.timed('intent')
+def detect_user_intent(user_input, allow_llm=True):
+    """
+    Detects whether the user intends to send an email, save a document, analyze data, analyze image, or just chat.
+    Returns one of: 'email', 'save', 'analyze', 'analyze_image', or 'normal'.
+
+    Cheap tiers run first: keyword/regex rules, an LRU cache of earlier decisions keyed
+    on the normalized input, then a nearest-neighbour classifier over the labelled
+    examples. The LLM is only called when the classifier is not confident or another
+    intent's example is nearly as close; with
+    allow_llm=False None is returned instead, without counting a decision.
+    """
+    normalized = _normalize(user_input)
+
+    intent = _fast_path(normalized)
+    if intent is not None:
+        _record('rule')
+        logger.debug(f"Detected intent (rule): {intent}")
+        return intent
+
+    with _lock:
+        intent = _intent_cache.get(normalized)
+        if intent is not None:
+            _intent_cache.move_to_end(normalized)
+    if intent is not None:
+        _record('cache')
+        logger.debug(f"Detected intent (cache): {intent}")
+        return intent
+
+    try:
+        intent, score, margin = get_intent_classifier().classify(normalized)
+    except Exception as e:
+        logger.error(f"Nearest-neighbour intent classification failed: {e}")
+        intent, score, margin = None, 0.0, 0.0
+    if intent in INTENTS and score >= KNN_CONFIDENCE_THRESHOLD and margin >= KNN_MARGIN:
+        _record('knn')
+        logger.debug(f"Detected intent (knn, {score:.2f}, margin {margin:.2f}): {intent}")
+        if score >= KNN_CACHE_THRESHOLD and margin >= KNN_CACHE_MARGIN:
+            _remember(normalized, intent)
+        return intent
+
+    if not allow_llm:
+        return None
+    intent = _llm_intent(user_input)
+    if intent is None:
+        _record('error')
+        return 'normal'
+    _record('llm')
+    _remember(normalized, intent)
+    return intent
+
+
+def _remember(normalized, intent):
+    with _lock:
+        _intent_cache[normalized] = intent
+        while len(_intent_cache) > INTENT_CACHE_SIZE:
+            _intent_cache.popitem(last=False)
+
+
+def _llm_intent(user_input):
+    """Classify with the LLM. Returns None if the call fails."""
     try:
-        response = ollama.chat(model='qwen2.5:3B', messages=[{"role": "user", "content": intent_prompt}])
-        intent = response['message']['content'].strip().lower()
-        logger.debug(f"Detected intent: {intent}")
+        # A reserved slot: a speculative chat generation may be holding a regular one
+        response = llm_client.chat(model=llm_client.MODELS['chat'], reserved=True, messages=[
+            {"role": "system", "content": _system_prompt()},
+            {"role": "user", "content": user_input},
+        ])
+        intent = _parse_intent(response['message']['content'])
+        logger.debug(f"Detected intent (llm): {intent}")
         return intent
     except Exception as e:
         logger.error(f"Intent detection failed: {e}")
-        return 'normal'
+        return None
@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    """A unit of background work with an append-only event log for progress reporting."""
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.events = []
+        self._condition = threading.Condition()
+
+    def report(self, progress):
+        """Append a progress chunk and wake up subscribers."""
+        self._publish({'type': 'progress', 'data': progress})
+
+    def _publish(self, event):
+        with self._condition:
+            self.events.append(event)
+            self._condition.notify_all()
+
+    def wait_for_events(self, start, timeout):
+        """Return events after index `start`, blocking up to `timeout` seconds for new ones."""
+        with self._condition:
+            if len(self.events) <= start and not self.done:
+                self._condition.wait(timeout)
+            return self.events[start:]
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class JobQueue:
+    """
+    Bounded worker pool for slow jobs.
+
+    At most `max_workers` jobs run at once and at most `max_pending` may be queued or
+    running; further submissions raise QueueFullError. Jobs submitted with the key of a
+    job that is still in flight share that job instead of running again. Finished jobs
+    are kept for `retention` seconds so clients can collect the result.
+    """
+
+    def __init__(self, max_workers=2, max_pending=16, retention=15 * 60):
+        self.max_pending = max_pending
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn):
+        """
+        Schedule `fn(job)` unless a job with the same key is already in flight.
+        Returns (job, created) where `created` is False for a deduplicated submission.
+        """
+        with self._lock:
+            self._purge()
+            job = self._in_flight.get(key)
+            if job is not None:
+                return job, False
+            if len(self._in_flight) >= self.max_pending:
+                raise QueueFullError(f"Job queue is full ({self.max_pending} pending jobs)")
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._in_flight[key] = job
+        self._executor.submit(self._run, job, fn)
+        return job, True
+
+    def get(self, job_id):
+        """Return the job with this ID, or None if it is unknown or expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        """Return the number of in-flight and retained jobs."""
+        with self._lock:
+            return {'in_flight': len(self._in_flight), 'retained': len(self._jobs)}
+
+    def _run(self, job, fn):
+        job.status = 'running'
+        job._publish({'type': 'status', 'data': 'running'})
+        try:
+            job.result = fn(job)
+            job.status = 'done'
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                if self._in_flight.get(job.key) is job:
+                    del self._in_flight[job.key]
+            job._publish({'type': 'status', 'data': job.status})
+
+    def _purge(self):
+        # Caller must hold the lock
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
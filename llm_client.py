@@ -0,0 +1,352 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+import metrics
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+# Model used for each role; override per deployment through the environment
+MODELS = {
+    'chat': os.environ.get('CHAT_MODEL', 'qwen2.5:3B'),
+    'vision': os.environ.get('VISION_MODEL', 'gemma3:4b'),
+}
+
+OLLAMA_HOST = os.environ.get('OLLAMA_HOST')
+REQUEST_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 120))
+CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT', 5))
+MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 2))
+RETRY_BACKOFF = float(os.environ.get('LLM_RETRY_BACKOFF', 0.5))
+# How long Ollama keeps a model loaded after a request; avoids reloads between calls
+KEEP_ALIVE = os.environ.get('LLM_KEEP_ALIVE', '30m')
+# Concurrent in-flight requests per model; extra callers wait for a slot
+MODEL_CONCURRENCY = int(os.environ.get('LLM_MODEL_CONCURRENCY', 2))
+# Extra per-model slots only short calls made with reserved=True (intent classification)
+# may use, so they do not queue behind long generations holding the regular slots
+RESERVED_SLOTS = int(os.environ.get('LLM_RESERVED_SLOTS', 1))
+MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', 16))
+# Seconds a call waits for a free model slot before failing with a retryable SlotTimeout
+SLOT_TIMEOUT = float(os.environ.get('LLM_SLOT_TIMEOUT', 60))
+# Log prompt-eval token counts and timings of every chat/generate call, e.g. to check
+# that a shared system prompt prefix is served from the model's KV cache
+MEASURE_PROMPTS = os.environ.get('LLM_MEASURE_PROMPTS', '0') == '1'
+
+
+class SlotTimeout(ConnectionError):
+    """No model slot became free within the slot timeout; retried like a connection error."""
+
+
+def _is_retryable(error):
+    import httpx
+    import ollama
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+
+class LLMClient:
+    """
+    Shared Ollama client with a persistent connection pool, per-model concurrency
+    limits, request timeouts, retry with exponential backoff and a keep-alive policy.
+
+    `backend` / `async_backend` may be any objects exposing the ollama.Client /
+    ollama.AsyncClient methods used here, e.g. a client pointed at a local stub server.
+    The ollama and httpx packages are only imported when the first request is made,
+    which keeps them off the application's startup path.
+    """
+
+    def __init__(self, host=OLLAMA_HOST, timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES,
+                 backoff=RETRY_BACKOFF, keep_alive=KEEP_ALIVE, concurrency=MODEL_CONCURRENCY,
+                 backend=None, async_backend=None, measure=MEASURE_PROMPTS, slot_timeout=SLOT_TIMEOUT,
+                 reserved_slots=RESERVED_SLOTS):
+        self.host = host
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.keep_alive = keep_alive
+        self.concurrency = concurrency
+        self.slot_timeout = slot_timeout
+        self.reserved_slots = reserved_slots
+        self._backend = backend
+        self._async_backend = async_backend
+        self._semaphores = {}
+        self._async_semaphores = {}
+        self._lock = threading.Lock()
+        self.measure = measure
+        self._usage = {}
+
+    def _http_options(self):
+        import httpx
+        return {
+            'timeout': httpx.Timeout(self.timeout, connect=CONNECT_TIMEOUT),
+            'limits': httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        }
+
+    def _get_backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    import ollama
+                    self._backend = ollama.Client(host=self.host, **self._http_options())
+        return self._backend
+
+    # -- sync API --------------------------------------------------------
+
+    def chat(self, model, messages, stream=False, reserved=False, **kwargs):
+        """
+        ollama.chat with pooling, limits and retries. Streams return an iterator of chunks.
+        `reserved` calls use the model's reserved slots instead of the regular ones.
+        """
+        kwargs.setdefault('keep_alive', self.keep_alive)
+        if stream:
+            return self._measured_stream(model, self._stream(
+                model, lambda: self._get_backend().chat(model=model, messages=messages, stream=True, **kwargs), reserved),
+                time.perf_counter())
+        return self._record(model, self._timed_call(
+            model, 'chat', lambda: self._get_backend().chat(model=model, messages=messages, **kwargs), reserved))
+
+    def generate(self, model, prompt='', **kwargs):
+        kwargs.setdefault('keep_alive', self.keep_alive)
+        return self._record(model, self._timed_call(
+            model, 'generate', lambda: self._get_backend().generate(model=model, prompt=prompt, **kwargs)))
+
+    def embed(self, model, input, **kwargs):
+        kwargs.setdefault('keep_alive', self.keep_alive)
+        return self._timed_call(model, 'embed', lambda: self._get_backend().embed(model=model, input=input, **kwargs))
+
+    def preload(self, model):
+        """Load `model` into memory ahead of the first request and keep it there for `keep_alive`."""
+        # An empty prompt makes Ollama load the model without generating anything
+        self._call(model, lambda: self._get_backend().generate(model=model, prompt='', keep_alive=self.keep_alive))
+
+    def usage(self):
+        """
+        Per-model totals of calls, prompt tokens evaluated (tokens served from the KV
+        cache are not counted by Ollama), generated tokens and the seconds spent on each.
+        """
+        with self._lock:
+            return {model: dict(totals) for model, totals in self._usage.items()}
+
+    def _record(self, model, response):
+        # Final responses carry Ollama's token counts and durations (in nanoseconds)
+        try:
+            prompt_tokens = response.get('prompt_eval_count') or 0
+            prompt_seconds = (response.get('prompt_eval_duration') or 0) / 1e9
+            eval_tokens = response.get('eval_count') or 0
+            eval_seconds = (response.get('eval_duration') or 0) / 1e9
+        except AttributeError:
+            return response
+        metrics.LLM_TOKENS.observe(prompt_tokens, model=model, phase='prompt')
+        metrics.LLM_TOKENS.observe(eval_tokens, model=model, phase='eval')
+        metrics.LLM_PHASE_SECONDS.observe(prompt_seconds, model=model, phase='prompt')
+        metrics.LLM_PHASE_SECONDS.observe(eval_seconds, model=model, phase='eval')
+        with self._lock:
+            totals = self._usage.setdefault(model, {
+                'calls': 0, 'prompt_tokens': 0, 'prompt_seconds': 0.0, 'eval_tokens': 0, 'eval_seconds': 0.0})
+            totals['calls'] += 1
+            totals['prompt_tokens'] += prompt_tokens
+            totals['prompt_seconds'] += prompt_seconds
+            totals['eval_tokens'] += eval_tokens
+            totals['eval_seconds'] += eval_seconds
+        if self.measure:
+            logger.info(f"{model}: prompt eval {prompt_tokens} tokens in {prompt_seconds * 1000:.0f} ms, "
+                        f"generated {eval_tokens} tokens in {eval_seconds * 1000:.0f} ms")
+        return response
+
+    def _observe(self, model, endpoint, started, failed=False):
+        seconds = time.perf_counter() - started
+        metrics.LLM_SECONDS.observe(seconds, model=model, endpoint=endpoint)
+        metrics.add_timing('llm', seconds)
+        if failed:
+            metrics.LLM_ERRORS.inc(model=model, endpoint=endpoint)
+
+    def _timed_call(self, model, endpoint, request, reserved=False):
+        started = time.perf_counter()
+        try:
+            response = self._call(model, request, reserved)
+        except Exception:
+            self._observe(model, endpoint, started, failed=True)
+            raise
+        self._observe(model, endpoint, started)
+        return response
+
+    def _measured_stream(self, model, stream, started):
+        first = True
+        failed = False
+        try:
+            for chunk in stream:
+                if first:
+                    metrics.LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started, model=model)
+                    first = False
+                if chunk.get('done'):
+                    self._record(model, chunk)
+                yield chunk
+        except Exception:
+            failed = True
+            raise
+        finally:
+            stream.close()
+            self._observe(model, 'chat_stream', started, failed)
+
+    def _semaphore(self, model, reserved=False):
+        with self._lock:
+            key = (model, reserved)
+            if key not in self._semaphores:
+                self._semaphores[key] = threading.BoundedSemaphore(self.reserved_slots if reserved else self.concurrency)
+            return self._semaphores[key]
+
+    @contextmanager
+    def _slot(self, model, reserved=False):
+        """Hold one of the model's slots; the slot is released however the block exits."""
+        semaphore = self._semaphore(model, reserved)
+        if not semaphore.acquire(timeout=self.slot_timeout):
+            raise SlotTimeout(f"No free {model} slot within {self.slot_timeout:g}s")
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def _delay(self, attempt):
+        return self.backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+
+    def _call(self, model, request, reserved=False):
+        attempt = 0
+        while True:
+            try:
+                with self._slot(model, reserved):
+                    return request()
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+                error = e
+            delay = self._delay(attempt)
+            logger.warning(f"LLM request to {model} failed ({error}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    def _stream(self, model, request, reserved=False):
+        # Retry only until the first chunk arrives; a half-delivered reply cannot be replayed.
+        # The slot is held while the caller iterates and released when the stream ends, fails
+        # or is closed (GeneratorExit), e.g. when an SSE client disconnects.
+        attempt = 0
+        while True:
+            stream = None
+            started = False
+            try:
+                with self._slot(model, reserved):
+                    try:
+                        stream = request()
+                        for chunk in stream:
+                            started = True
+                            yield chunk
+                        return
+                    finally:
+                        if stream is not None and hasattr(stream, 'close'):
+                            stream.close()
+            except Exception as e:
+                if started or attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+                error = e
+            delay = self._delay(attempt)
+            logger.warning(f"LLM stream from {model} failed ({error}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    # -- async API -------------------------------------------------------
+
+    def _get_async_backend(self):
+        if self._async_backend is None:
+            import ollama
+            self._async_backend = ollama.AsyncClient(host=self.host, **self._http_options())
+        return self._async_backend
+
+    def _async_semaphore(self, model, reserved=False):
+        loop = asyncio.get_running_loop()
+        key = (id(loop), model, reserved)
+        if key not in self._async_semaphores:
+            self._async_semaphores[key] = asyncio.Semaphore(self.reserved_slots if reserved else self.concurrency)
+        return self._async_semaphores[key]
+
+    @asynccontextmanager
+    async def _async_slot(self, model, reserved=False):
+        """Async counterpart of _slot, with the same wait timeout."""
+        semaphore = self._async_semaphore(model, reserved)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.slot_timeout)
+        except asyncio.TimeoutError:
+            raise SlotTimeout(f"No free {model} slot within {self.slot_timeout:g}s") from None
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    async def achat(self, model, messages, reserved=False, **kwargs):
+        """Async ollama.chat (non-streaming) with the same limits, slot reservation and retry policy."""
+        kwargs.setdefault('keep_alive', self.keep_alive)
+        backend = self._get_async_backend()
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                async with self._async_slot(model, reserved):
+                    response = await backend.chat(model=model, messages=messages, **kwargs)
+                self._observe(model, 'chat', started)
+                return self._record(model, response)
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    self._observe(model, 'chat', started, failed=True)
+                    raise
+                error = e
+            delay = self._delay(attempt)
+            logger.warning(f"LLM request to {model} failed ({error}); retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide LLMClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient()
+    return _client
+
+
+def set_client(client):
+    """Replace the process-wide client, e.g. with one backed by a stub server in benchmarks."""
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def chat(model, messages, stream=False, reserved=False, **kwargs):
+    return get_client().chat(model, messages, stream=stream, reserved=reserved, **kwargs)
+
+
+async def achat(model, messages, reserved=False, **kwargs):
+    return await get_client().achat(model, messages, reserved=reserved, **kwargs)
+
+
+def generate(model, prompt='', **kwargs):
+    return get_client().generate(model, prompt, **kwargs)
+
+
+def embed(model, input, **kwargs):
+    return get_client().embed(model, input, **kwargs)
+
+
+def usage():
+    return get_client().usage()
+
+
+def preload(model):
+    return get_client().preload(model)
@@ -3,6 +3,7 @@ import logging
 from email_workflow import generate_email_content, modify_email_content, send_email
 from intent_detection import detect_user_intent
 from chat_processing import process_general_chat
+from conversation_memory import new_conversation
 from document_utils import save_response_to_file
 from data_analysis import read_data_file, generate_data_insights, format_analysis_output
 
@@ -18,6 +19,7 @@ def main():
     email_stage = None
     generated_email = None
     last_response = ""  # Store the last LLM response
+    conversation = new_conversation()
 
     print("Welcome to the FrobeAI Assistant (type 'exit' to quit)")
     print("I can help you with:")
@@ -109,7 +111,7 @@ def main():
                 # Process file path
                 success, result = read_data_file(user_input)
                 if success:
-                    print("\nSystem: Analyzing data sample...")
+                    print("\nSystem: Analyzing data profile...")
                     insights = generate_data_insights(result)
                     formatted_output = format_analysis_output(insights)
                     print("\nSystem: Data Analysis Results:")
@@ -137,7 +139,7 @@ def main():
             if mode != "chat":
                 print("System: Switching to general chat mode.")
                 mode = "chat"
-            response = process_general_chat(user_input)
+            response = process_general_chat(user_input, conversation)
             last_response = response
             print(f"LLM: {response}")
 
@@ -0,0 +1,233 @@
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+# Serve the metrics below in the Prometheus text format on /metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+# Add a Server-Timing header with the time each stage of the request took
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+PREFIX = 'frobe_'
+
+# Seconds; spans rule-based intent hits (sub-millisecond) to cold model loads
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (1, 4, 16, 64, 256, 1024, 2048, 4096, 8192, 16384)
+
+_metrics = []
+_collectors = []
+_registry_lock = threading.Lock()
+# Stage timings of the current request, for the Server-Timing header
+_trace = contextvars.ContextVar('metrics_trace', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class: a named metric family with one value per combination of label values."""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _samples(self):
+        """Yield (suffix, label pairs, value) for every series."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, pairs, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(pairs)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield '', list(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Per-bucket counts; made cumulative when rendered. The last slot is +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def _samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in values.items():
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', pairs + [('le', _format_value(float(bound)))], cumulative
+            yield '_sum', pairs, total
+            yield '_count', pairs, cumulative
+
+
+def register_collector(collect):
+    """
+    Add a callable run on every scrape that returns (name, kind, documentation, samples)
+    tuples, `samples` being (labels dict, value) pairs. Used for values other modules
+    already count, such as cache hit counters.
+    """
+    with _registry_lock:
+        _collectors.append(collect)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics, collectors = list(_metrics), list(_collectors)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for collect in collectors:
+        try:
+            families = collect()
+        except Exception as e:
+            logger.warning(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+            continue
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {PREFIX}{name} {documentation}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{PREFIX}{name}{_format_labels(list(labels.items()))} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+STAGE_SECONDS = Histogram('stage_seconds', 'Wall time of each processing stage.', ['stage'])
+HTTP_SECONDS = Histogram('http_request_seconds', 'Time until the response headers are sent (streams continue after).',
+                         ['endpoint', 'method', 'status'])
+LLM_SECONDS = Histogram('llm_request_seconds', 'Wall time of LLM calls, including queueing for a model slot and retries.',
+                        ['model', 'endpoint'])
+LLM_FIRST_TOKEN_SECONDS = Histogram('llm_first_token_seconds', 'Time from a streaming LLM call to its first chunk.', ['model'])
+LLM_ERRORS = Counter('llm_errors_total', 'LLM calls that failed after retries.', ['model', 'endpoint'])
+LLM_TOKENS = Histogram('llm_tokens', 'Tokens per LLM call as reported by Ollama: phase="prompt" is prompt tokens '
+                       'evaluated (excluding KV-cache hits), phase="eval" is generated tokens.',
+                       ['model', 'phase'], buckets=TOKEN_BUCKETS)
+LLM_PHASE_SECONDS = Histogram('llm_phase_seconds', 'Prompt evaluation and generation time per LLM call as reported by Ollama.',
+                              ['model', 'phase'])
+SSE_FIRST_EVENT_SECONDS = Histogram('sse_first_event_seconds', 'Time from the start of a server-sent event stream to its first event.',
+                                    ['endpoint'])
+SSE_STREAM_SECONDS = Histogram('sse_stream_seconds', 'Duration of server-sent event streams.', ['endpoint'])
+SSE_EVENTS = Counter('sse_events_total', 'Server-sent events (including keepalive comments) delivered.', ['endpoint'])
+
+
+def start_trace():
+    """Start collecting stage timings for the current request."""
+    _trace.set([])
+
+
+def end_trace():
+    """Stop collecting and return the (stage, seconds) timings of the current request."""
+    entries = _trace.get()
+    _trace.set(None)
+    return entries or []
+
+
+def add_timing(stage, seconds):
+    """Add a timing to the current request's trace, if one is being collected."""
+    entries = _trace.get()
+    if entries is not None:
+        entries.append((stage, seconds))
+
+
+def record(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    add_timing(stage, seconds)
+
+
+@contextmanager
+def timed(stage):
+    """Time a block (or, as a decorator, a function) as `stage`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+def timed_stream(endpoint, events):
+    """Pass `events` through, recording the time to the first event, stream duration and event count."""
+    started = time.perf_counter()
+    count = 0
+    try:
+        for event in events:
+            if count == 0:
+                SSE_FIRST_EVENT_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+            count += 1
+            yield event
+    finally:
+        SSE_STREAM_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        SSE_EVENTS.inc(count, endpoint=endpoint)
+
+
+def server_timing(entries, total=None):
+    """
+    Server-Timing header value for (stage, seconds) timings; repeated stages are summed,
+    with the number of occurrences as the description.
+    """
+    durations = {}
+    counts = {}
+    for stage, seconds in entries:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+        counts[stage] = counts.get(stage, 0) + 1
+    parts = []
+    for stage, seconds in durations.items():
+        description = f';desc="{counts[stage]}x"' if counts[stage] > 1 else ''
+        parts.append(f"{stage}{description};dur={seconds * 1000:.1f}")
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(parts)
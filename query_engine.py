@@ -0,0 +1,249 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import llm_client
+from data_profiler import jsonable
+from dataset_cache import get_dataset_cache
+from result_cache import TieredCache
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+QUERY_TIMEOUT = float(os.environ.get('QUERY_TIMEOUT', 5))
+QUERY_MAX_ROWS = int(os.environ.get('QUERY_MAX_ROWS', 50))
+QUERY_WORKERS = int(os.environ.get('QUERY_WORKERS', 4))
+# Bump when the translation prompt changes so stale cached SQL is not reused
+TRANSLATION_PROMPT_VERSION = 'v1'
+TABLE_NAME = 'data'
+
+_query_pool = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix='query')
+
+
+class QueryError(Exception):
+    """Raised when a generated query is rejected, fails or times out."""
+
+
+def validate_sql(sql: str) -> str:
+    """Return `sql` as a single read-only SELECT statement, or raise QueryError."""
+    sql = sql.strip().strip('`').strip()
+    if sql.lower().startswith('sql'):
+        sql = sql[3:].strip()
+    sql = sql.rstrip(';').strip()
+    if ';' in sql:
+        raise QueryError("Only a single statement is allowed")
+    if not re.match(r'^(select|with)\b', sql, re.IGNORECASE):
+        raise QueryError("Only SELECT queries are allowed")
+    return sql
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class QueryEngine:
+    """
+    Turns the suggested queries from the data insights into SQL over the uploaded table
+    and runs them.
+
+    DuckDB queries the memory-mapped Arrow copy from the dataset cache directly when
+    both are available; otherwise the table is loaded once into a read-only SQLite file
+    stored with the dataset. Queries run on a thread pool, each limited to `timeout`
+    seconds and `max_rows` rows, and results are cached per dataset fingerprint.
+    """
+
+    def __init__(self, dataset_cache=None, cache=None, timeout=QUERY_TIMEOUT, max_rows=QUERY_MAX_ROWS):
+        self.dataset_cache = dataset_cache or get_dataset_cache()
+        self.cache = cache or TieredCache(os.path.join('cache', 'queries'), max_entries=512, max_disk_entries=5000)
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self._build_lock = threading.Lock()
+
+    def backend(self, file_path: str, sheets=None) -> str:
+        """'duckdb' when the Arrow copy can be queried in place, else 'sqlite'."""
+        if duckdb is not None and self.dataset_cache.arrow_path(file_path, sheets) is not None:
+            return 'duckdb'
+        return 'sqlite'
+
+    def translate(self, profile: Dict, questions: List[str], dialect: str) -> List[Optional[str]]:
+        """Ask the chat model for one SQL query per question; None where it has none."""
+        model = llm_client.MODELS['chat']
+        schema = [[name, column['dtype']] for name, column in profile['columns'].items()]
+        key = self._key('translate', model, TRANSLATION_PROMPT_VERSION, dialect, schema, questions)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        columns = "\n".join(f"- {_quote(name)} ({dtype})" for name, dtype in schema)
+        numbered = "\n".join(f"{index}. {question}" for index, question in enumerate(questions, 1))
+        prompt = (
+            f"Translate each question into one {dialect} SELECT statement over the table {TABLE_NAME} "
+            f"({profile['row_count']} rows) with these columns:\n{columns}\n\n"
+            f"Questions:\n{numbered}\n\n"
+            "Answer with exactly one line per question in the form `<number>. <SQL>`, quoting column names "
+            "with double quotes. Write `<number>. NONE` if a question cannot be answered with a query."
+        )
+        response = llm_client.chat(model=model, messages=[{"role": "user", "content": prompt}],
+                                   options={'temperature': 0})
+        queries = [None] * len(questions)
+        for line in response['message']['content'].splitlines():
+            match = re.match(r'^\s*(\d+)[.):]\s*(.+)$', line)
+            if not match:
+                continue
+            index = int(match.group(1)) - 1
+            sql = match.group(2).strip().strip('`').strip()
+            if 0 <= index < len(queries) and sql.upper() != 'NONE':
+                queries[index] = sql
+        self.cache.set(key, queries)
+        return queries
+
+    def execute(self, file_path: str, sql: str, backend: Optional[str] = None, sheets=None) -> Dict:
+        """Run one read-only query and return its columns and rows (at most `max_rows`)."""
+        backend = backend or self.backend(file_path, sheets)
+        sql = validate_sql(sql)
+        dataset = self.dataset_cache.dataset_key(file_path, sheets)
+        key = self._key('result', dataset, backend, sql, self.max_rows)
+        cached = self.cache.get(key)
+        if cached is not None:
+            if 'error' in cached:
+                raise QueryError(cached['error'])
+            return cached
+
+        # Fetch one extra row to tell whether the result was truncated
+        limited = f"SELECT * FROM ({sql}) AS q LIMIT {self.max_rows + 1}"
+        started = time.perf_counter()
+        try:
+            if backend == 'duckdb':
+                columns, rows = self._execute_duckdb(file_path, limited, sheets)
+            else:
+                columns, rows = self._execute_sqlite(file_path, limited, sheets)
+        except QueryError as e:
+            # Failures and timeouts are deterministic for the same data; do not pay for them twice
+            self.cache.set(key, {'error': str(e)})
+            raise
+        result = {
+            'columns': columns,
+            'rows': [[jsonable(value) for value in row] for row in rows[:self.max_rows]],
+            'truncated': len(rows) > self.max_rows,
+            'elapsed': time.perf_counter() - started,
+        }
+        self.cache.set(key, result)
+        return result
+
+    def run_suggested(self, profile: Dict, questions: List[str]) -> List[Dict]:
+        """Translate and run the suggested queries in parallel; one result dict per question."""
+        file_path = profile.get('source')
+        sheets = profile.get('sheets')
+        if not questions or not file_path or not os.path.exists(file_path):
+            return []
+        backend = self.backend(file_path, sheets)
+        try:
+            queries = self.translate(profile, questions, 'DuckDB' if backend == 'duckdb' else 'SQLite')
+        except Exception as e:
+            logger.error(f"Error translating suggested queries: {e}")
+            return []
+
+        def run(question, sql):
+            result = {'question': question, 'sql': sql}
+            if sql is None:
+                result['error'] = "No query could be generated"
+                return result
+            try:
+                result.update(self.execute(file_path, sql, backend, sheets))
+            except Exception as e:
+                logger.info(f"Suggested query failed: {sql}: {e}")
+                result['error'] = str(e)
+            return result
+
+        futures = [_query_pool.submit(run, question, sql) for question, sql in zip(questions, queries)]
+        return [future.result() for future in futures]
+
+    def _execute_duckdb(self, file_path, sql, sheets=None):
+        table = self.dataset_cache.table(file_path, sheets)
+        conn = duckdb.connect(config={'enable_external_access': False})
+        timer = threading.Timer(self.timeout, conn.interrupt)
+        timer.start()
+        try:
+            conn.register(TABLE_NAME, table)
+            cursor = conn.execute(sql)
+            columns = [description[0] for description in cursor.description]
+            return columns, cursor.fetchall()
+        except duckdb.InterruptException:
+            raise QueryError(f"Query timed out after {self.timeout:g}s")
+        except duckdb.Error as e:
+            raise QueryError(str(e))
+        finally:
+            timer.cancel()
+            conn.close()
+
+    def _execute_sqlite(self, file_path, sql, sheets=None):
+        path = self._sqlite_path(file_path, sheets)
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        deadline = time.monotonic() + self.timeout
+        # A non-zero return from the progress handler aborts the running statement
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+        try:
+            cursor = conn.execute(sql)
+            columns = [description[0] for description in cursor.description]
+            return columns, cursor.fetchall()
+        except sqlite3.OperationalError as e:
+            if time.monotonic() > deadline:
+                raise QueryError(f"Query timed out after {self.timeout:g}s")
+            raise QueryError(str(e))
+        finally:
+            conn.close()
+
+    def _sqlite_path(self, file_path, sheets=None):
+        path = self.dataset_cache.entry_path(file_path, 'data.sqlite', sheets)
+        if os.path.exists(path):
+            return path
+        with self._build_lock:
+            if not os.path.exists(path):
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+                os.close(fd)
+                try:
+                    conn = sqlite3.connect(tmp_path)
+                    try:
+                        for chunk in self.dataset_cache.iter_chunks(file_path, sheets):
+                            chunk.to_sql(TABLE_NAME, conn, if_exists='append', index=False)
+                        conn.commit()
+                    finally:
+                        conn.close()
+                    os.replace(tmp_path, path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+        return path
+
+    def _key(self, *parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_query_engine():
+    """Return the process-wide QueryEngine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = QueryEngine()
+    return _engine
+
+
+def run_suggested_queries(profile: Dict, questions: List[str]) -> List[Dict]:
+    return get_query_engine().run_suggested(profile, questions)
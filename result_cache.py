@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+
+class TieredCache:
+    """
+    Two-level result cache: an in-memory LRU in front of a directory of JSON files.
+
+    Entries expire after `ttl` seconds (None disables expiry). The memory tier holds
+    at most `max_entries` items and the disk tier at most `max_disk_entries` files;
+    the least recently used / oldest entries are evicted first.
+    """
+
+    def __init__(self, cache_dir, max_entries=100, max_disk_entries=1000, ttl=None):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self.evictions = 0
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key):
+        """Return the cached value for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if not self._expired(created):
+                    self._memory.move_to_end(key)
+                    self.hits['memory'] += 1
+                    return value
+                del self._memory[key]
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            created, value = entry
+            self._remember(key, created, value)
+            self.hits['disk'] += 1
+            return value
+
+    def set(self, key, value):
+        """Store `value` in both tiers. The disk write is atomic."""
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, value)
+        self._write_disk(key, created, value)
+        self._evict_disk()
+
+    def stats(self):
+        """Return hit/miss counters and current tier sizes."""
+        with self._lock:
+            lookups = self.hits['memory'] + self.hits['disk'] + self.misses
+            return {
+                'memory_hits': self.hits['memory'],
+                'disk_hits': self.hits['disk'],
+                'misses': self.misses,
+                'hit_rate': (lookups - self.misses) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'memory_entries': len(self._memory),
+            }
+
+    def _remember(self, key, created, value):
+        # Caller must hold the lock
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _read_disk(self, key):
+        cache_file = self._path(key)
+        if not os.path.exists(cache_file):
+            return None
+        try:
+            with open(cache_file, 'r') as f:
+                entry = json.load(f)
+            created, value = entry['created'], entry['value']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable cache file {cache_file}: {e}")
+            return None
+        if self._expired(created):
+            self._remove(cache_file)
+            return None
+        return created, value
+
+    def _write_disk(self, key, created, value):
+        # Write to a temp file in the same directory, then rename over the target so
+        # readers never observe a partially written entry.
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'created': created, 'value': value}, f)
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                self._remove(tmp_path)
+                raise
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Error writing cache entry {key}: {e}")
+
+    def _evict_disk(self):
+        if self.max_disk_entries is None:
+            return
+        try:
+            entries = [
+                entry for entry in os.scandir(self.cache_dir)
+                if entry.is_file() and entry.name.endswith('.json')
+            ]
+        except OSError:
+            return
+        overflow = len(entries) - self.max_disk_entries
+        if overflow <= 0:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:overflow]:
+            self._remove(entry.path)
+            with self._lock:
+                self.evictions += 1
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,276 @@
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE = {
+    'mode': 'chat',
+    'email_stage': None,
+    'generated_email': None,
+    'last_response': '',
+    'current_data': None,  # Store current data for analysis
+    'current_image': None,  # Store current image for analysis
+    'conversation': None  # General chat history, see conversation_memory
+}
+
+
+class BlobRef:
+    """Reference to a value spilled to the blob store instead of being kept in the session."""
+
+    def __init__(self, digest, size):
+        self.digest = digest
+        self.size = size
+
+
+class BlobStore:
+    """Content-addressed directory of pickled values."""
+
+    def __init__(self, blob_dir):
+        self.blob_dir = blob_dir
+        if not os.path.exists(self.blob_dir):
+            os.makedirs(self.blob_dir)
+
+    def _path(self, digest):
+        return os.path.join(self.blob_dir, f"{digest}.blob")
+
+    def put(self, data):
+        """Store serialized bytes and return a BlobRef to them."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return BlobRef(digest, len(data))
+
+    def touch(self, ref):
+        """Mark a blob as still referenced so purge() keeps it."""
+        try:
+            os.utime(self._path(ref.digest))
+        except OSError:
+            pass
+
+    def get(self, ref):
+        """Load the value behind a BlobRef."""
+        with open(self._path(ref.digest), 'rb') as f:
+            return pickle.load(f)
+
+    def purge(self, max_age):
+        """Delete blobs not written or re-referenced for `max_age` seconds."""
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self.blob_dir):
+            try:
+                if entry.name.endswith('.blob') and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+class SessionState(dict):
+    """Session state dict that loads spilled blobs on first access."""
+
+    def __init__(self, values, blobs):
+        super().__init__(values)
+        self._blobs = blobs
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, BlobRef):
+            value = self._blobs.get(value)
+            super().__setitem__(key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+class SessionStore:
+    """
+    Base class for session-keyed state backends.
+
+    States are pickled on save. Values larger than `blob_threshold` bytes, and then the
+    largest remaining values until the state fits in `max_state_bytes`, are written to
+    the blob store and kept in the session only by reference. Subclasses implement
+    `_read`, `_write`, `_delete` and `_purge` over the serialized bytes.
+    """
+
+    def __init__(self, blob_dir, ttl=24 * 3600, blob_threshold=64 * 1024, max_state_bytes=256 * 1024):
+        self.ttl = ttl
+        self.blob_threshold = blob_threshold
+        self.max_state_bytes = max_state_bytes
+        self.blobs = BlobStore(blob_dir)
+        self._last_purge = time.time()
+
+    def load(self, session_id):
+        """Return the state for `session_id`, or a fresh default state."""
+        data = self._read(session_id)
+        if data is None:
+            return SessionState(copy.deepcopy(DEFAULT_STATE), self.blobs)
+        try:
+            return SessionState(pickle.loads(data), self.blobs)
+        except Exception as e:
+            logger.error(f"Discarding unreadable session {session_id}: {e}")
+            return SessionState(copy.deepcopy(DEFAULT_STATE), self.blobs)
+
+    def save(self, session_id, state):
+        """Persist `state`, spilling large values to the blob store."""
+        values = dict.copy(state)
+        sizes = {}
+        for key, value in values.items():
+            if isinstance(value, BlobRef):
+                self.blobs.touch(value)
+                continue
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            if len(data) > self.blob_threshold:
+                values[key] = self.blobs.put(data)
+            else:
+                sizes[key] = len(data)
+
+        total = sum(sizes.values())
+        for key in sorted(sizes, key=sizes.get, reverse=True):
+            if total <= self.max_state_bytes:
+                break
+            values[key] = self.blobs.put(pickle.dumps(values[key], protocol=pickle.HIGHEST_PROTOCOL))
+            total -= sizes[key]
+
+        self._write(session_id, pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL))
+        self._maybe_purge()
+
+    def update(self, session_id, fn):
+        """Load the state, apply `fn(state)` and save it again."""
+        state = self.load(session_id)
+        fn(state)
+        self.save(session_id, state)
+
+    def delete(self, session_id):
+        self._delete(session_id)
+
+    def _maybe_purge(self):
+        if self.ttl is None or time.time() - self._last_purge < min(self.ttl, 3600):
+            return
+        self._last_purge = time.time()
+        self._purge(time.time() - self.ttl)
+        self.blobs.purge(self.ttl)
+
+    def _read(self, session_id):
+        raise NotImplementedError
+
+    def _write(self, session_id, data):
+        raise NotImplementedError
+
+    def _delete(self, session_id):
+        raise NotImplementedError
+
+    def _purge(self, cutoff):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """In-process store with LRU eviction beyond `max_sessions` and TTL expiry."""
+
+    def __init__(self, blob_dir, max_sessions=1000, **kwargs):
+        super().__init__(blob_dir, **kwargs)
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _read(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            updated, data = entry
+            if self.ttl is not None and time.time() - updated > self.ttl:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return data
+
+    def _write(self, session_id, data):
+        with self._lock:
+            self._sessions[session_id] = (time.time(), data)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def _delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _purge(self, cutoff):
+        with self._lock:
+            expired = [sid for sid, (updated, _) in self._sessions.items() if updated < cutoff]
+            for sid in expired:
+                del self._sessions[sid]
+
+
+class SQLiteSessionStore(SessionStore):
+    """Store backed by an SQLite file, shareable between worker processes on one host."""
+
+    def __init__(self, db_path, blob_dir, **kwargs):
+        super().__init__(blob_dir, **kwargs)
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, data BLOB NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _read(self, session_id):
+        row = self._connect().execute(
+            "SELECT data, updated FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        data, updated = row
+        if self.ttl is not None and time.time() - updated > self.ttl:
+            self._delete(session_id)
+            return None
+        return data
+
+    def _write(self, session_id, data):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, updated) VALUES (?, ?, ?)",
+                (session_id, data, time.time())
+            )
+
+    def _delete(self, session_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def _purge(self, cutoff):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE updated < ?", (cutoff,))
+
+
+def create_session_store(backend='memory', data_dir='sessions', **kwargs):
+    """Build the session store named by `backend` ('memory' or 'sqlite')."""
+    blob_dir = os.path.join(data_dir, 'blobs')
+    if backend == 'memory':
+        return MemorySessionStore(blob_dir, **kwargs)
+    if backend == 'sqlite':
+        return SQLiteSessionStore(os.path.join(data_dir, 'sessions.db'), blob_dir, **kwargs)
+    raise ValueError(f"Unknown session backend: {backend}")
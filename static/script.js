@@ -39,6 +39,20 @@ document.addEventListener('DOMContentLoaded', () => {
         return messageContent;
     }
 
+    // Function to show rendered charts below a message
+    function appendCharts(messageContent, charts) {
+        if (!charts || charts.length === 0) return;
+        charts.forEach(chart => {
+            const img = document.createElement('img');
+            img.className = 'chart-image';
+            img.src = `/charts/${chart.filename}`;
+            img.alt = chart.title;
+            img.title = chart.title;
+            messageContent.appendChild(img);
+        });
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
+
     // Function to show typing indicator
     function showTypingIndicator() {
         const indicator = document.createElement('div');
@@ -125,6 +139,41 @@ document.addEventListener('DOMContentLoaded', () => {
         doc.save(filename.replace('.txt', '.pdf'));
     }
 
+    // Read a server-sent event stream, calling onEvent with each parsed payload.
+    // Events may be split across network chunks, so buffer until a blank line.
+    // Returning false from onEvent stops reading.
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+
+            for (const event of events) {
+                for (const line of event.split('\n')) {
+                    if (!line.startsWith('data: ')) continue;
+                    let data;
+                    try {
+                        data = JSON.parse(line.slice(6));
+                    } catch (e) {
+                        console.error('Error parsing SSE data:', e);
+                        continue;
+                    }
+                    if (onEvent(data) === false) {
+                        reader.cancel();
+                        return;
+                    }
+                }
+            }
+        }
+    }
+
     // Handle image upload
     imageUpload.addEventListener('change', handleImageSelect);
     fileUpload.addEventListener('change', handleFileSelect);
@@ -132,13 +181,26 @@ document.addEventListener('DOMContentLoaded', () => {
     cancelUpload.addEventListener('click', closeImagePreview);
     confirmUpload.addEventListener('click', handleImageUpload);
 
+    // Match on the extensions the input accepts: browsers report DICOM files with an
+    // empty MIME type and series zips as application/zip
+    const imageExtensions = imageUpload.accept.split(',').map(extension => extension.trim().toLowerCase());
+
+    function hasExtension(file, extensions) {
+        const name = file.name.toLowerCase();
+        return extensions.some(extension => name.endsWith(extension));
+    }
+
     function handleImageSelect(e) {
         const file = e.target.files[0];
-        if (file && file.type.startsWith('image/')) {
+        if (!file || !hasExtension(file, imageExtensions)) {
+            alert('Please select a valid image file (PNG, JPG, JPEG, DICOM or a zipped DICOM series)');
+            imageUpload.value = '';
+        } else if (file.type.startsWith('image/')) {
             selectedFile = file;
             showImagePreview(file);
         } else {
-            alert('Please select a valid image file (PNG, JPG, JPEG, or DICOM)');
+            // DICOM files and series cannot be previewed by the browser
+            uploadFile(file);
             imageUpload.value = '';
         }
     }
@@ -177,16 +239,7 @@ document.addEventListener('DOMContentLoaded', () => {
         const formData = new FormData();
         formData.append('file', file);
 
-        // Show uploading message with image preview
-        if (file.type.startsWith('image/')) {
-            const reader = new FileReader();
-            reader.onload = function(e) {
-                addMessage(`Uploading ${file.name}...`, true);
-            };
-            reader.readAsDataURL(file);
-        } else {
-            addMessage(`Uploading ${file.name}...`, true);
-        }
+        addMessage(`Uploading ${file.name}...`, true);
 
         // Show typing indicator
         const typingIndicator = showTypingIndicator();
@@ -197,12 +250,17 @@ document.addEventListener('DOMContentLoaded', () => {
         })
         .then(response => response.json())
         .then(data => {
+            // Images, DICOM files and series are analyzed in a background job
+            if (data.job_id) {
+                return followAnalysisJob(data.job_id, typingIndicator);
+            }
             typingIndicator.remove();
 
             if (data.error) {
                 addMessage(`Error: ${data.error}`);
             } else {
-                addMessage(data.response);
+                const messageContent = addMessage(data.response);
+                appendCharts(messageContent, data.charts);
                 if (data.mode) {
                     updateModeIndicator(data.mode);
                 }
@@ -215,6 +273,37 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    // Follow an image analysis job and show model output live
+    async function followAnalysisJob(jobId, typingIndicator) {
+        try {
+            const events = await fetch(`/api/jobs/${jobId}/events`);
+            typingIndicator.remove();
+            const messageContent = addMessage('Analyzing image...\n', false);
+            let progressText = '';
+            await readEventStream(events, (event) => {
+                if (event.error) {
+                    messageContent.innerHTML = `Error: ${event.error}`;
+                    return false;
+                }
+                if (event.progress) {
+                    progressText += event.progress;
+                    messageContent.innerHTML = ('Analyzing image...\n' + progressText).replace(/\n/g, '<br>');
+                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                }
+                if (event.response) {
+                    messageContent.innerHTML = event.response.replace(/\n/g, '<br>');
+                }
+                if (event.mode) {
+                    updateModeIndicator(event.mode);
+                }
+            });
+        } catch (error) {
+            typingIndicator.remove();
+            addMessage('Error: Lost the connection to the image analysis. Please try again.');
+            console.error('Error:', error);
+        }
+    }
+
     // Handle form submission with streaming
     chatForm.addEventListener('submit', async (e) => {
         e.preventDefault();
@@ -247,48 +336,38 @@ document.addEventListener('DOMContentLoaded', () => {
                 return;
             }
 
-            const reader = response.body.getReader();
             let fullText = '';
             let mode = 'chat';
             let documentData = null;
+            let charts = [];
 
-            const decoder = new TextDecoder();
-            while (true) {
-                const { value, done } = await reader.read();
-                if (done) break;
-
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n');
-
-                for (const line of lines) {
-                    if (line.startsWith('data: ')) {
-                        try {
-                            const data = JSON.parse(line.slice(6));
-                            
-                            if (data.error) {
-                                messageContent.innerHTML = `Error: ${data.error}`;
-                                return;
-                            }
-
-                            if (data.document) {
-                                documentData = data.document;
-                            }
-
-                            if (data.response) {
-                                fullText += data.response;
-                                messageContent.innerHTML = fullText.replace(/\n/g, '<br>');
-                            }
-
-                            if (data.mode) {
-                                mode = data.mode;
-                                updateModeIndicator(mode);
-                            }
-                        } catch (e) {
-                            console.error('Error parsing SSE data:', e);
-                        }
-                    }
+            await readEventStream(response, (data) => {
+                if (data.error) {
+                    messageContent.innerHTML = `Error: ${data.error}`;
+                    return false;
                 }
-            }
+
+                if (data.document) {
+                    documentData = data.document;
+                }
+
+                if (data.charts) {
+                    charts = charts.concat(data.charts);
+                }
+
+                if (data.response) {
+                    fullText += data.response;
+                    messageContent.innerHTML = fullText.replace(/\n/g, '<br>');
+                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                }
+
+                if (data.mode && data.mode !== mode) {
+                    mode = data.mode;
+                    updateModeIndicator(mode);
+                }
+            });
+
+            appendCharts(messageContent, charts);
 
             // Handle document download if available
             if (documentData) {
@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+# Largest accepted upload; larger requests are refused before their body is read
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 50 * 1024 * 1024))
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured size limit."""
+
+
+class StoredUpload:
+    """
+    Reference to an upload stored on disk under its content hash.
+
+    Sessions and background jobs hold this small object instead of the file's bytes;
+    consumers open or memory-map `path` when they need the data.
+    """
+
+    def __init__(self, path, sha256, size, filename):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.filename = filename
+
+    def read_bytes(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def __repr__(self):
+        return f"StoredUpload({self.filename!r}, {self.sha256[:12]}, {self.size} bytes)"
+
+
+class UploadStore:
+    """
+    Writes uploads to `upload_dir` in fixed-size chunks, hashing as it writes and
+    aborting as soon as `max_bytes` is exceeded. Files are named by their SHA-256 (plus
+    the original extension), so re-uploading the same file stores it once.
+    """
+
+    def __init__(self, upload_dir, max_bytes=MAX_UPLOAD_BYTES, chunk_size=COPY_CHUNK_SIZE):
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        if not os.path.exists(self.upload_dir):
+            os.makedirs(self.upload_dir)
+
+    def save(self, stream, filename):
+        """Copy `stream` into the store and return a StoredUpload for it."""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.upload_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLarge(f"File exceeds the {self.max_bytes // (1024 * 1024)} MB upload limit")
+                    digest.update(chunk)
+                    f.write(chunk)
+            if size == 0:
+                raise ValueError("The uploaded file is empty")
+
+            sha256 = digest.hexdigest()
+            extension = os.path.splitext(filename)[1].lower()
+            path = os.path.join(self.upload_dir, f"{sha256}{extension}")
+            if os.path.exists(path):
+                os.utime(path)
+            else:
+                os.replace(tmp_path, path)
+                tmp_path = None
+            return StoredUpload(path, sha256, size, filename)
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+@contextmanager
+def measure_peak_memory(label):
+    """
+    Log the peak Python heap allocation inside the block when tracemalloc is tracing
+    (enable with PYTHONTRACEMALLOC=1 or UPLOAD_MEMORY_PROFILE=1). The peak is process
+    wide, so concurrent requests are included in it.
+    """
+    if not tracemalloc.is_tracing():
+        yield
+        return
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        logger.info(f"{label}: peak {(peak - baseline) / 1024:.0f} KiB above baseline "
+                    f"in {time.perf_counter() - started:.3f}s")
@@ -1,194 +1,208 @@
 import logging
 from PIL import Image
-import ollama
-from io import BytesIO
-import base64
+import llm_client
 import hashlib
-import os
-from functools import lru_cache
 import re
+import json
+import mmap
+from result_cache import TieredCache
+from image_hash import dhash, PerceptualIndex
+from image_preprocess import get_image_preprocessor
+from dicom_ingest import is_dicom_upload, load_study_image
+import os
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Bump whenever the analysis or formatting prompts change so stale cached reports
+# are not served for the new prompt.
+PROMPT_VERSION = 'v3'
+
+ANALYSIS_PROMPT = """
+    You are a medical AI Vision-Language assistant specialized in analyzing breast cancer medical images and generating diagnostic insights.
+
+    Your task is to:
+    1. Accurately analyze the uploaded breast scan image.
+    2. Identify and classify the cancer stage as one of the following:
+    - Preliminary Stage
+    - Middle Stage
+    - Final Stage
+    3. Provide a concise medical explanation justifying your stage classification based on visual markers observed in the image (e.g., tumor size, lymph node involvement, tissue structure, etc.).
+    4. Based on the identified stage, follow these outputs:
+    - If **Preliminary Stage**:
+        • Provide key **precautionary measures** based on standard medical guidelines to prevent cancer progression.
+    - If **Middle or Final Stage**:
+        • Provide an **analysis of the cancer progression**, and suggest medically recommended **treatment strategies** or **recovery plans** aligned with current oncology practices.
+
+    Your output should be clear, accurate, medically relevant, and ready to be included in a structured PDF report. Avoid speculative language. Do not generate treatment or medical advice outside of recognized guidelines.
+   
+                     """
+
+STRUCTURED_OUTPUT_INSTRUCTIONS = """
+    Respond ONLY with a JSON object with these fields:
+    - "stage": one of "preliminary", "middle", "final" or "unknown"
+    - "confidence": your confidence in the stage classification, between 0 and 1
+    - "observations": list of the key visual findings, one short sentence each
+    - "explanation": the medical explanation justifying the stage classification
+    - "recommendations": list of precautionary measures (preliminary stage) or treatment strategies and recovery plans (middle or final stage)
+"""
+
+# The instructions above go in the system message and stay identical across scans, so
+# the model can reuse them from its KV cache; the user message carries only the image
+IMAGE_MESSAGE = "Analyze this breast scan image."
+
+MARKDOWN_PROMPT = """
+    Convert the text in the user's message into a well-structured Markdown format. Include ALL of the following sections:
+    1. Analysis (including stage, observations, and confidence level)
+    2. Detailed medical explanation
+    3. Treatment recommendations or precautionary measures based on the stage
+    4. A medical disclaimer
+
+    Format it with proper Markdown headers, bullet points, and emphasis where appropriate.
+    and Give entire response in between ```markdown``` tags
+"""
+
+# JSON schema passed to Ollama's `format` parameter to constrain single-pass output
+ANALYSIS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'stage': {'type': 'string', 'enum': ['preliminary', 'middle', 'final', 'unknown']},
+        'confidence': {'type': 'number', 'minimum': 0, 'maximum': 1},
+        'observations': {'type': 'array', 'items': {'type': 'string'}},
+        'explanation': {'type': 'string'},
+        'recommendations': {'type': 'array', 'items': {'type': 'string'}},
+    },
+    'required': ['stage', 'confidence', 'observations', 'explanation', 'recommendations'],
+}
+
+# Hamming distance (in bits of the 64-bit dHash) within which an earlier scan's report is
+# served for a new scan. Off by default: scans from the same protocol can hash this close
+# while showing different findings, so look-alikes are only flagged. Exact copies are
+# always served from the cache by content hash.
+MRI_REUSE_DISTANCE = int(os.environ['MRI_REUSE_DISTANCE']) if os.environ.get('MRI_REUSE_DISTANCE') else None
+
+MEDICAL_DISCLAIMER = (
+    "This report was generated by an AI model and is intended to support, not replace, "
+    "the judgement of a qualified radiologist or oncologist. All findings must be confirmed "
+    "by a medical professional before any clinical decision is made."
+)
+
 class BreastMRIAnalyzer:
-    def __init__(self):
-        self.model_name = 'gemma3:4b'
-        self.cache_dir = 'cache'
-        if not os.path.exists(self.cache_dir):
-            os.makedirs(self.cache_dir)
-        
-    def _compress_image(self, image, max_size=(800, 800)):
-        """Compress image while maintaining aspect ratio."""
-        if isinstance(image, bytes):
-            image = Image.open(BytesIO(image))
-        
-        # Calculate new dimensions while maintaining aspect ratio
-        ratio = min(max_size[0]/image.size[0], max_size[1]/image.size[1])
-        new_size = tuple(int(dim * ratio) for dim in image.size)
+    def __init__(self, model_name=None, cache_dir='cache', cache_size=100, cache_ttl=30 * 24 * 3600,
+                 reuse_distance=MRI_REUSE_DISTANCE, flag_distance=10, structured_output=True, preprocessor=None):
+        self.model_name = model_name or llm_client.MODELS['vision']
+        # Single schema-constrained call rendered to Markdown locally; set to False
+        # for the legacy analysis + Markdown reformatting round trip.
+        self.structured_output = structured_output
+        self.prompt_version = f"{PROMPT_VERSION}-{'structured' if structured_output else 'two-pass'}"
+        self.cache_dir = cache_dir
+        self.cache = TieredCache(self.cache_dir, max_entries=cache_size, ttl=cache_ttl)
+        # Perceptual hashes within `flag_distance` bits annotate the new report as a likely
+        # duplicate; within `reuse_distance` bits (None: never) the earlier report is reused.
+        self.reuse_distance = reuse_distance
+        self.flag_distance = flag_distance
+        # One index per model/prompt version, matching the scope of the cache keys
+        index_name = re.sub(r'[^\w.-]', '_', f"{self.model_name}-{self.prompt_version}") + '.json'
+        self.phash_index = PerceptualIndex(os.path.join(self.cache_dir, 'phash', index_name))
+        # Resized JPEG payloads, stored by source content and shared across models
+        self.preprocessor = preprocessor or get_image_preprocessor()
         
-        # Resize image
-        image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-            
-        return image
-    
     def _get_cache_key(self, image_data):
-        """Generate a cache key for the image."""
-        if isinstance(image_data, bytes):
-            return hashlib.md5(image_data).hexdigest()
-        return hashlib.md5(image_data.tobytes()).hexdigest()
+        """Generate a cache key for the image, the model and the prompt version."""
+        digest = hashlib.md5(f"{self.model_name}:{self.prompt_version}:".encode())
+        if isinstance(image_data, Image.Image):
+            digest.update(image_data.tobytes())
+        else:
+            digest.update(image_data)
+        return digest.hexdigest()
     
-    @lru_cache(maxsize=100)
     def _get_cached_analysis(self, cache_key):
         """Get cached analysis if available."""
-        cache_file = os.path.join(self.cache_dir, f"{cache_key}.json")
-        if os.path.exists(cache_file):
-            try:
-                import json
-                with open(cache_file, 'r') as f:
-                    return json.load(f)
-            except:
-                return None
-        return None
+        return self.cache.get(cache_key)
     
     def _save_to_cache(self, cache_key, analysis):
         """Save analysis to cache."""
-        cache_file = os.path.join(self.cache_dir, f"{cache_key}.json")
-        try:
-            import json
-            with open(cache_file, 'w') as f:
-                json.dump(analysis, f)
-        except:
-            pass
-        
-    
+        self.cache.set(cache_key, analysis)
 
-    def analyze_mri_scan(self, image_data):
+    def _find_near_duplicate(self, image_hash):
+        """Return (distance, cache_key) of a previously analyzed look-alike image, or None."""
+        return self.phash_index.nearest(image_hash, self.flag_distance)
+
+    def cache_stats(self):
+        """Return hit/miss counters for the analysis cache."""
+        return self.cache.stats()
+
+    def analyze_mri_scan(self, image_data, on_token=None):
         """
         Analyzes a breast MRI scan image and determines the stage of cancer.
         
         Args:
-            image_data: Image data in bytes or PIL Image format
+            image_data: Image data in bytes or PIL Image format, or the path of a stored
+                image, which is memory-mapped rather than read into memory. Paths of DICOM
+                files and zipped DICOM series are reduced to a montage of representative slices
+            on_token: Optional callable receiving progress text: each chunk of model output
+                in two-pass mode, a single status note in structured mode
             
         Returns:
             dict: Analysis results containing stage, confidence, and markdown report
         """
+        if isinstance(image_data, (str, os.PathLike)):
+            try:
+                if is_dicom_upload(image_data):
+                    image, series = load_study_image(image_data)
+                    return dict(self.analyze_mri_scan(image, on_token), series=series)
+                with open(image_data, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return self.analyze_mri_scan(mapped, on_token)
+            except (OSError, ValueError) as e:
+                logger.error(f"Error opening image {image_data}: {e}")
+                return {
+                    'error': f"Failed to open image: {str(e)}",
+                    'stage': 'unknown',
+                    'observations': [],
+                    'confidence': 0.0,
+                    'markdown': ''
+                }
+
         try:
             # Generate cache key
             cache_key = self._get_cache_key(image_data)
-            
-            # Compress image
-            image = self._compress_image(image_data)
-            
-            # Convert to base64
-            buffered = BytesIO()
-            image.save(buffered, format="JPEG", quality=85)
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            
-            # Prepare the prompt for analysis
-            prompt = """
-    You are a medical AI Vision-Language assistant specialized in analyzing breast cancer medical images and generating diagnostic insights.
-
-    Your task is to:
-    1. Accurately analyze the uploaded breast scan image.
-    2. Identify and classify the cancer stage as one of the following:
-    - Preliminary Stage
-    - Middle Stage
-    - Final Stage
-    3. Provide a concise medical explanation justifying your stage classification based on visual markers observed in the image (e.g., tumor size, lymph node involvement, tissue structure, etc.).
-    4. Based on the identified stage, follow these outputs:
-    - If **Preliminary Stage**:
-        • Provide key **precautionary measures** based on standard medical guidelines to prevent cancer progression.
-    - If **Middle or Final Stage**:
-        • Provide an **analysis of the cancer progression**, and suggest medically recommended **treatment strategies** or **recovery plans** aligned with current oncology practices.
+            cached = self._get_cached_analysis(cache_key)
+            if cached is not None:
+                logger.info(f"Serving cached analysis for {cache_key}")
+                return dict(cached, cached=True)
 
-    Your output should be clear, accurate, medically relevant, and ready to be included in a structured PDF report. Avoid speculative language. Do not generate treatment or medical advice outside of recognized guidelines.
-   
-                     """
-            
-            # Generate analysis using Ollama
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt,
-                        "images": [img_str]
-                    }
-                ]
-            )
+            # Look for a re-encoded or slightly cropped copy of an earlier scan
+            image_hash = None
+            similar_to = None
+            try:
+                image_hash = dhash(image_data)
+            except Exception as e:
+                logger.warning(f"Could not compute perceptual hash: {e}")
+            if image_hash is not None:
+                match = self._find_near_duplicate(image_hash)
+                if match is not None:
+                    distance, match_key = match
+                    similar_to = {'cache_key': match_key, 'distance': distance}
+                    reuse = self.reuse_distance is not None and distance <= self.reuse_distance
+                    cached = self._get_cached_analysis(match_key) if reuse else None
+                    if cached is not None:
+                        logger.info(f"Serving near-duplicate analysis {match_key} (distance {distance})")
+                        return dict(cached, cached=True, near_duplicate=similar_to)
             
-            # Process and structure the response
-            content = response['message']['content']
-            analysis = {
-                'stage': self._extract_stage(content),
-                'observations': self._extract_observations(content),
-                'confidence': self._extract_confidence(content),
-                'raw_response': content
-            }
-
-            # Format analysis as plain text
-            analysis_text = (
-                f"Stage: {analysis['stage']}\n"
-                f"Observations: {analysis['observations']}\n"
-                f"Confidence: {analysis['confidence']}\n"
-                f"Raw Response:\n{analysis['raw_response']}"
-            )
-
-            print(analysis['observations'])
-            print("")
-
-            # Prompt for Markdown formatting
-            markdown_prompt = f"""
-            Convert the following text into a well-structured Markdown format. Include ALL of the following sections:
-            1. Analysis (including stage, observations, and confidence level)
-            2. Detailed medical explanation
-            3. Treatment recommendations or precautionary measures based on the stage
-            4. A medical disclaimer
-
-            Format it with proper Markdown headers, bullet points, and emphasis where appropriate.
-            and Give entire response in between ```markdown``` tags
-
-            {analysis_text}
-            """
-
-            # Generate markdown from analysis
-            analysis_md_response = ollama.chat(
-                model=self.model_name,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": markdown_prompt.strip()
-                    }
-                ]
-            )
+            # Resized base64 JPEG, reused if this image was prepared before
+            img_str = self.preprocessor.payload(image_data)
             
-            analysis_md = analysis_md_response['message']['content']
-            # Extract markdown content between ```markdown``` tags
-            match = re.search(r'```markdown\n([\s\S]*?)\n```', analysis_md)
-            if not match:
-                # If no markdown tags found, use the content as is
-                analysis_new_md = analysis_md
+            if self.structured_output:
+                result = self._analyze_structured(img_str, on_token)
             else:
-                analysis_new_md = match.group(1)
-            
-            print("------------------------------------------------")
-            print(analysis_new_md)
-
-            # Include markdown result in final output
-            analysis['markdown'] = analysis_new_md
-            
-            return {
-                'stage': analysis['stage'],
-                'observations': analysis['observations'],
-                'confidence': analysis['confidence'],
-                'raw_response': analysis['raw_response'],
-                'markdown': analysis_new_md
-            }
+                result = self._analyze_two_pass(img_str, on_token)
+            self._save_to_cache(cache_key, result)
+            if image_hash is not None:
+                self.phash_index.add(image_hash, cache_key)
+            if similar_to is not None:
+                # A copy: the cached dict must stay as stored, so memory and disk hits match
+                result = dict(result, near_duplicate=similar_to)
+            return result
 
         except Exception as e:
             logger.error(f"Error analyzing MRI scan: {str(e)}")
@@ -201,6 +215,149 @@ class BreastMRIAnalyzer:
             }
 
     
+    def _chat(self, messages, on_token=None, **kwargs):
+        """Call the VLM and return the reply text, streaming chunks to `on_token` if given."""
+        if on_token is None:
+            response = llm_client.chat(model=self.model_name, messages=messages, **kwargs)
+            return response['message']['content']
+
+        parts = []
+        for chunk in llm_client.chat(model=self.model_name, messages=messages, stream=True, **kwargs):
+            content = chunk['message']['content']
+            if content:
+                parts.append(content)
+                on_token(content)
+        return ''.join(parts)
+
+    def _analyze_structured(self, img_str, on_token=None):
+        """
+        Run a single schema-constrained VLM call and render the Markdown report locally.
+        The reply is raw JSON until parsed, so `on_token` only gets a fixed progress note.
+        """
+        if on_token is not None:
+            on_token("Generating the structured report...\n")
+        content = self._chat(
+            [
+                {"role": "system", "content": ANALYSIS_PROMPT + STRUCTURED_OUTPUT_INSTRUCTIONS},
+                {
+                    "role": "user",
+                    "content": IMAGE_MESSAGE,
+                    "images": [img_str]
+                }
+            ],
+            format=ANALYSIS_SCHEMA,
+            options={'temperature': 0}
+        )
+
+        try:
+            parsed = json.loads(content)
+        except ValueError:
+            logger.warning("Structured VLM output was not valid JSON; falling back to text extraction")
+            parsed = {
+                'stage': self._extract_stage(content),
+                'observations': self._extract_observations(content),
+                'confidence': self._extract_confidence(content),
+                'explanation': content,
+                'recommendations': [],
+            }
+
+        stage = str(parsed.get('stage', 'unknown')).lower()
+        if stage not in ('preliminary', 'middle', 'final'):
+            stage = 'unknown'
+        try:
+            confidence = float(parsed.get('confidence', 0.0))
+            if confidence > 1.0:
+                # Some models answer in percent despite the schema
+                confidence /= 100
+            confidence = min(max(confidence, 0.0), 1.0)
+        except (TypeError, ValueError):
+            confidence = 0.0
+        analysis = {
+            'stage': stage,
+            'observations': [str(obs).strip() for obs in parsed.get('observations') or []],
+            'confidence': confidence,
+            'explanation': str(parsed.get('explanation', '')).strip(),
+            'recommendations': [str(rec).strip() for rec in parsed.get('recommendations') or []],
+            'raw_response': content
+        }
+        analysis['markdown'] = self._render_markdown(analysis)
+        return analysis
+
+    def _analyze_two_pass(self, img_str, on_token=None):
+        """Legacy path: free-text analysis followed by a second call to format it as Markdown."""
+        content = self._chat(
+            [
+                {"role": "system", "content": ANALYSIS_PROMPT},
+                {
+                    "role": "user",
+                    "content": IMAGE_MESSAGE,
+                    "images": [img_str]
+                }
+            ],
+            on_token
+        )
+        
+        # Process and structure the response
+        analysis = {
+            'stage': self._extract_stage(content),
+            'observations': self._extract_observations(content),
+            'confidence': self._extract_confidence(content),
+            'raw_response': content
+        }
+
+        # Format analysis as plain text
+        analysis_text = (
+            f"Stage: {analysis['stage']}\n"
+            f"Observations: {analysis['observations']}\n"
+            f"Confidence: {analysis['confidence']}\n"
+            f"Raw Response:\n{analysis['raw_response']}"
+        )
+
+        # Generate markdown from analysis
+        analysis_md = self._chat(
+            [
+                {"role": "system", "content": MARKDOWN_PROMPT.strip()},
+                {
+                    "role": "user",
+                    "content": analysis_text
+                }
+            ]
+        )
+
+        # Extract markdown content between ```markdown``` tags
+        match = re.search(r'```markdown\n([\s\S]*?)\n```', analysis_md)
+        if not match:
+            # If no markdown tags found, use the content as is
+            analysis['markdown'] = analysis_md
+        else:
+            analysis['markdown'] = match.group(1)
+        return analysis
+
+    def _render_markdown(self, analysis):
+        """Deterministically render a structured analysis as a Markdown report."""
+        lines = ["# Breast MRI Scan Analysis", "", "## Analysis", ""]
+        lines.append(f"- **Stage:** {analysis['stage'].capitalize()}")
+        lines.append(f"- **Confidence:** {analysis['confidence'] * 100:.1f}%")
+        lines.append("")
+        lines.append("### Key Observations")
+        lines.append("")
+        lines.extend(f"- {obs}" for obs in analysis['observations'] or ["No specific observations reported."])
+        lines.append("")
+
+        lines.extend(["## Detailed Medical Explanation", ""])
+        lines.append(analysis['explanation'] or "No explanation provided.")
+        lines.append("")
+
+        if analysis['stage'] == 'preliminary':
+            lines.extend(["## Precautionary Measures", ""])
+        else:
+            lines.extend(["## Treatment Recommendations", ""])
+        lines.extend(f"- {rec}" for rec in analysis['recommendations'] or ["Consult an oncologist for guidance."])
+        lines.append("")
+
+        lines.extend(["## Medical Disclaimer", "", f"*{MEDICAL_DISCLAIMER}*"])
+        return "\n".join(lines)
+
     def _extract_stage(self, response_text):
         """Extract the cancer stage from the model response."""
         stages = ['preliminary', 'middle', 'final']
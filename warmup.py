@@ -0,0 +1,90 @@
+import logging
+import os
+import threading
+import time
+
+# Get the logger for this module
+logger = logging.getLogger(__name__)
+
+# Run the warm-up steps in a background thread when the app starts
+WARMUP_ON_START = os.environ.get('WARMUP_ON_START', '1') == '1'
+# Seconds between retries of failed steps, e.g. while the Ollama server is still starting
+WARMUP_RETRY_INTERVAL = float(os.environ.get('WARMUP_RETRY_INTERVAL', 30))
+
+
+class Warmup:
+    """
+    Runs named startup steps (deferred imports, model loads) once, in order, on a
+    daemon thread, and reports their progress for the health endpoint. Failed steps
+    are retried every `retry_interval` seconds until they succeed.
+
+    `started` is the perf_counter value the process start is measured from, so
+    time-to-ready includes the application's own import time.
+    """
+
+    def __init__(self, steps, started=None, retry_interval=WARMUP_RETRY_INTERVAL):
+        self.steps = list(steps)
+        self.started = started if started is not None else time.perf_counter()
+        self.retry_interval = retry_interval
+        self.ready_after = None
+        self._state = {name: {'state': 'pending', 'seconds': None, 'error': None} for name, _ in self.steps}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the warm-up thread; further calls are no-ops."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='warmup', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        pending = self.steps
+        while pending:
+            pending = [step for step in pending if not self._run_step(*step)]
+            if pending:
+                logger.warning(f"Warm-up steps failed: {', '.join(name for name, _ in pending)}; "
+                               f"retrying in {self.retry_interval:g}s")
+                time.sleep(self.retry_interval)
+        with self._lock:
+            self.ready_after = time.perf_counter() - self.started
+        logger.info(f"Ready {self.ready_after:.2f}s after start")
+
+    def _run_step(self, name, step):
+        with self._lock:
+            self._state[name].update(state='running', error=None)
+        began = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            with self._lock:
+                self._state[name].update(state='failed', seconds=time.perf_counter() - began, error=str(e))
+            return False
+        seconds = time.perf_counter() - began
+        with self._lock:
+            self._state[name].update(state='ready', seconds=seconds)
+        logger.info(f"Warm-up step {name} done in {seconds:.2f}s")
+        return True
+
+    @property
+    def ready(self):
+        return self.ready_after is not None
+
+    def status(self):
+        """Overall state ('ready', 'starting' or 'degraded' when a step failed) and per-step timings."""
+        with self._lock:
+            steps = {name: dict(state) for name, state in self._state.items()}
+            ready_after = self.ready_after
+        if ready_after is not None:
+            status = 'ready'
+        elif any(state['state'] == 'failed' for state in steps.values()):
+            status = 'degraded'
+        else:
+            status = 'starting'
+        return {
+            'status': status,
+            'uptime': time.perf_counter() - self.started,
+            'time_to_ready': ready_after,
+            'steps': steps,
+        }